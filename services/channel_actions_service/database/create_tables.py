@@ -1,12 +1,23 @@
+from sqlalchemy import text
+
 from .base import _Base
 from .session import engine
 
+# Колонки, добавленные в существующие таблицы после их создания:
+# create_all не изменяет существующие таблицы, поэтому они добавляются
+# отдельно (выражения идемпотентны и выполняются при каждом запуске)
+MIGRATIONS = [
+    "ALTER TABLE videos_info ADD COLUMN IF NOT EXISTS is_playable BOOLEAN NOT NULL DEFAULT false",
+    "ALTER TABLE videos_info ADD COLUMN IF NOT EXISTS duration DOUBLE PRECISION",
+]
+
 
 async def create_tables() -> None:
     """
     Асинхронная функция для создания таблиц в базе данных.
     
-    Выполняет создание всех таблиц, определенных в метаданных SQLAlchemy.
+    Выполняет создание всех таблиц, определенных в метаданных SQLAlchemy,
+    и добавляет в существующие таблицы новые колонки (MIGRATIONS).
     Используется при инициализации приложения для подготовки БД.
     
     :return: None
@@ -15,8 +26,10 @@ async def create_tables() -> None:
     **Примечания:**
     
     - Создает только отсутствующие таблицы
-    - Не выполняет миграции существующих таблиц
+    - Новые колонки существующих таблиц добавляются выражениями из MIGRATIONS
     - Использует асинхронное подключение к базе данных
     """
     async with engine.begin() as conn:
         await conn.run_sync(_Base.metadata.create_all)
+        for statement in MIGRATIONS:
+            await conn.execute(text(statement))
@@ -1,4 +1,4 @@
-from sqlalchemy import BIGINT, String, Column, TIMESTAMP, Boolean, UUID
+from sqlalchemy import BIGINT, String, Column, TIMESTAMP, Boolean, UUID, Float
 from sqlalchemy.sql import func
 
 from .base import _Base
@@ -10,7 +10,9 @@ class VideoInfo(_Base):
     uuid = Column(UUID(as_uuid=True), primary_key=True, index=True, name='uuid')
     author_id = Column(BIGINT, nullable=False, index=True, name='author_id')
     created_at = Column(TIMESTAMP, nullable=False, server_default=func.now(), name='created_at')
+    is_playable = Column(Boolean, nullable=False, server_default='0', name='is_playable')
     is_complete = Column(Boolean, nullable=False, server_default='0', name='is_complete')
+    duration = Column(Float, nullable=True, name='duration')
     likes_count = Column(BIGINT, nullable=False, server_default='0', name='likes_count')
     dislikes_count = Column(BIGINT, nullable=False, server_default='0', name='dislikes_count')
     views_count = Column(BIGINT, nullable=False, server_default='0', name='views_count')
@@ -21,7 +23,9 @@ class VideoInfo(_Base):
             'uuid': str(self.uuid),
             'author_id': self.author_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
+            'is_playable': self.is_playable or self.is_complete,
             'is_complete': self.is_complete,
+            'duration': self.duration,
             'likes_count': self.likes_count,
             'dislikes_count': self.dislikes_count,
             'views_count': self.views_count
@@ -5,7 +5,7 @@ from fastapi import Query, HTTPException
 
 from .router import router
 
-from sqlalchemy import select, func
+from sqlalchemy import select, func, or_
 
 from database.video_info import VideoInfo
 from database.session import async_session
@@ -18,7 +18,8 @@ async def get_author_videos(author_id: int, offset: conint(ge=0) = 0,
     Получение списка видео конкретного автора с пагинацией.
     
     .. note::
-        Возвращает только полностью обработанные видео (is_complete = True)
+        Возвращает только видео, доступные для просмотра (is_playable = True;
+        видео, обработанные до появления is_playable, отмечены только is_complete)
     
     :param author_id: ID автора для фильтрации видео
     :type author_id: int
@@ -33,7 +34,8 @@ async def get_author_videos(author_id: int, offset: conint(ge=0) = 0,
     async with async_session() as session:
         # Выполняем запрос к БД с фильтрацией по автору и статусу обработки
         result = await session.execute(
-            select(VideoInfo).where(VideoInfo.author_id == author_id, VideoInfo.is_complete == True).limit(
+            select(VideoInfo).where(VideoInfo.author_id == author_id,
+                                    or_(VideoInfo.is_playable == True, VideoInfo.is_complete == True)).limit(
                 count).offset(offset)
         )
         result = result.scalars().all()
@@ -44,7 +46,7 @@ async def get_author_videos(author_id: int, offset: conint(ge=0) = 0,
 @router.get('/videos/batch')
 async def get_author_videos(offset: conint(ge=0) = 0, count: conint(ge=1, le=20) = 20) -> ORJSONResponse:
     """
-    Получение батча обработанных видео с пагинацией.
+    Получение батча доступных для просмотра видео с пагинацией.
 
     :param offset: Смещение для пагинации (по умолчанию 0)
     :type offset: int
@@ -55,7 +57,8 @@ async def get_author_videos(offset: conint(ge=0) = 0, count: conint(ge=1, le=20)
     """
     async with async_session() as session:
         result = await session.execute(
-            select(VideoInfo).where(VideoInfo.is_complete == True).limit(count).offset(offset)
+            select(VideoInfo).where(or_(VideoInfo.is_playable == True, VideoInfo.is_complete == True)).limit(
+                count).offset(offset)
         )
         result = result.scalars().all()
         return ORJSONResponse({'msg': 'Видео успешно выбраны',
@@ -68,7 +71,10 @@ async def get_author_videos(uuid: UUID4) -> ORJSONResponse:
     Получение детальной информации о конкретном видео по UUID.
     
     .. note::
-        Возвращает 503 ошибку если видео еще не обработано
+        Возвращает 503 ошибку если видео еще нельзя смотреть (не опубликовано
+        ни одно разрешение). Пока конвертируются остальные разрешения,
+        is_complete = False. Видео, обработанные до появления is_playable,
+        доступны по is_complete.
     
     :param uuid: UUID видео для поиска
     :type uuid: UUID4
@@ -80,9 +86,10 @@ async def get_author_videos(uuid: UUID4) -> ORJSONResponse:
         result = await session.execute(
             select(VideoInfo).where(VideoInfo.uuid == uuid))
         result: VideoInfo = result.scalars().first()
-        if not result.is_complete:
+        if not (result.is_playable or result.is_complete):
             return ORJSONResponse({"msg": "Видео не обработано"}, status_code=503)
         result_info = {"uuid": str(result.uuid), "author_id": result.author_id, "created_at": result.created_at,
+                       "is_complete": result.is_complete, "duration": result.duration,
                        "likes_count": result.likes_count, "dislikes_count": result.dislikes_count,
                        "views_count": result.views_count}
         return ORJSONResponse({'msg': 'Видео успешно выбраны',
@@ -1,8 +1,9 @@
+import time
 import uuid
 
 import orjson
 
-from sqlalchemy import update
+from sqlalchemy import func, select, update
 from faststream.rabbit import RabbitQueue
 
 from .router import router
@@ -45,38 +46,53 @@ async def handle_unprocessed_video_uploaded(info: UnprocessedVideoUploaded) -> b
     
     1. Создает новый UUID для видео
     2. Сохраняет запись о видео в базу данных
-    3. Отправляет сообщение в очередь конвертации
+    3. Отправляет сообщение в очередь конвертации с популярностью канала
+       (суммарные просмотры видео автора) - по ней сервис постобработки
+       решает, кодировать ли дополнительные кодеки
     """
     video_uuid = uuid.uuid4()
     
     async with async_session() as session:
+        popularity = await session.scalar(
+            select(func.coalesce(func.sum(VideoInfo.views_count), 0)).where(VideoInfo.author_id == info.user_id)
+        )
         video_info_db = VideoInfo(uuid=video_uuid, author_id=info.user_id)
         session.add(video_info_db)
         await session.commit()
 
-    return orjson.dumps({"video_path": info.video_path, "uuid": video_uuid})
+    # published_at - для метрики времени ожидания в очереди конвертации
+    return orjson.dumps({"video_path": info.video_path, "uuid": video_uuid, "published_at": time.time(),
+                         "popularity": int(popularity or 0)})
 
 
 @router.subscriber(confirm_video_hls_converting_queue, retry=True)
 async def confirm_video_hls_converting(info: ConfirmVideoHlsConverting):
     """
-    Обработчик подтверждения успешной конвертации видео в HLS формат.
+    Обработчик подтверждения конвертации видео в HLS формат.
     
     :param info: Данные о конвертированном видео
     :type info: ConfirmVideoHlsConverting
     
     **Процесс обработки:**
     
-    1. Обновляет статус видео в базе данных на "обработано"
-    2. Устанавливает флаг is_complete = True
+    1. При статусе "playable" устанавливает флаг is_playable = True
+    2. При статусе "complete" устанавливает флаги is_playable = True и is_complete = True
+    3. Сохраняет длительность видео из media_info, если она известна
     
     **Примечания:**
     
-    - После выполнения этой функции видео становится доступным для просмотра
+    - После первого подтверждения видео становится доступным для просмотра
+    - Запоздавшее "playable" не сбрасывает уже установленный is_complete
     - Обработчик автоматически повторяет попытку при ошибках (retry=True)
     """
+    values = {"is_playable": True}
+    if info.status == "complete":
+        values["is_complete"] = True
+    if info.media_info and info.media_info.duration is not None:
+        values["duration"] = info.media_info.duration
+    
     async with async_session() as session:
         await session.execute(
-            update(VideoInfo).where(VideoInfo.uuid == info.uuid).values(is_complete=True)
+            update(VideoInfo).where(VideoInfo.uuid == info.uuid).values(**values)
         )
         await session.commit()
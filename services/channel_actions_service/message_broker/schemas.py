@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel, UUID4
 
 
@@ -12,11 +14,30 @@ class UnprocessedVideoUploaded(BaseModel):
     video_path: str
 
 
+class VideoMediaInfo(BaseModel):
+    """
+    Параметры исходного видео, определенные сервисом постобработки.
+    
+    Размеры указаны с учетом поворота (как видео показывается зрителю).
+    Неизвестные поля игнорируются.
+    """
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+    frame_rate: float | None = None
+    has_audio: bool | None = None
+
+
 class ConfirmVideoHlsConverting(BaseModel):
     """
     Модель данных для подтверждения успешной конвертации видео в HLS.
     
-    Содержит UUID видео, которое было успешно сконвертировано.
+    Содержит UUID видео и стадию конвертации:
+    - playable: опубликовано минимальное разрешение, видео можно смотреть
+    - complete: опубликованы все разрешения
+    и параметры исходного видео (media_info).
     Используется для обновления статуса видео в базе данных.
     """
     uuid: UUID4
+    status: Literal['playable', 'complete'] = 'complete'
+    media_info: VideoMediaInfo | None = None
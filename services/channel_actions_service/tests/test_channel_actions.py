@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 from unittest.mock import AsyncMock, patch, MagicMock
@@ -23,6 +24,8 @@ os.environ['RABBITMQ_PORT'] = '5672'
 import unittest
 from fastapi.testclient import TestClient
 from main import app
+from database.create_tables import create_tables
+from message_broker.schemas import ConfirmVideoHlsConverting
 
 
 class TestVideoEndpoints(unittest.TestCase):
@@ -52,5 +55,69 @@ class TestVideoEndpoints(unittest.TestCase):
             
             self.assertEqual(response.status_code, 404)
 
+    def test_video_processed_before_is_playable_is_available(self):
+        """Тест: видео, обработанное до появления is_playable (только is_complete), доступно для просмотра"""
+        video_uuid = uuid4()
+        with patch('get_info.videos.async_session') as mock_session:
+            mock_session_ctx = AsyncMock()
+            mock_session.return_value = mock_session_ctx
+
+            mock_execute = AsyncMock()
+            mock_session_ctx.__aenter__.return_value.execute = mock_execute
+
+            mock_video = MagicMock(uuid=video_uuid, author_id=1, created_at=None, is_playable=False,
+                                   is_complete=True, duration=None, likes_count=0, dislikes_count=0,
+                                   views_count=0)
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.first.return_value = mock_video
+            mock_execute.return_value = mock_result
+
+            response = self.client.get(f"/channel_actions/video/?uuid={video_uuid}")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()["video_info"]["is_complete"])
+
+
+class TestConfirmVideoHlsConvertingSchema(unittest.TestCase):
+    """Тесты схемы подтверждения конвертации"""
+
+    def test_status_defaults_to_complete(self):
+        """Тест: сообщение без статуса считается подтверждением полной конвертации"""
+        info = ConfirmVideoHlsConverting(uuid=uuid4())
+        self.assertEqual(info.status, "complete")
+
+    def test_media_info_parsed(self):
+        """Тест: параметры видео из сообщения разбираются, лишние поля игнорируются"""
+        info = ConfirmVideoHlsConverting(uuid=uuid4(), media_info={"duration": 12.5, "width": 1080,
+                                                                   "height": 1920, "video_codec": "h264"})
+        self.assertEqual(info.media_info.duration, 12.5)
+        self.assertEqual((info.media_info.width, info.media_info.height), (1080, 1920))
+
+    def test_invalid_status_rejected(self):
+        """Тест: неизвестный статус не проходит валидацию"""
+        with self.assertRaises(Exception):
+            ConfirmVideoHlsConverting(uuid=uuid4(), status="unknown")
+
+
+
+class TestCreateTables(unittest.TestCase):
+    """Тесты подготовки схемы БД"""
+
+    def test_new_columns_added_to_existing_tables(self):
+        """Тест: после create_all в существующую таблицу добавляются новые колонки"""
+        conn = AsyncMock()
+        engine = MagicMock()
+        engine.begin.return_value.__aenter__.return_value = conn
+
+        with patch('database.create_tables.engine', engine):
+            asyncio.run(create_tables())
+
+        conn.run_sync.assert_awaited_once()
+        statements = [str(call.args[0]) for call in conn.execute.await_args_list]
+        self.assertIn("ALTER TABLE videos_info ADD COLUMN IF NOT EXISTS is_playable BOOLEAN NOT NULL DEFAULT false",
+                      statements)
+        self.assertIn("ALTER TABLE videos_info ADD COLUMN IF NOT EXISTS duration DOUBLE PRECISION", statements)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,426 @@
+"""
+Бенчмарк полного конвейера обработки видео.
+
+Прогоняет process_message на детерминированных синтетических исходниках
+(lavfi testsrc2 + sine, несколько разрешений и длительностей) против
+локального S3 (moto server в отдельном процессе или уже запущенный MinIO)
+и брокера в памяти. Для каждого исходника измеряет длительность этапов
+задачи и кодирования рендишенов, процессорное время (процесс и FFmpeg),
+пиковый RSS дерева процессов, пиковый объем временного каталога и объем
+выгруженного результата. Отчет пишется в JSON и может сравниваться
+с сохраненным базовым отчетом: при ухудшении метрики больше допуска
+бенчмарк завершается с кодом 1.
+
+Конфигурация обработки берется из окружения (VIDEO_*), распределенное
+кодирование и дедупликация исходников отключаются (повторы одного
+исходника иначе копировали бы результат первого прогона).
+Нужны ffmpeg/ffprobe и moto[server].
+
+Запуск из каталога сервиса:
+
+    python3 benchmarks/bench_pipeline.py --cases 640x360:10,1280x720:10 --output bench.json
+    python3 benchmarks/bench_pipeline.py --baseline bench.json --max-regression 0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for name, value in {
+    'DEBUG_MODE': 'False',
+    'VIDEO_POSTPROCESS_WORKERS': '1',
+    'RABBITMQ_DEFAULT_USER': 'benchmark',
+    'RABBITMQ_DEFAULT_PASS': 'benchmark',
+    'MINIO_SERVER_URL': 'localhost:9000',
+    'MINIO_ROOT_USER': 'benchmark',
+    'MINIO_ROOT_PASSWORD': 'benchmark',
+}.items():
+    os.environ.setdefault(name, value)
+
+from config import RABBITMQ_SETTINGS, MINIO_SETTINGS, TRANSCODE_SETTINGS, JOB_SETTINGS, \
+    DISTRIBUTED_SETTINGS, RETRY_SETTINGS
+from services.jobs import JobState
+from services.metrics import STAGE_SECONDS, ENCODE_SECONDS
+from services.s3 import S3Metrics, S3Service
+from services.video_processor import VideoProcessor
+
+# Метрики, которые сравниваются с базовым отчетом (больше - хуже)
+COMPARED_METRICS = ('wall_seconds', 'cpu_seconds', 'peak_rss_bytes', 'peak_temp_bytes', 'output_bytes')
+
+# Период опроса RSS и временного каталога, секунды
+SAMPLE_INTERVAL = 0.1
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def generate_source(path: str, size: str, duration: int):
+    """
+    Генерация синтетического исходника testsrc2 + sine.
+
+    Кодирование в один поток с bitexact дает побайтно одинаковый файл
+    при одинаковой версии FFmpeg, поэтому исходники можно кешировать.
+    """
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-pix_fmt', 'yuv420p', '-c:v', 'libx264', '-preset', 'ultrafast', '-threads', '1',
+        '-c:a', 'aac', '-shortest', '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+        path
+    ], check=True)
+
+
+class InMemoryBroker:
+    """Брокер в памяти: вместо канала RabbitMQ запоминает опубликованные сообщения."""
+
+    def __init__(self):
+        self.default_exchange = self
+        self.published: list[tuple[str, dict]] = []
+
+    async def publish(self, message, routing_key: str):
+        self.published.append((routing_key, json.loads(message.body)))
+
+
+class BenchmarkMessage:
+    """Входящее сообщение задачи с результатом подтверждения."""
+
+    def __init__(self, data: dict):
+        self.body = json.dumps(data).encode()
+        self.headers = {}
+        self.content_type = 'application/json'
+        self.message_id = data['uuid']
+        self.timestamp = datetime.now(timezone.utc)
+        self.outcome = None
+
+    async def ack(self):
+        self.outcome = 'ack'
+
+    async def nack(self, requeue: bool = True):
+        self.outcome = 'nack'
+
+
+def process_tree_rss(root_pid: int, exclude: set[int]) -> int:
+    """Суммарный RSS процесса и его потомков (кроме exclude), байты."""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat_file:
+                # поле 4 после имени процесса в скобках - ppid
+                parents[int(entry)] = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree, frontier = {root_pid}, [root_pid]
+    while frontier:
+        parent = frontier.pop()
+        for pid, ppid in parents.items():
+            if ppid == parent and pid not in tree and pid not in exclude:
+                tree.add(pid)
+                frontier.append(pid)
+    rss = 0
+    for pid in tree:
+        try:
+            with open(f'/proc/{pid}/statm') as statm_file:
+                rss += int(statm_file.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+    return rss
+
+
+def directory_size(path: str) -> int:
+    """Объем файлов в каталоге, байты."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
+
+
+def histogram_sums(histogram) -> dict[str, float]:
+    """Суммы наблюдений гистограммы Prometheus по значениям меток."""
+    return {
+        '/'.join(sample.labels.values()): sample.value
+        for metric in histogram.collect() for sample in metric.samples if sample.name.endswith('_sum')
+    }
+
+
+def histogram_delta(before: dict[str, float], after: dict[str, float]) -> dict[str, float]:
+    return {
+        labels: round(value - before.get(labels, 0.0), 3)
+        for labels, value in sorted(after.items()) if value - before.get(labels, 0.0) > 0
+    }
+
+
+class StageTimeline:
+    """Длительность этапов задачи по переходам JobState.set_stage."""
+
+    def __init__(self, video_uuid: str):
+        self.video_uuid = video_uuid
+        self.stages: dict[str, float] = {}
+        self._stage = None
+        self._stage_started = None
+        self._set_stage = None
+
+    def __enter__(self) -> 'StageTimeline':
+        self._set_stage = JobState.set_stage
+        timeline = self
+
+        def set_stage(job: JobState, stage: str):
+            timeline._set_stage(job, stage)
+            if job.uuid == timeline.video_uuid:
+                timeline.switch(stage)
+
+        JobState.set_stage = set_stage
+        # Задача создается в этапе waiting (ожидание аренды), без вызова set_stage
+        self.switch('waiting')
+        return self
+
+    def __exit__(self, *exc_info):
+        JobState.set_stage = self._set_stage
+        self.switch(None)
+
+    def switch(self, stage: str | None):
+        now = time.perf_counter()
+        if self._stage is not None and self._stage not in ('done', 'failed'):
+            self.stages[self._stage] = round(self.stages.get(self._stage, 0.0) + now - self._stage_started, 3)
+        self._stage, self._stage_started = stage, now
+
+
+class Sampler:
+    """Фоновый опрос RSS и объема временного каталога во время прогона."""
+
+    def __init__(self, temp_dir: str, exclude: set[int]):
+        self.temp_dir = temp_dir
+        self.exclude = exclude
+        self.peak_rss = 0
+        self.peak_temp = 0
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, process_tree_rss(os.getpid(), self.exclude))
+        self.peak_temp = max(self.peak_temp, directory_size(self.temp_dir))
+
+
+class LocalS3:
+    """moto server в отдельном процессе (его CPU и память не попадают в замеры)."""
+
+    def __init__(self):
+        self.process = None
+        self.endpoint = None
+
+    def start(self) -> str:
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.endpoint = f'http://127.0.0.1:{port}'
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return self.endpoint
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError('moto server did not start')
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+
+
+async def output_stats(s3_service: S3Service, prefix: str) -> tuple[int, int]:
+    """Количество и объем объектов результата в S3."""
+    objects, total = 0, 0
+    paginator = s3_service.client.get_paginator('list_objects_v2')
+    async for page in paginator.paginate(Bucket=s3_service.config.bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            objects += 1
+            total += item['Size']
+    return objects, total
+
+
+def cpu_seconds() -> float:
+    """Процессорное время процесса и завершившихся дочерних процессов (FFmpeg/ffprobe)."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+async def run_case(processor: VideoProcessor, source: str, case: str, run: int, work_dir: str,
+                   exclude: set[int]) -> dict:
+    """Один прогон process_message на исходнике."""
+    video_uuid = f'bench-{case}-{run}-{int(time.time())}'
+    video_path = f'uploads/{video_uuid}/{os.path.basename(source)}'
+    await processor.s3_service.upload_file(source, video_path)
+    processor.s3_service.metrics = S3Metrics()
+    broker = InMemoryBroker()
+    processor.channel = processor.retry.channel = broker
+
+    message = BenchmarkMessage({'uuid': video_uuid, 'video_path': video_path})
+    sampler = Sampler(work_dir, exclude)
+    stage_before, encode_before = histogram_sums(STAGE_SECONDS), histogram_sums(ENCODE_SECONDS)
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+    sampling = asyncio.create_task(sampler.run())
+    try:
+        with StageTimeline(video_uuid) as timeline:
+            await processor.process_message(message)
+    finally:
+        sampling.cancel()
+        await asyncio.gather(sampling, return_exceptions=True)
+    wall = time.perf_counter() - started
+    cpu = cpu_seconds() - cpu_before
+    sampler.sample()
+
+    job = processor.job_registry.get(video_uuid)
+    if message.outcome != 'ack' or job.stage != 'done':
+        raise RuntimeError(f'{case}: job failed at {job.stage}: {job.error}')
+    objects, output_bytes = await output_stats(processor.s3_service, f'video_files/{video_uuid}/')
+    return {
+        'wall_seconds': round(wall, 3),
+        'cpu_seconds': round(cpu, 3),
+        'peak_rss_bytes': sampler.peak_rss,
+        'peak_temp_bytes': sampler.peak_temp,
+        'output_bytes': output_bytes,
+        'output_objects': objects,
+        'stages': timeline.stages,
+        'stage_seconds': histogram_delta(stage_before, histogram_sums(STAGE_SECONDS)),
+        'encode_seconds': histogram_delta(encode_before, histogram_sums(ENCODE_SECONDS)),
+        's3': processor.s3_service.metrics.snapshot(),
+        'published': [routing_key for routing_key, _ in broker.published],
+    }
+
+
+def best_run(runs: list[dict]) -> dict:
+    """Лучший прогон по времени; сравниваемые метрики - минимум по повторам."""
+    best = dict(min(runs, key=lambda result: result['wall_seconds']))
+    for metric in COMPARED_METRICS:
+        best[metric] = min(result[metric] for result in runs)
+    best['runs'] = len(runs)
+    return best
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Сравнение с базовым отчетом; возвращает описания ухудшений."""
+    if baseline.get('config') != report['config']:
+        print('warning: baseline was recorded with a different configuration')
+    regressions = []
+    for case, result in report['cases'].items():
+        reference = baseline.get('cases', {}).get(case)
+        if reference is None:
+            print(f'{case}: no baseline')
+            continue
+        for metric in COMPARED_METRICS:
+            current, previous = result[metric], reference.get(metric)
+            if not previous:
+                continue
+            change = current / previous - 1
+            line = f'{case:<14} {metric:<16} {previous:>14} -> {current:>14} ({change:+.1%})'
+            if change > max_regression:
+                regressions.append(line)
+                line += '  REGRESSION'
+            print(line)
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    cases = [case.split(':') for case in args.cases.split(',')]
+    distributed_config = DISTRIBUTED_SETTINGS.model_copy(update={'enabled': False})
+    transcode_config = TRANSCODE_SETTINGS.model_copy(update={'dedup_enabled': False})
+    local_s3 = None
+    endpoint = args.s3_endpoint
+    if endpoint is None:
+        local_s3 = LocalS3()
+        endpoint = local_s3.start()
+    minio_config = MINIO_SETTINGS.model_copy(update={'endpoint': endpoint, 'bucket': args.bucket})
+
+    processor = VideoProcessor(RABBITMQ_SETTINGS, minio_config, transcode_config, JOB_SETTINGS,
+                               distributed_config, RETRY_SETTINGS)
+    processor.s3_service = S3Service(minio_config)
+    await processor.s3_service.connect()
+
+    report = {
+        'config': {
+            'transcode': transcode_config.model_dump(mode='json'),
+            'max_concurrent_jobs': JOB_SETTINGS.max_concurrent_jobs,
+            'ffmpeg': subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
+                .stdout.split('\n', 1)[0],
+        },
+        'cases': {},
+    }
+    exclude = {local_s3.process.pid} if local_s3 else set()
+    try:
+        sources_dir = args.sources_dir or tempfile.mkdtemp(prefix='bench-sources-')
+        os.makedirs(sources_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix='bench-pipeline-') as work_dir:
+            # Временные каталоги задач создаются внутри work_dir
+            tempfile.tempdir = work_dir
+            for size, duration in cases:
+                case = f'{size}x{duration}s'
+                source = os.path.join(sources_dir, f'{case}.mp4')
+                if not os.path.exists(source):
+                    generate_source(source, size, int(duration))
+                runs = []
+                for run in range(args.repeat):
+                    result = await run_case(processor, source, case, run, work_dir, exclude)
+                    print(f"{case}: run {run}: {result['wall_seconds']:.2f}s wall, "
+                          f"{result['cpu_seconds']:.2f}s cpu, stages {result['stages']}", file=sys.stderr)
+                    runs.append(result)
+                report['cases'][case] = best_run(runs)
+    finally:
+        tempfile.tempdir = None
+        await processor.s3_service.close()
+        if local_s3:
+            local_s3.stop()
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.max_regression)
+        if regressions:
+            print(f'{len(regressions)} metrics regressed more than {args.max_regression:.0%}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default='640x360:10,1280x720:10,1920x1080:30',
+                        help='Исходники через запятую: WxH:секунды')
+    parser.add_argument('--repeat', type=int, default=1, help='Количество повторов, берется лучший результат')
+    parser.add_argument('--sources-dir', help='Каталог кеша сгенерированных исходников')
+    parser.add_argument('--s3-endpoint', help='Уже запущенный S3/MinIO вместо moto server')
+    parser.add_argument('--bucket', default='bench', help='Bucket для прогонов')
+    parser.add_argument('--output', help='Файл JSON-отчета (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='Базовый JSON-отчет для сравнения')
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help='Допустимое ухудшение метрики относительно базового отчета (доля)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,106 @@
+"""
+Бенчмарк параллельного кодирования рендишенов.
+
+Сравнивает время кодирования лестницы разрешений последовательным циклом
+convert_to_hls и планировщиком RenditionScheduler на синтетическом
+исходнике, сгенерированном через lavfi. MinIO и RabbitMQ не нужны.
+
+Запуск из каталога сервиса:
+
+    python3 benchmarks/bench_rendition_scheduler.py --size 1920x1080 --duration 20 --cpu-budget 8
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for name, value in {
+    'DEBUG_MODE': 'False',
+    'VIDEO_POSTPROCESS_WORKERS': '1',
+    'RABBITMQ_DEFAULT_USER': 'benchmark',
+    'RABBITMQ_DEFAULT_PASS': 'benchmark',
+    'MINIO_SERVER_URL': 'localhost:9000',
+    'MINIO_ROOT_USER': 'benchmark',
+    'MINIO_ROOT_PASSWORD': 'benchmark',
+}.items():
+    os.environ.setdefault(name, value)
+
+from config import RABBITMQ_SETTINGS, MINIO_SETTINGS, TRANSCODE_SETTINGS, JOB_SETTINGS, \
+    DISTRIBUTED_SETTINGS, RETRY_SETTINGS
+from services.video_processor import VideoProcessor, RenditionScheduler
+
+
+def generate_source(path: str, size: str, duration: int):
+    """Генерация синтетического исходника testsrc2 + sine."""
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-pix_fmt', 'yuv420p', '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest',
+        path
+    ], check=True)
+
+
+async def run_sequential(processor: VideoProcessor, input_file: str, resolutions: list, output_dir: str) -> float:
+    """Текущий последовательный цикл по рендишенам."""
+    started = time.perf_counter()
+    for resolution in resolutions:
+        await processor.convert_to_hls(input_file, 'bench', resolution, output_dir)
+    return time.perf_counter() - started
+
+
+async def run_scheduled(processor: VideoProcessor, input_file: str, resolutions: list, output_dir: str,
+                        cpu_budget: int) -> float:
+    """Параллельное кодирование через RenditionScheduler."""
+    started = time.perf_counter()
+    await RenditionScheduler(cpu_budget).run(
+        resolutions,
+        lambda resolution, threads: processor.convert_to_hls(input_file, 'bench', resolution, output_dir, threads)
+    )
+    return time.perf_counter() - started
+
+
+async def main(args: argparse.Namespace):
+    processor = VideoProcessor(RABBITMQ_SETTINGS, MINIO_SETTINGS, TRANSCODE_SETTINGS, JOB_SETTINGS,
+                               DISTRIBUTED_SETTINGS, RETRY_SETTINGS)
+    width, height = (int(part) for part in args.size.split('x'))
+    resolutions = processor.select_resolutions(width, height)
+
+    with tempfile.TemporaryDirectory(prefix='bench-scheduler-') as temp_dir:
+        input_file = os.path.join(temp_dir, 'source.mp4')
+        generate_source(input_file, args.size, args.duration)
+
+        allocation = RenditionScheduler(args.cpu_budget).allocate_threads(resolutions)
+        print(f"Source: {args.size}, {args.duration}s; ladder: {resolutions}")
+        print(f"Thread allocation (budget {args.cpu_budget}): {allocation}")
+
+        sequential, scheduled = [], []
+        for run in range(args.repeat):
+            for results, runner in ((sequential, 'sequential'), (scheduled, 'scheduled')):
+                output_dir = os.path.join(temp_dir, f'{runner}-{run}')
+                os.makedirs(output_dir)
+                if runner == 'sequential':
+                    elapsed = await run_sequential(processor, input_file, resolutions, output_dir)
+                else:
+                    elapsed = await run_scheduled(processor, input_file, resolutions, output_dir, args.cpu_budget)
+                results.append(elapsed)
+                print(f"run {run}: {runner:<10} {elapsed:8.2f}s")
+
+    best_sequential, best_scheduled = min(sequential), min(scheduled)
+    print(f"sequential: {best_sequential:.2f}s, scheduled: {best_scheduled:.2f}s, "
+          f"speedup: {best_sequential / best_scheduled:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='1920x1080', help='Разрешение исходника WxH')
+    parser.add_argument('--duration', type=int, default=20, help='Длительность исходника, секунды')
+    parser.add_argument('--cpu-budget', type=int, default=TRANSCODE_SETTINGS.cpu_budget,
+                        help='Бюджет ядер для планировщика')
+    parser.add_argument('--repeat', type=int, default=1, help='Количество повторов, берется лучший результат')
+    asyncio.run(main(parser.parse_args()))
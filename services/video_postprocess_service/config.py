@@ -1,4 +1,7 @@
-from pydantic import Field
+import os
+from typing import Literal
+
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 
 
@@ -46,6 +49,20 @@ class MinIOSettings(BaseSettings):
     
     Содержит параметры для доступа к объектному хранилищу.
     Используется для загрузки и выгрузки видео файлов.
+    
+    Параметры передачи:
+    - max_pool_connections: размер пула HTTP-соединений клиента
+    - max_concurrency: максимум одновременных запросов к хранилищу
+    - multipart_threshold: размер файла, начиная с которого используется multipart-загрузка
+    - multipart_chunksize: размер части multipart-загрузки (и буфера скачивания)
+    - multipart_concurrency: сколько частей одного файла отправляется параллельно
+    
+    Кеширование (заголовок Cache-Control объектов video_files/, его отдает
+    nginx через прокси к MinIO):
+    - segment_cache_control: сегменты и init-файлы - имена уникальны
+      и содержимое не меняется, поэтому кешируются надолго как immutable
+    - playlist_cache_control: медиаплейлисты и мастер-плейлист -
+      перезаписываются по мере кодирования, поэтому короткий TTL
     """
     bucket: str = Field(default='files', alias='S3_BUCKET')
     region: str = Field(default='us-east-1', alias='S3_REGION')
@@ -53,6 +70,14 @@ class MinIOSettings(BaseSettings):
     access_key: str = Field(alias='MINIO_ROOT_USER')
     secret_key: str = Field(alias='MINIO_ROOT_PASSWORD')
     timeout: int = Field(default=30, alias='MINIO_STALE_UPLOADS_EXPIRY')
+    max_pool_connections: int = Field(default=32, alias='S3_MAX_POOL_CONNECTIONS')
+    max_concurrency: int = Field(default=16, alias='S3_MAX_CONCURRENCY')
+    multipart_threshold: int = Field(default=64 * 1024 * 1024, alias='S3_MULTIPART_THRESHOLD')
+    multipart_chunksize: int = Field(default=16 * 1024 * 1024, alias='S3_MULTIPART_CHUNKSIZE')
+    multipart_concurrency: int = Field(default=4, alias='S3_MULTIPART_CONCURRENCY')
+    segment_cache_control: str = Field(default='public, max-age=31536000, immutable',
+                                       alias='S3_SEGMENT_CACHE_CONTROL')
+    playlist_cache_control: str = Field(default='public, max-age=2', alias='S3_PLAYLIST_CACHE_CONTROL')
 
     @property
     def endpoint_url(self) -> str:
@@ -82,8 +107,245 @@ class ServerSettings(BaseSettings):
     port: int = Field(default=8090, alias='SERVER_PORT')
 
 
+class LadderRung(BaseModel):
+    """
+    Ступень лестницы кодирования.
+    
+    - width/height: разрешение (для вертикального видео стороны меняются местами)
+    - profile/level: профиль и уровень H.264 (определяют и CODECS в мастер-плейлисте)
+    - crf: качество x264; при заданном maxrate - CRF с ограничением битрейта
+      через VBV (maxrate/bufsize, бит/с), maxrate же объявляется в BANDWIDTH
+      мастер-плейлиста, пока битрейт рендишена не измерен
+    - gop: интервал принудительных ключевых кадров, секунды
+      (HLS_SEGMENT_TIME должен быть ему кратен)
+    - align_keyframes: без дополнительных ключевых кадров на сменах сцен,
+      чтобы границы сегментов совпадали во всех ступенях
+    """
+    width: int = Field(gt=0)
+    height: int = Field(gt=0)
+    profile: Literal['baseline', 'main', 'high'] = 'high'
+    level: str = '4.0'
+    crf: int = Field(default=23, ge=0, le=51)
+    maxrate: int | None = Field(default=None, gt=0)
+    bufsize: int | None = Field(default=None, gt=0)
+    gop: float = Field(default=2.5, gt=0)
+    align_keyframes: bool = True
+
+
+# Лестница по умолчанию: нижние ступени - baseline для старых устройств, уровни с запасом на 60 fps
+DEFAULT_LADDER = [
+    LadderRung(width=256, height=144, profile='baseline', level='3.0', crf=26, maxrate=300000, bufsize=600000),
+    LadderRung(width=426, height=240, profile='baseline', level='3.0', crf=25, maxrate=750000, bufsize=1500000),
+    LadderRung(width=640, height=360, profile='main', level='3.1', crf=24, maxrate=1000000, bufsize=2000000),
+    LadderRung(width=854, height=480, profile='main', level='3.1', crf=23, maxrate=1500000, bufsize=3000000),
+    LadderRung(width=1280, height=720, profile='high', level='4.0', crf=23, maxrate=3000000, bufsize=6000000),
+    LadderRung(width=1920, height=1080, profile='high', level='4.2', crf=22, maxrate=6000000, bufsize=12000000),
+    LadderRung(width=2560, height=1440, profile='high', level='5.1', crf=22, maxrate=10000000, bufsize=20000000),
+    LadderRung(width=3840, height=2160, profile='high', level='5.2', crf=22, maxrate=20000000, bufsize=40000000),
+]
+
+
+class TranscodeSettings(BaseSettings):
+    """
+    Настройки перекодирования видео в HLS.
+    
+    Определяет способ запуска FFmpeg для лестницы разрешений:
+    - per_rendition: отдельный запуск FFmpeg на каждое разрешение, последовательно
+    - parallel: рендишены кодируются одновременно в пределах бюджета ядер,
+      каждому FFmpeg выделяется своя доля потоков
+    - single_decode: один запуск FFmpeg, исходник декодируется один раз
+      и через split/scale раздается во все разрешения
+    
+    При progressive_publishing сначала кодируется и публикуется минимальное
+    разрешение (видео становится доступным для просмотра), остальные
+    добавляются в мастер-плейлист по мере готовности. Включать после
+    обновления channel_actions_service: старая версия считает первое
+    подтверждение ("playable") окончанием обработки.
+    
+    Источник видео (source_mode):
+    - download: исходник целиком скачивается во временный каталог
+    - stream: ffprobe и FFmpeg читают исходник по presigned-ссылке из MinIO
+      (HTTP Range-запросы); MP4 с moov-атомом в конце скачивается как раньше
+    
+    При remux_enabled ступень лестницы, совпадающая с исходником по
+    разрешению, нарезается в HLS без перекодирования, если исходник -
+    H.264 (профиль из remux_profiles, yuv420p, без поворота) с AAC-LC
+    звуком и достаточно частыми ключевыми кадрами. Остальные ступени
+    в этом случае кодируются с ключевыми кадрами исходника, чтобы
+    границы сегментов совпадали.
+    
+    Лестница кодирования (ladder, JSON-список LadderRung в VIDEO_LADDER):
+    минимальная ступень кодируется всегда, остальные - если помещаются
+    в разрешение исходника. Параметры кодировщика, CODECS и BANDWIDTH
+    мастер-плейлиста каждой ступени берутся из ее описания.
+    
+    Формат сегментов (segment_format):
+    - mpegts: каждый сегмент - отдельный .ts файл
+    - fmp4: рендишен - один fMP4-файл (init-сегмент и фрагменты),
+      плейлист адресует сегменты через EXT-X-BYTERANGE; объектов в MinIO
+      на порядки меньше, но рендишен выгружается только после кодирования
+    
+    При shared_audio звук кодируется один раз в отдельный звуковой рендишен
+    (группа EXT-X-MEDIA TYPE=AUDIO), видеорендишены пишутся без звука,
+    а мастер-плейлист дополнительно предлагает вариант только со звуком.
+    
+    При dedup_enabled во время скачивания считается SHA-256 исходника:
+    если такой же файл уже обработан, его HLS копируется на стороне MinIO
+    под новый uuid без кодирования (в режиме stream исходник
+    не скачивается, и дедупликация не выполняется).
+    
+    Варианты в дополнительных кодеках (variant_codecs: hevc - libx265,
+    av1 - libsvtav1) кодируются для variant_rungs верхних ступеней
+    не ниже variant_min_height после всей лестницы H.264 и объявляются
+    в мастер-плейлисте со своими CODECS, чтобы плееры с поддержкой кодека
+    выбирали их. Программное кодирование в разы дороже H.264, поэтому
+    варианты кодируются только для видео не короче variant_min_duration
+    секунд или с популярностью (просмотры канала автора) не меньше
+    variant_min_popularity; None отключает соответствующий порог.
+    
+    При jit_enabled ступени не ниже jit_min_height (кроме минимальной)
+    при загрузке не кодируются: мастер-плейлист их объявляет, а под их
+    именами опубликован медиаплейлист самой большой закодированной ступени.
+    Первый запрос такого плейлиста (nginx отправляет его копию
+    в /renditions/...; в docker-compose копия включается тем же
+    VIDEO_JIT_ENABLED) ставит кодирование ступени в очередь; исходник
+    хранится в MinIO, пока все отложенные ступени не закодированы.
+    Повторный запрос ставит задачу снова не раньше jit_request_ttl секунд.
+    """
+    encode_mode: Literal['per_rendition', 'parallel', 'single_decode'] = Field(default='per_rendition',
+                                                                               alias='VIDEO_ENCODE_MODE')
+    cpu_budget: int = Field(default_factory=lambda: os.cpu_count() or 1, alias='VIDEO_CPU_BUDGET')
+    progressive_publishing: bool = Field(default=False, alias='VIDEO_PROGRESSIVE_PUBLISHING')
+    source_mode: Literal['download', 'stream'] = Field(default='download', alias='VIDEO_SOURCE_MODE')
+    presigned_url_ttl: int = Field(default=6 * 60 * 60, alias='VIDEO_PRESIGNED_URL_TTL')
+    segment_format: Literal['mpegts', 'fmp4'] = Field(default='mpegts', alias='VIDEO_HLS_SEGMENT_FORMAT')
+    shared_audio: bool = Field(default=False, alias='VIDEO_SHARED_AUDIO')
+    dedup_enabled: bool = Field(default=False, alias='VIDEO_DEDUP_ENABLED')
+    ladder: list[LadderRung] = Field(default=DEFAULT_LADDER, min_length=1, alias='VIDEO_LADDER')
+    variant_codecs: list[Literal['hevc', 'av1']] = Field(default=[], alias='VIDEO_VARIANT_CODECS')
+    variant_rungs: int = Field(default=2, ge=1, alias='VIDEO_VARIANT_RUNGS')
+    variant_min_height: int = Field(default=720, alias='VIDEO_VARIANT_MIN_HEIGHT')
+    variant_min_duration: float | None = Field(default=600.0, alias='VIDEO_VARIANT_MIN_DURATION')
+    variant_min_popularity: int | None = Field(default=None, alias='VIDEO_VARIANT_MIN_POPULARITY')
+    jit_enabled: bool = Field(default=False, alias='VIDEO_JIT_ENABLED')
+    jit_min_height: int = Field(default=1440, alias='VIDEO_JIT_MIN_HEIGHT')
+    jit_request_ttl: float = Field(default=60 * 60, gt=0, alias='VIDEO_JIT_REQUEST_TTL')
+    remux_enabled: bool = Field(default=False, alias='VIDEO_REMUX_ENABLED')
+    remux_profiles: list[str] = Field(default=['Constrained Baseline', 'Baseline', 'Main', 'High'],
+                                      alias='VIDEO_REMUX_PROFILES')
+
+
+class JobSettings(BaseSettings):
+    """
+    Настройки параллельной обработки видео одним процессом.
+    
+    Определяет сколько сообщений из очереди обрабатывается одновременно
+    и какие ресурсы машины должны быть свободны для старта следующей задачи:
+    - место во временном каталоге: размер исходника * disk_factor
+      (исходник и все рендишены лежат в одном TemporaryDirectory)
+    - доступная память
+    - загрузка CPU (load average на одно ядро)
+    
+    status_history - сколько завершенных задач хранить для API статуса.
+    lease_ttl - срок аренды задачи в MinIO: упавший процесс перестает
+    продлевать аренду, и повторно доставленную задачу другой процесс
+    подхватывает не позже чем через lease_ttl секунд.
+    
+    Планировщик (scheduler_enabled) оценивает стоимость задачи по заголовку
+    исходника - длительность * пиксели всех ступеней лестницы в секундах
+    видео 1080p - и раскладывает задачи по очередям .short (стоимость
+    не больше short_job_max_cost) и .long. Освободившийся слот берет
+    задачу из очередей по весам short_weight:long_weight (длинные задачи
+    не голодают), long_max_jobs ограничивает число одновременных длинных
+    задач, чтобы короткие всегда находили свободный слот.
+    """
+    max_concurrent_jobs: int = Field(default=1, ge=1, alias='VIDEO_MAX_CONCURRENT_JOBS')
+    disk_factor: float = Field(default=3.0, alias='VIDEO_JOB_DISK_FACTOR')
+    min_free_memory_mb: int = Field(default=512, alias='VIDEO_MIN_FREE_MEMORY_MB')
+    max_cpu_load: float = Field(default=0.9, alias='VIDEO_MAX_CPU_LOAD')
+    admission_poll_interval: float = Field(default=5.0, alias='VIDEO_ADMISSION_POLL_INTERVAL')
+    status_history: int = Field(default=100, alias='VIDEO_JOB_STATUS_HISTORY')
+    lease_ttl: float = Field(default=60.0, gt=0, alias='VIDEO_JOB_LEASE_TTL')
+    scheduler_enabled: bool = Field(default=False, alias='VIDEO_SCHEDULER_ENABLED')
+    short_job_max_cost: float = Field(default=600.0, alias='VIDEO_SHORT_JOB_MAX_COST')
+    short_weight: int = Field(default=3, ge=1, alias='VIDEO_SHORT_JOB_WEIGHT')
+    long_weight: int = Field(default=1, ge=1, alias='VIDEO_LONG_JOB_WEIGHT')
+    long_max_jobs: int | None = Field(default=None, ge=1, alias='VIDEO_LONG_MAX_JOBS')
+    scheduler_poll_interval: float = Field(default=1.0, gt=0, alias='VIDEO_SCHEDULER_POLL_INTERVAL')
+
+
+class DistributedSettings(BaseSettings):
+    """
+    Настройки распределенного перекодирования длинных видео.
+    
+    Видео длиннее min_duration режется по ключевым кадрам на куски
+    примерно по chunk_duration секунд, куски кодируются любыми экземплярами
+    сервиса через очередь convert_video_chunk и затем склеиваются.
+    chunk_concurrency - сколько кусков один процесс кодирует одновременно.
+    """
+    enabled: bool = Field(default=False, alias='VIDEO_DISTRIBUTED_ENABLED')
+    min_duration: float = Field(default=600.0, alias='VIDEO_DISTRIBUTED_MIN_DURATION')
+    chunk_duration: float = Field(default=60.0, alias='VIDEO_CHUNK_DURATION')
+    chunk_concurrency: int = Field(default=1, ge=1, alias='VIDEO_CHUNK_CONCURRENCY')
+    chunk_timeout: float = Field(default=3600.0, alias='VIDEO_CHUNK_TIMEOUT')
+
+
+class RetrySettings(BaseSettings):
+    """
+    Настройки повторных попыток обработки видео.
+    
+    Упавшая задача откладывается в очередь задержки и после ее TTL
+    возвращается в convert_video_to_hls; задержка растет экспоненциально:
+    base_delay, 2 * base_delay, ... но не больше max_delay секунд.
+    После max_attempts неудачных попыток сообщение уходит в очередь
+    convert_video_to_hls.dead с причиной последней ошибки.
+    """
+    max_attempts: int = Field(default=5, ge=1, alias='VIDEO_RETRY_MAX_ATTEMPTS')
+    base_delay: float = Field(default=30.0, gt=0, alias='VIDEO_RETRY_BASE_DELAY')
+    max_delay: float = Field(default=3600.0, gt=0, alias='VIDEO_RETRY_MAX_DELAY')
+
+
+class SupervisorSettings(BaseSettings):
+    """
+    Настройки режима супервизора.
+    
+    В режиме супервизора (enabled) uvicorn запускает один легкий HTTP-процесс
+    (health, метрики, статус задач, администрирование), а кодирование
+    выполняют workers отдельных процессов-потребителей RabbitMQ.
+    Bucket и политика MinIO настраиваются один раз в HTTP-процессе.
+    Упавший процесс-потребитель перезапускается через restart_delay
+    секунд; если он снова падает быстрее stable_after секунд, задержка
+    удваивается до max_restart_delay. Процессы-потребители отправляют
+    состояние своих задач супервизору каждые status_interval секунд.
+    """
+    enabled: bool = Field(default=False, alias='VIDEO_SUPERVISOR_ENABLED')
+    workers: int = Field(default=2, ge=1, alias='VIDEO_ENCODING_WORKERS')
+    restart_delay: float = Field(default=1.0, gt=0, alias='VIDEO_WORKER_RESTART_DELAY')
+    max_restart_delay: float = Field(default=60.0, gt=0, alias='VIDEO_WORKER_MAX_RESTART_DELAY')
+    stable_after: float = Field(default=60.0, alias='VIDEO_WORKER_STABLE_AFTER')
+    status_interval: float = Field(default=2.0, gt=0, alias='VIDEO_WORKER_STATUS_INTERVAL')
+    shutdown_timeout: float = Field(default=30.0, alias='VIDEO_WORKER_SHUTDOWN_TIMEOUT')
+
+
+
+class AdminSettings(BaseSettings):
+    """
+    Настройки эндпоинтов администрирования (/admin).
+    
+    Запросы к /admin должны передавать token в заголовке X-Admin-Token;
+    без заданного token эндпоинты администрирования отключены.
+    """
+    token: str | None = Field(default=None, alias='VIDEO_ADMIN_TOKEN')
+
+
 DEBUG_MODE = DebugMode()
 WORKER_THREADS = WorkerThreads()
 RABBITMQ_SETTINGS = RabbitMQSettings()
 MINIO_SETTINGS = MinIOSettings()
-SERVER_SETTINGS = ServerSettings()
\ No newline at end of file
+SERVER_SETTINGS = ServerSettings()
+TRANSCODE_SETTINGS = TranscodeSettings()
+JOB_SETTINGS = JobSettings()
+DISTRIBUTED_SETTINGS = DistributedSettings()
+RETRY_SETTINGS = RetrySettings()
+SUPERVISOR_SETTINGS = SupervisorSettings()
+ADMIN_SETTINGS = AdminSettings()
\ No newline at end of file
@@ -0,0 +1,58 @@
+import hmac
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
+
+from config import ADMIN_SETTINGS
+
+
+async def require_admin_token(x_admin_token: str | None = Header(default=None)):
+    """
+    Проверка токена администратора из заголовка X-Admin-Token.
+
+    :raises HTTPException: 403, если токен не задан в настройках или не совпадает
+    """
+    if not ADMIN_SETTINGS.token or not x_admin_token \
+            or not hmac.compare_digest(x_admin_token.encode(), ADMIN_SETTINGS.token.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+router: APIRouter = APIRouter(prefix="/admin", dependencies=[Depends(require_admin_token)])
+"""
+Роутер администрирования очереди обработки видео.
+
+Позволяет посмотреть размер dead-letter очереди convert_video_to_hls
+и вернуть задачи из нее в работу (например, после устранения сбоя MinIO).
+Все эндпоинты требуют токен VIDEO_ADMIN_TOKEN в заголовке X-Admin-Token.
+
+:var router: Экземпляр роутера FastAPI для эндпоинтов администрирования
+:type router: APIRouter
+"""
+
+
+@router.get("/dead-letters", status_code=200, response_class=ORJSONResponse)
+async def dead_letters(request: Request) -> ORJSONResponse:
+    """
+    Количество задач в dead-letter очереди.
+
+    :return: JSON с именем очереди и количеством сообщений
+    :rtype: ORJSONResponse
+    """
+    job_retry = request.app.state.job_retry
+    return ORJSONResponse({"queue": job_retry.dead_queue, "count": await job_retry.dead_letter_count()})
+
+
+@router.post("/dead-letters/replay", status_code=200, response_class=ORJSONResponse)
+async def replay_dead_letters(request: Request, limit: int | None = Query(default=None, ge=1)) -> ORJSONResponse:
+    """
+    Возврат задач из dead-letter очереди в convert_video_to_hls.
+
+    Счетчик попыток возвращенных задач сбрасывается; рендишены,
+    выгруженные до падения, повторно не кодируются.
+
+    :param limit: Максимальное количество возвращаемых задач (по умолчанию все)
+    :type limit: int | None
+    :return: JSON с количеством возвращенных задач
+    :rtype: ORJSONResponse
+    """
+    return ORJSONResponse({"replayed": await request.app.state.job_retry.replay(limit)})
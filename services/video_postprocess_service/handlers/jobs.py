@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import ORJSONResponse
+
+router: APIRouter = APIRouter()
+"""
+Роутер статуса задач обработки видео.
+
+Предоставляет список задач процесса и детальное состояние задачи
+с прогрессом каждого запуска FFmpeg.
+
+:var router: Экземпляр роутера FastAPI для эндпоинтов статуса задач
+:type router: APIRouter
+"""
+
+
+@router.get("/jobs", status_code=200, response_class=ORJSONResponse)
+def list_jobs(request: Request) -> ORJSONResponse:
+    """
+    Список выполняющихся и недавно завершенных задач.
+
+    Для каждой задачи возвращаются этап, выполняющиеся запуски FFmpeg
+    и время с последнего обновления (по нему видны зависшие задачи).
+
+    .. note::
+        Каждый процесс uvicorn обрабатывает свои задачи, поэтому
+        список содержит задачи только ответившего процесса. В режиме
+        супервизора список собирается со всех процессов-потребителей
+        (с задержкой до VIDEO_WORKER_STATUS_INTERVAL).
+
+    :return: JSON со списком задач
+    :rtype: ORJSONResponse
+    """
+    job_registry = request.app.state.job_registry
+    return ORJSONResponse({"jobs": [job.summary() for job in job_registry.list()]})
+
+
+@router.get("/jobs/{uuid:path}", status_code=200, response_class=ORJSONResponse)
+def get_job(uuid: str, request: Request) -> ORJSONResponse:
+    """
+    Детальное состояние задачи.
+
+    Включает все запуски FFmpeg задачи: закодированные секунды,
+    скорость относительно реального времени, fps и скорость на ядро.
+
+    :param uuid: UUID видео (для кусков - "<uuid>/chunk-<номер>")
+    :type uuid: str
+    :return: JSON с состоянием задачи
+    :rtype: ORJSONResponse
+    :raises: 404 Not Found если задача неизвестна процессу
+    """
+    job = request.app.state.job_registry.get(uuid)
+    if job is None:
+        return ORJSONResponse({"msg": "Задача не найдена"}, status_code=404)
+    return ORJSONResponse({"job": job.model_dump()})
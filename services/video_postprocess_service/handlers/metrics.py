@@ -0,0 +1,28 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from services.metrics import render_metrics
+
+router: APIRouter = APIRouter()
+"""
+Роутер метрик Prometheus.
+
+:var router: Экземпляр роутера FastAPI для эндпоинта метрик
+:type router: APIRouter
+"""
+
+
+@router.get("/metrics", status_code=200)
+def metrics() -> Response:
+    """
+    Метрики конвейера постобработки в формате Prometheus.
+
+    Длительности скачивания, ffprobe, кодирования рендишенов, операций
+    с MinIO и задач целиком, объемы данных, количество сегментов,
+    время ожидания в очереди и счетчики успешных и упавших задач.
+
+    :return: Текстовое представление метрик
+    :rtype: Response
+    """
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
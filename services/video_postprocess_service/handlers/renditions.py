@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import ORJSONResponse
+
+router: APIRouter = APIRouter(prefix="/renditions")
+"""
+Роутер кодирования отложенных ступеней по запросу.
+
+nginx отправляет сюда копию каждого запроса медиаплейлиста видео
+(mirror), первый запрос отложенной ступени ставит ее кодирование в очередь.
+
+:var router: Экземпляр роутера FastAPI для эндпоинтов отложенных ступеней
+:type router: APIRouter
+"""
+
+
+@router.get("/{video_uuid}/{playlist_name}", status_code=200, response_class=ORJSONResponse)
+async def demand_rendition(video_uuid: str, playlist_name: str, request: Request) -> ORJSONResponse:
+    """
+    Запрос медиаплейлиста видео.
+
+    Пока ступень кодируется, зритель получает опубликованный под ее именем
+    плейлист меньшей ступени. Ответ не ждет MinIO и RabbitMQ: nginx держит
+    следующий запрос клиента, пока копия запроса не завершилась.
+
+    :param video_uuid: UUID видео
+    :type video_uuid: str
+    :param playlist_name: Имя медиаплейлиста (например, 2160p-<uuid>.m3u8)
+    :type playlist_name: str
+    :return: JSON со статусом: accepted (проверка запущена), ready или disabled
+    :rtype: ORJSONResponse
+    """
+    rendition_demand = request.app.state.rendition_demand
+    if rendition_demand is None:
+        return ORJSONResponse({"uuid": video_uuid, "status": "disabled"})
+    return ORJSONResponse({"uuid": video_uuid, "status": rendition_demand.submit(video_uuid, playlist_name)})
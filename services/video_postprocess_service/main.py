@@ -1,14 +1,25 @@
 import asyncio
+import aio_pika
 import uvicorn
 
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
+from handlers.admin import router as admin_router
 from handlers.health import router as health_router
+from handlers.jobs import router as jobs_router
+from handlers.metrics import router as metrics_router
+from handlers.renditions import router as renditions_router
+from services.deferred import RenditionDemand, DEFERRED_QUEUE
+from services.rabbitmq import RetryTopology
+from services.s3 import S3Service
+from services.supervisor import WorkerSupervisor
 from services.video_processor import VideoProcessor
 
-from config import DEBUG_MODE, WORKER_THREADS, SERVER_SETTINGS, RABBITMQ_SETTINGS, MINIO_SETTINGS
+from config import DEBUG_MODE, WORKER_THREADS, SERVER_SETTINGS, RABBITMQ_SETTINGS, MINIO_SETTINGS, \
+    TRANSCODE_SETTINGS, JOB_SETTINGS, \
+    DISTRIBUTED_SETTINGS, RETRY_SETTINGS, SUPERVISOR_SETTINGS
 
 
 @asynccontextmanager
@@ -17,14 +28,62 @@ async def lifespan(app: FastAPI):
     Контекстный менеджер для управления жизненным циклом приложения.
     
     Выполняет инициализацию и завершение работы видео процессора.
-    Запускает потребителей RabbitMQ при старте приложения.
+    Запускает потребителей RabbitMQ при старте приложения и открывает
+    реестр задач и dead-letter очередь процессора для эндпоинтов
+    статуса и администрирования. В режиме супервизора вместо процессора
+    запускается пул процессов-потребителей. При кодировании ступеней
+    по запросу (VIDEO_JIT_ENABLED) эндпоинт запроса плейлиста ставит
+    задачи через соединения процессора.
     """
-    video_processor = VideoProcessor(RABBITMQ_SETTINGS, MINIO_SETTINGS)
+    if SUPERVISOR_SETTINGS.enabled:
+        async with supervised_workers(app):
+            yield
+        return
+    
+    video_processor = VideoProcessor(RABBITMQ_SETTINGS, MINIO_SETTINGS, TRANSCODE_SETTINGS, JOB_SETTINGS,
+                                     DISTRIBUTED_SETTINGS, RETRY_SETTINGS)
+    app.state.job_registry = video_processor.job_registry
+    app.state.job_retry = video_processor.retry
     await video_processor.start()
+    app.state.rendition_demand = RenditionDemand(
+        video_processor.s3_service, video_processor.channel, TRANSCODE_SETTINGS, JOB_SETTINGS.lease_ttl
+    ) if TRANSCODE_SETTINGS.jit_enabled else None
     yield
     await video_processor.stop()
 
 
+@asynccontextmanager
+async def supervised_workers(app: FastAPI):
+    """
+    Режим супервизора: HTTP-процесс настраивает bucket MinIO один раз,
+    запускает процессы-потребители и держит свое соединение с RabbitMQ
+    только для администрирования dead-letter очереди и постановки
+    задач отложенных ступеней.
+    """
+    s3_service = S3Service(MINIO_SETTINGS)
+    await s3_service.connect()
+    
+    connection = await aio_pika.connect_robust(RABBITMQ_SETTINGS.url)
+    channel = await connection.channel()
+    job_retry = RetryTopology("convert_video_to_hls", RETRY_SETTINGS)
+    await job_retry.declare(channel)
+    app.state.rendition_demand = None
+    if TRANSCODE_SETTINGS.jit_enabled:
+        await channel.declare_queue(DEFERRED_QUEUE, durable=True)
+        app.state.rendition_demand = RenditionDemand(s3_service, channel, TRANSCODE_SETTINGS, JOB_SETTINGS.lease_ttl)
+    
+    supervisor = WorkerSupervisor(SUPERVISOR_SETTINGS)
+    app.state.job_registry = supervisor.jobs
+    app.state.job_retry = job_retry
+    await supervisor.start()
+    try:
+        yield
+    finally:
+        await supervisor.stop()
+        await connection.close()
+        await s3_service.close()
+
+
 app = FastAPI(
     docs_url='/docs' if DEBUG_MODE.debug_mode else None,
     redoc_url='/redoc' if DEBUG_MODE.debug_mode else None,
@@ -32,6 +91,10 @@ app = FastAPI(
 )
 
 app.include_router(health_router)
+app.include_router(jobs_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
+app.include_router(renditions_router)
 
 
 async def main():
@@ -51,7 +114,9 @@ if __name__ == '__main__':
     Настройки сервера:
     - Хост: из конфигурации SERVER_SETTINGS
     - Порт: из конфигурации SERVER_SETTINGS  
-    - Количество воркеров: из конфигурации WORKER_THREADS
+    - Количество воркеров: из конфигурации WORKER_THREADS (в режиме
+      супервизора один HTTP-процесс, кодированием занимаются
+      процессы-потребители SUPERVISOR_SETTINGS.workers)
     - Режим перезагрузки: из конфигурации DEBUG_MODE
     """
     asyncio.run(main())
@@ -59,6 +124,6 @@ if __name__ == '__main__':
         "main:app",
         host=SERVER_SETTINGS.host,
         port=SERVER_SETTINGS.port,
-        workers=WORKER_THREADS.count,
+        workers=1 if SUPERVISOR_SETTINGS.enabled else WORKER_THREADS.count,
         reload=DEBUG_MODE.debug_mode
     )
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+
+
+class AdmissionController:
+    """
+    Контроль допуска задач перекодирования.
+
+    Ограничивает количество одновременно обрабатываемых видео и перед
+    стартом очередной задачи проверяет ресурсы машины: загрузку CPU,
+    свободную память и место во временном каталоге с учетом места,
+    уже зарезервированного запущенными задачами. Если ни одна задача
+    не выполняется, задача допускается без проверок, чтобы одно большое
+    видео не ждало ресурсов вечно.
+
+    Потребитель очереди вызывает acquire до получения сообщения: занятый
+    воркер не забирает задачи, которые мог бы взять свободный. Место
+    под конкретную задачу известно только после получения сообщения,
+    его проверяет disk_shortage и резервирует reserve_disk.
+    """
+
+    def __init__(self, job_config):
+        self.job_config = job_config
+        self.temp_dir = tempfile.gettempdir()
+        self._slots = asyncio.Semaphore(job_config.max_concurrent_jobs)
+        self._admission_lock = asyncio.Lock()
+        self._running_jobs = 0
+        self._reserved_disk = 0
+
+    async def acquire(self, required_disk: int = 0):
+        """Ожидание свободного слота и ресурсов машины, резервирование места на диске."""
+        await self._slots.acquire()
+        try:
+            async with self._admission_lock:
+                while self._running_jobs > 0:
+                    reason = self.check_resources(required_disk)
+                    if reason is None:
+                        break
+                    print(f"Admission delayed: {reason}")
+                    await asyncio.sleep(self.job_config.admission_poll_interval)
+                self._running_jobs += 1
+                self._reserved_disk += required_disk
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, required_disk: int = 0):
+        """Освобождение слота и зарезервированного места."""
+        self._running_jobs -= 1
+        self._reserved_disk -= required_disk
+        self._slots.release()
+
+    @asynccontextmanager
+    async def admit(self, required_disk: int):
+        """Ожидание свободного слота и ресурсов, резервирование места на диске под задачу."""
+        await self.acquire(required_disk)
+        try:
+            yield
+        finally:
+            self.release(required_disk)
+
+    def disk_shortage(self, required_disk: int) -> str | None:
+        """
+        Причина, по которой задаче не хватает места во временном каталоге,
+        или None. Если место не зарезервировано другими задачами, задача
+        допускается без проверки.
+        """
+        if self._reserved_disk == 0:
+            return None
+        free_disk = shutil.disk_usage(self.temp_dir).free - self._reserved_disk
+        if free_disk < required_disk:
+            return f"not enough temp disk space ({free_disk} < {required_disk} bytes)"
+        return None
+
+    @asynccontextmanager
+    async def reserve_disk(self, required_disk: int):
+        """Резервирование места во временном каталоге на время задачи."""
+        self._reserved_disk += required_disk
+        try:
+            yield
+        finally:
+            self._reserved_disk -= required_disk
+
+    def check_resources(self, required_disk: int) -> str | None:
+        """Проверка ресурсов; возвращает причину отказа или None, если задачу можно запускать."""
+        free_disk = shutil.disk_usage(self.temp_dir).free - self._reserved_disk
+        if free_disk < required_disk:
+            return f"not enough temp disk space ({free_disk} < {required_disk} bytes)"
+
+        free_memory = self._available_memory()
+        min_free_memory = self.job_config.min_free_memory_mb * 1024 * 1024
+        if free_memory is not None and free_memory < min_free_memory:
+            return f"not enough memory ({free_memory} < {min_free_memory} bytes)"
+
+        cpu_load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        if cpu_load > self.job_config.max_cpu_load:
+            return f"CPU is busy (load {cpu_load:.2f} > {self.job_config.max_cpu_load})"
+
+        return None
+
+    def _available_memory(self) -> int | None:
+        """Доступная память из /proc/meminfo (MemAvailable), None вне Linux."""
+        try:
+            with open('/proc/meminfo') as meminfo:
+                for line in meminfo:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
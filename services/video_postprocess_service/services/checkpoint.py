@@ -0,0 +1,191 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+from pydantic import BaseModel
+
+from services.s3 import S3Service
+
+
+class RenditionCheckpoint(BaseModel):
+    """Выгруженный рендишен: измеренные (пиковый, средний) битрейты и CODECS для мастер-плейлиста."""
+    bitrates: tuple[int, int] | None = None
+    codecs: str | None = None
+
+
+class JobManifest(BaseModel):
+    """
+    Манифест задачи в MinIO.
+
+    renditions - рендишены, полностью выгруженные в video_files/<uuid>/,
+    completed - мастер-плейлист со всеми рендишенами опубликован.
+    """
+    renditions: dict[str, RenditionCheckpoint] = {}
+    completed: bool = False
+
+
+class JobCheckpoint:
+    """
+    Контрольные точки задачи по рендишенам.
+
+    После выгрузки каждого рендишена манифест перезаписывается в MinIO,
+    поэтому повторно доставленная задача (после падения процесса или
+    ошибки) кодирует только недостающие ступени лестницы.
+    """
+
+    def __init__(self, s3_service: S3Service, video_uuid: str, manifest: JobManifest | None = None):
+        self.s3_service = s3_service
+        self.video_uuid = video_uuid
+        self.manifest = manifest or JobManifest()
+
+    @classmethod
+    async def load(cls, s3_service: S3Service, video_uuid: str) -> 'JobCheckpoint':
+        """Чтение манифеста задачи; пустой манифест, если задача еще не начиналась."""
+        data = await s3_service.get_bytes(cls.manifest_key(video_uuid))
+        manifest = JobManifest.model_validate_json(data) if data is not None else None
+        return cls(s3_service, video_uuid, manifest)
+
+    @staticmethod
+    def manifest_key(video_uuid: str) -> str:
+        """Путь манифеста задачи в MinIO."""
+        return f"jobs/{video_uuid}/manifest.json"
+
+    def completed_renditions(self, resolutions: list) -> list[str]:
+        """Уже выгруженные рендишены из resolutions (в том же порядке)."""
+        return [resolution for resolution in resolutions if resolution in self.manifest.renditions]
+
+    def bitrates(self, resolution: str) -> tuple[int, int] | None:
+        """Сохраненные битрейты рендишена."""
+        rendition = self.manifest.renditions.get(resolution)
+        return rendition.bitrates if rendition else None
+
+    def codecs(self) -> dict[str, str]:
+        """Сохраненные CODECS рендишенов, кодированных не нашим кодировщиком."""
+        return {
+            resolution: rendition.codecs
+            for resolution, rendition in self.manifest.renditions.items() if rendition.codecs
+        }
+
+    async def record_rendition(self, resolution: str, bitrates: tuple[int, int] | None, codecs: str | None):
+        """Отметка рендишена выгруженным."""
+        self.manifest.renditions[resolution] = RenditionCheckpoint(bitrates=bitrates, codecs=codecs)
+        await self._save()
+
+    async def complete(self):
+        """Отметка задачи завершенной: повторные доставки сообщения будут подтверждаться без обработки."""
+        self.manifest.completed = True
+        await self._save()
+
+    async def _save(self):
+        await self.s3_service.upload_bytes(
+            self.manifest.model_dump_json().encode(), self.manifest_key(self.video_uuid)
+        )
+
+
+class JobLeaseMarker(BaseModel):
+    """Содержимое маркера аренды."""
+    owner: str
+    expires_at: float
+
+
+class LeaseLostError(Exception):
+    """Аренда задачи перехвачена другим процессом."""
+
+
+class JobLease:
+    """
+    Аренда задачи через объект-маркер в MinIO.
+
+    Не дает двум процессам одновременно обрабатывать одно видео (например,
+    при повторной доставке сообщения, пока первый обработчик еще работает).
+    Маркер хранит владельца и срок действия и продлевается каждую треть ttl.
+    Чужой действующий маркер ожидается до освобождения или истечения срока
+    (упавший процесс маркер не продлевает). Если маркер перехватил другой
+    процесс, задача внутри аренды отменяется с LeaseLostError.
+
+    .. note::
+        MinIO без условной записи не дает атомарного захвата, поэтому после
+        записи маркер перечитывается: из двух одновременно записавших
+        процессов аренду получает тот, чья запись оказалась последней.
+    """
+
+    # Пауза между записью маркера и его проверкой, секунды
+    SETTLE_DELAY = 1.0
+
+    def __init__(self, s3_service: S3Service, video_uuid: str, ttl: float):
+        self.s3_service = s3_service
+        self.key = self.lease_key(video_uuid)
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lost = False
+        self._task: asyncio.Task | None = None
+        self._renew_task: asyncio.Task | None = None
+
+    @staticmethod
+    def lease_key(video_uuid: str) -> str:
+        """Путь маркера аренды в MinIO."""
+        return f"jobs/{video_uuid}/lease.json"
+
+    async def __aenter__(self) -> 'JobLease':
+        await self.acquire()
+        self._task = asyncio.current_task()
+        self._renew_task = asyncio.create_task(self._renew())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._renew_task.cancel()
+        await asyncio.gather(self._renew_task, return_exceptions=True)
+        if self.lost:
+            if self._task.cancelling():
+                self._task.uncancel()
+            raise LeaseLostError(f"Lease {self.key} was taken over by another worker")
+        await self.release()
+
+    async def acquire(self):
+        """Ожидание освобождения чужой аренды и захват маркера."""
+        while True:
+            lease = await self._read()
+            if lease and lease.owner != self.owner and lease.expires_at > time.time():
+                print(f"Job is leased by {lease.owner}, waiting: {self.key}")
+                await asyncio.sleep(min(self.ttl / 3, max(lease.expires_at - time.time(), 0.1)))
+                continue
+            await self._write()
+            await asyncio.sleep(self.SETTLE_DELAY)
+            lease = await self._read()
+            if lease and lease.owner == self.owner:
+                return
+
+    async def release(self):
+        """Удаление маркера, если он все еще наш."""
+        lease = await self._read()
+        if lease and lease.owner == self.owner:
+            await self.s3_service.delete_file(self.key)
+
+    async def _renew(self):
+        """Продление маркера; при перехвате аренды отменяет задачу-владельца."""
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                lease = await self._read()
+            except Exception as e:
+                print(f"Error renewing lease {self.key}: {e}")
+                continue
+            if not lease or lease.owner != self.owner:
+                print(f"Lease lost: {self.key}")
+                self.lost = True
+                self._task.cancel()
+                return
+            try:
+                await self._write()
+            except Exception as e:
+                print(f"Error renewing lease {self.key}: {e}")
+
+    async def _read(self) -> JobLeaseMarker | None:
+        data = await self.s3_service.get_bytes(self.key)
+        return JobLeaseMarker.model_validate_json(data) if data is not None else None
+
+    async def _write(self):
+        marker = JobLeaseMarker(owner=self.owner, expires_at=time.time() + self.ttl)
+        await self.s3_service.upload_bytes(marker.model_dump_json().encode(), self.key)
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+
+import aio_pika
+
+from services.jobs import current_job, set_stage
+from services.media_info import MediaInfo
+from services.metrics import ENCODE_SECONDS
+
+# Очередь задач на кодирование кусков видео
+CHUNK_QUEUE = "convert_video_chunk"
+
+
+def plan_chunks(keyframes: list[float], duration: float, chunk_duration: float) -> list[tuple[float, float]]:
+    """
+    Разбиение видео на куски, начинающиеся с ключевых кадров исходника.
+
+    Граница очередного куска - первый ключевой кадр не раньше, чем через
+    chunk_duration секунд от начала предыдущего. Последний кусок
+    заканчивается в конце видео.
+    """
+    boundaries = [0.0]
+    for keyframe in sorted(keyframes):
+        if keyframe >= boundaries[-1] + chunk_duration and keyframe < duration:
+            boundaries.append(keyframe)
+    boundaries.append(duration)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def forced_keyframe_times(start: float, end: float, segment_time: float) -> list[float]:
+    """
+    Моменты принудительных ключевых кадров куска (относительно его начала).
+
+    Ключевые кадры ставятся в начале куска и на каждой абсолютной отметке,
+    кратной длительности сегмента. Так границы HLS-сегментов после склейки
+    совпадают во всех рендишенах.
+    """
+    times = [0.0]
+    mark = (int(start // segment_time) + 1) * segment_time
+    while mark < end:
+        times.append(round(mark - start, 3))
+        mark += segment_time
+    return times
+
+
+class ChunkedTranscoder:
+    """
+    Распределенное перекодирование длинных видео по кускам.
+
+    Координатор (процессор, получивший видео) режет исходник на куски
+    по ключевым кадрам и публикует задачи на каждый кусок в очередь
+    convert_video_chunk. Любой экземпляр VideoProcessor берет кусок,
+    кодирует его сразу во все разрешения (без звука, в Matroska, чтобы
+    склейка сохраняла точные метки времени) и выгружает в MinIO.
+    Пока куски кодируются, координатор один раз кодирует звук, затем
+    склеивает куски каждого разрешения concat-демуксером без перекодирования
+    и нарезает непрерывные HLS-рендишены с выровненными границами сегментов.
+
+    Ответы о готовности кусков приходят в эксклюзивную очередь координатора
+    (reply_to + correlation_id).
+    """
+
+    def __init__(self, processor, distributed_config, segment_time: int):
+        self.processor = processor
+        self.config = distributed_config
+        self.segment_time = segment_time
+        self.channel = None
+        self.callback_queue = None
+        self._pending: dict[str, asyncio.Future] = {}
+
+    async def start(self, connection: aio_pika.abc.AbstractRobustConnection):
+        """Подписка на очередь кусков и на очередь ответов координатора."""
+        self.channel = await connection.channel()
+        await self.channel.set_qos(prefetch_count=self.config.chunk_concurrency)
+
+        chunk_queue = await self.channel.declare_queue(CHUNK_QUEUE, durable=True)
+        await chunk_queue.consume(self.on_chunk_message)
+
+        self.callback_queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+        await self.callback_queue.consume(self.on_chunk_done, no_ack=True)
+
+    def should_distribute(self, media_info: MediaInfo) -> bool:
+        """Нужно ли кодировать видео распределенно."""
+        return (self.config.enabled and media_info.duration is not None
+                and media_info.duration >= self.config.min_duration)
+
+    async def transcode(self, input_file: str, video_uuid: str, resolutions: list, output_dir: str,
+                        video_path: str, media_info: MediaInfo, on_rendition_done=None):
+        """
+        Координация распределенного кодирования всех разрешений видео.
+
+        Ключевые кадры всего видеопотока читаются только здесь: границы
+        кусков нужны лишь при распределенном кодировании.
+        """
+        keyframes = await self.processor.probe_keyframes(input_file)
+        chunks = plan_chunks(keyframes, media_info.duration, self.config.chunk_duration)
+        print(f"Distributing {video_uuid} as {len(chunks)} chunks")
+        chunk_keys = [self.chunk_key(video_uuid, index, resolution)
+                      for resolution in resolutions for index in range(len(chunks))]
+
+        try:
+            with tempfile.TemporaryDirectory(prefix=f"{video_uuid}-stitch",
+                                             dir=os.path.dirname(output_dir)) as work_dir:
+                await self._dispatch_and_stitch(input_file, video_uuid, resolutions, output_dir, video_path,
+                                                media_info, chunks, work_dir, on_rendition_done)
+        finally:
+            # Куски удаляются и при ошибке: уже выгруженные воркерами иначе остаются в MinIO
+            await self.processor.s3_service.delete_files(chunk_keys)
+
+    async def _dispatch_and_stitch(self, input_file: str, video_uuid: str, resolutions: list, output_dir: str,
+                                   video_path: str, media_info: MediaInfo, chunks: list, work_dir: str,
+                                   on_rendition_done=None):
+        """Кодирование кусков воркерами и склейка их в рендишены во временном каталоге work_dir."""
+        audio_file = os.path.join(work_dir, "audio.m4a")
+        # При общем звуковом рендишене звук кодирует процессор, склейка - только видео
+        with_audio = media_info.has_audio and not self.processor.shares_audio(media_info)
+        audio_task = None
+        if with_audio:
+            audio_task = asyncio.create_task(self.encode_audio(input_file, audio_file))
+        try:
+            await self.dispatch_chunks(video_uuid, video_path, chunks, resolutions)
+            if audio_task:
+                await audio_task
+        finally:
+            if audio_task:
+                audio_task.cancel()
+
+        for resolution in resolutions:
+            chunk_files = []
+            for index in range(len(chunks)):
+                key = self.chunk_key(video_uuid, index, resolution)
+                local_path = os.path.join(work_dir, f"{index:05d}-{os.path.basename(key)}")
+                await self.processor.s3_service.download_file(key, local_path)
+                chunk_files.append(local_path)
+
+            await self.stitch(chunk_files, audio_file if with_audio else None, resolution, video_uuid,
+                              output_dir)
+            for chunk_file in chunk_files:
+                os.remove(chunk_file)
+            if on_rendition_done:
+                await on_rendition_done(resolution)
+
+    async def dispatch_chunks(self, video_uuid: str, video_path: str, chunks: list, resolutions: list):
+        """Публикация задач на куски и ожидание ответов от воркеров."""
+        loop = asyncio.get_running_loop()
+        correlation_ids = []
+        futures = []
+        for index, (start, end) in enumerate(chunks):
+            correlation_id = f"{video_uuid}:{index}:{uuid.uuid4().hex}"
+            future = loop.create_future()
+            self._pending[correlation_id] = future
+            correlation_ids.append(correlation_id)
+            futures.append(future)
+
+            job = {"uuid": video_uuid, "video_path": video_path, "index": index,
+                   "start": start, "end": end, "resolutions": resolutions}
+            await self.processor.channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=json.dumps(job).encode(),
+                    content_type="application/json",
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    correlation_id=correlation_id,
+                    reply_to=self.callback_queue.name
+                ),
+                routing_key=CHUNK_QUEUE
+            )
+
+        try:
+            results = await asyncio.wait_for(asyncio.gather(*futures), timeout=self.config.chunk_timeout)
+        finally:
+            for correlation_id in correlation_ids:
+                self._pending.pop(correlation_id).cancel()
+
+        failed = [result for result in results if result.get("status") != "ok"]
+        if failed:
+            raise Exception(f"Chunk encoding failed: {failed}")
+
+    async def on_chunk_done(self, message: aio_pika.IncomingMessage):
+        """
+        Ответ воркера о готовности куска.
+
+        Куски из ответа, пришедшего после того, как координатор перестал
+        его ждать (таймаут или ошибка другого куска), удаляются из MinIO:
+        координатор их уже не склеит и не удалит.
+        """
+        try:
+            result = json.loads(message.body.decode())
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            print(f"Invalid chunk result: {e}")
+            return
+        future = self._pending.get(message.correlation_id)
+        if future and not future.done():
+            future.set_result(result)
+        elif result.get("keys"):
+            print(f"Deleting chunk {result.get('index')} that arrived after its job finished")
+            try:
+                await self.processor.s3_service.delete_files(result["keys"])
+            except Exception as e:
+                print(f"Error deleting late chunk {result.get('index')}: {e}")
+
+    async def on_chunk_message(self, message: aio_pika.IncomingMessage):
+        """Кодирование куска по задаче координатора и отправка ответа."""
+        try:
+            job = json.loads(message.body.decode())
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            print(f"Invalid chunk message: {e}")
+            await message.reject(requeue=False)
+            return
+        state = self.processor.job_registry.start(f"{job.get('uuid')}/chunk-{job.get('index')}", job.get('video_path'),
+                                                  kind='chunk')
+        state.duration = job.get('end', 0) - job.get('start', 0)
+        state.resolutions = job.get('resolutions', [])
+        job_token = current_job.set(state)
+        try:
+            set_stage('encoding')
+            keys = await self.encode_chunk(job)
+            result = {"status": "ok", "index": job["index"], "keys": keys}
+        except Exception as e:
+            print(f"Error encoding chunk {job.get('index')} of {job.get('uuid')}: {e}")
+            state.error = str(e)
+            result = {"status": "error", "index": job.get("index"), "error": str(e)}
+        finally:
+            current_job.reset(job_token)
+        self.processor.job_registry.finish(state, result["status"] == "ok")
+
+        if message.reply_to:
+            await self.channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=json.dumps(result).encode(),
+                    content_type="application/json",
+                    correlation_id=message.correlation_id
+                ),
+                routing_key=message.reply_to
+            )
+        await message.ack()
+
+    async def encode_chunk(self, job: dict) -> list[str]:
+        """Кодирование одного куска во все разрешения и выгрузка в MinIO; возвращает пути кусков."""
+        start, end = job["start"], job["end"]
+        resolutions = job["resolutions"]
+        keyframe_times = ",".join(str(time) for time in forced_keyframe_times(start, end, self.segment_time))
+        source_url = await self.processor.s3_service.generate_presigned_url(
+            job["video_path"], self.processor.transcode_config.presigned_url_ttl
+        )
+
+        with tempfile.TemporaryDirectory(prefix=f"{job['uuid']}-chunk{job['index']}") as temp_dir:
+            cmd = [
+                'ffmpeg',
+                '-loglevel', 'warning',
+                '-ss', str(start),
+                '-to', str(end),
+                *self.processor._input_args(source_url),
+                '-filter_complex', self.processor._build_split_filter(resolutions)
+            ]
+            outputs = []
+            for index, resolution in enumerate(resolutions):
+                output_file = os.path.join(temp_dir, os.path.basename(self.chunk_key(job["uuid"], 0, resolution)))
+                outputs.append((output_file, self.chunk_key(job["uuid"], job["index"], resolution)))
+                cmd += [
+                    '-map', f'[v{index}out]',
+                    '-an',
+                    *self.processor._video_codec_args(resolution),
+                    # Ключевые кадры только на границах сегментов: scenecut в разных
+                    # разрешениях ставит их по-разному, и сегменты ступеней разъезжаются
+                    *self.processor._forced_keyframe_args(keyframe_times),
+                    '-f', 'matroska',
+                    output_file
+                ]
+
+            print(f"Encoding chunk {job['index']} of {job['uuid']} ({start:.3f}-{end:.3f})")
+            with ENCODE_SECONDS.labels('all', 'chunk').time():
+                await self.processor._run_ffmpeg(cmd, f"chunk {job['index']}")
+            await self.processor.s3_service.upload_files(outputs)
+        return [key for _, key in outputs]
+
+    async def encode_audio(self, input_file: str, audio_file: str):
+        """Однократное кодирование звука для склейки."""
+        await self.processor._run_ffmpeg([
+            'ffmpeg',
+            '-loglevel', 'warning',
+            *self.processor._input_args(input_file),
+            '-map', '0:a:0',
+            '-vn',
+            '-c:a', 'aac',
+            audio_file
+        ], "audio", threads=1)
+
+    async def stitch(self, chunk_files: list[str], audio_file: str | None, resolution: str, video_uuid: str,
+                     output_dir: str):
+        """Склейка кусков одного разрешения в HLS-рендишен без перекодирования видео."""
+        list_file = os.path.join(os.path.dirname(chunk_files[0]), f"{resolution.replace(':', 'x')}.txt")
+        with open(list_file, 'w') as concat_list:
+            for chunk_file in chunk_files:
+                concat_list.write(f"file '{chunk_file}'\n")
+
+        output_file = os.path.join(output_dir, f"{self.processor._rendition_name(resolution, video_uuid)}.m3u8")
+        cmd = ['ffmpeg', '-loglevel', 'warning', '-f', 'concat', '-safe', '0', '-i', list_file]
+        if audio_file:
+            cmd += ['-i', audio_file, '-map', '0:v', '-map', '1:a']
+        cmd += ['-c', 'copy', *self.processor._hls_muxer_args(output_file)]
+        rendition = f"{min(int(side) for side in resolution.split(':'))}p"
+        with ENCODE_SECONDS.labels(rendition, 'stitch').time():
+            await self.processor._run_ffmpeg(cmd, f"stitch {resolution}", threads=1)
+        print(f"Stitched {len(chunk_files)} chunks into {resolution}")
+
+    @staticmethod
+    def chunk_key(video_uuid: str, index: int, resolution: str) -> str:
+        """Путь куска одного разрешения в MinIO."""
+        return f"video_chunks/{video_uuid}/{index:05d}/{resolution.replace(':', 'x')}.mkv"
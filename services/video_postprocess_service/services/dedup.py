@@ -0,0 +1,84 @@
+import asyncio
+
+from pydantic import BaseModel
+
+from services.checkpoint import JobCheckpoint
+from services.media_info import MediaInfo
+from services.s3 import S3Service
+
+
+class MissingOutputError(Exception):
+    """HLS видео из записи индекса уже удален."""
+
+
+class SourceIndexEntry(BaseModel):
+    """Обработанное видео с данным содержимым исходника."""
+    uuid: str
+    media_info: MediaInfo
+
+
+class SourceIndex:
+    """
+    Индекс хеш содержимого исходника -> uuid обработанного видео в MinIO.
+
+    Запись dedup/sha256/<хеш>.json создается после успешной обработки.
+    Повторная загрузка того же файла (например, повтор со страницы
+    загрузки) не кодируется заново: HLS найденного видео копируется
+    на стороне MinIO под новый uuid. Каждое видео получает свою копию,
+    поэтому удаление одного из них не затрагивает другое.
+    """
+
+    def __init__(self, s3_service: S3Service):
+        self.s3_service = s3_service
+
+    @staticmethod
+    def entry_key(source_hash: str) -> str:
+        """Путь записи индекса в MinIO."""
+        return f"dedup/sha256/{source_hash}.json"
+
+    async def lookup(self, source_hash: str) -> SourceIndexEntry | None:
+        """
+        Обработанное видео с таким же исходником; None, если его нет
+        или его HLS уже не полностью опубликован (видео удалено).
+        """
+        data = await self.s3_service.get_bytes(self.entry_key(source_hash))
+        if data is None:
+            return None
+        entry = SourceIndexEntry.model_validate_json(data)
+        checkpoint = await JobCheckpoint.load(self.s3_service, entry.uuid)
+        if not checkpoint.manifest.completed:
+            return None
+        return entry
+
+    async def record(self, source_hash: str, video_uuid: str, media_info: MediaInfo):
+        """Запись обработанного видео в индекс."""
+        entry = SourceIndexEntry(uuid=video_uuid, media_info=media_info)
+        await self.s3_service.upload_bytes(entry.model_dump_json().encode(), self.entry_key(source_hash))
+
+    async def forget(self, source_hash: str):
+        """Удаление записи индекса, указывающей на удаленный HLS."""
+        await self.s3_service.delete_file(self.entry_key(source_hash))
+
+    async def copy_output(self, source_uuid: str, video_uuid: str) -> int:
+        """
+        Копирование HLS видео source_uuid в video_files/<video_uuid>/.
+
+        Плейлисты ссылаются на сегменты и медиаплейлисты относительными
+        именами, поэтому файлы копируются без изменений. Мастер-плейлист
+        копируется последним: до него копия видео не видна плееру.
+        Возвращает количество скопированных объектов; MissingOutputError,
+        если HLS видео source_uuid уже удален.
+        """
+        source_prefix = f"{self.s3_service.video_files_folder}/{source_uuid}/"
+        target_prefix = f"{self.s3_service.video_files_folder}/{video_uuid}/"
+        files = await self.s3_service.list_files(source_prefix)
+        if not files:
+            raise MissingOutputError(f"No HLS output found for {source_uuid}")
+        masters = [(key, size) for key, size in files if key.endswith('/master.m3u8')]
+        others = [(key, size) for key, size in files if not key.endswith('/master.m3u8')]
+        for batch in (others, masters):
+            await asyncio.gather(*(
+                self.s3_service.copy_file(key, target_prefix + key[len(source_prefix):], size)
+                for key, size in batch
+            ))
+        return len(files)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import re
+import time
+
+import aio_pika
+from pydantic import BaseModel
+
+from services.checkpoint import JobLease
+from services.s3 import S3Service
+
+# Очередь задач кодирования отложенных ступеней
+DEFERRED_QUEUE = "transcode_deferred_rendition"
+
+# Имя медиаплейлиста ступени H.264: <высота>p-<uuid>.m3u8
+MEDIA_PLAYLIST_PATTERN = re.compile(r'^(\d+)p-(.+)\.m3u8$')
+
+
+class DeferredRenditions(BaseModel):
+    """
+    Ступени лестницы видео, не кодированные при загрузке.
+
+    - video_path: исходник в MinIO (сохраняется, пока есть отложенные ступени)
+    - renditions: отложенные ступени ('W:H')
+    - fallback: ступень, медиаплейлист которой опубликован под именами отложенных
+    - master: рендишены мастер-плейлиста в порядке объявления
+    - align_keyframes: ступени кодировались с ключевыми кадрами исходника
+    - requested: время постановки в очередь кодирования отложенных ступеней
+    """
+    video_path: str
+    renditions: list[str]
+    fallback: str
+    master: list[str]
+    align_keyframes: bool = False
+    requested: dict[str, float] = {}
+
+    @staticmethod
+    def key(video_uuid: str) -> str:
+        """Путь записи отложенных ступеней в MinIO."""
+        return f"jobs/{video_uuid}/deferred.json"
+
+    @classmethod
+    async def load(cls, s3_service: S3Service, video_uuid: str) -> 'DeferredRenditions | None':
+        """Чтение записи; None, если отложенных ступеней у видео нет."""
+        data = await s3_service.get_bytes(cls.key(video_uuid))
+        return cls.model_validate_json(data) if data is not None else None
+
+    async def save(self, s3_service: S3Service, video_uuid: str):
+        await s3_service.upload_bytes(self.model_dump_json().encode(), self.key(video_uuid))
+
+
+class RenditionDemand:
+    """
+    Кодирование отложенной ступени по первому запросу ее медиаплейлиста.
+
+    До кодирования под именем отложенной ступени опубликован плейлист
+    ступени fallback, поэтому плеер сразу получает меньшее разрешение.
+    Первый запрос ставит задачу в очередь DEFERRED_QUEUE и отмечает ее
+    в записи DeferredRenditions; повторные видят отметку и задачу
+    не дублируют. Плейлисты ниже jit_min_height не отложены и отвечаются
+    без обращения к MinIO. Постановка задачи выполняется под арендой
+    JobLease видео, поэтому одновременные запросы из разных процессов
+    и реплик сервиса ставят задачу один раз. Отметка старше jit_request_ttl
+    (задача потеряна) не мешает поставить задачу снова; потребитель перед
+    кодированием еще раз сверяется с записью под арендой задачи.
+
+    nginx не отдает клиенту следующий ответ keepalive-соединения, пока
+    не завершилась копия запроса, поэтому эндпоинт вызывает submit:
+    проверка и постановка задачи выполняются в фоновой задаче, одной
+    на ступень видео.
+    """
+
+    def __init__(self, s3_service: S3Service, channel: aio_pika.abc.AbstractChannel, transcode_config,
+                 lease_ttl: float):
+        self.s3_service = s3_service
+        self.channel = channel
+        self.config = transcode_config
+        self.lease_ttl = lease_ttl
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def lease_name(video_uuid: str) -> str:
+        """Имя аренды постановки задач отложенных ступеней видео (jobs/<uuid>/demand/lease.json)."""
+        return f"{video_uuid}/demand"
+
+    def submit(self, video_uuid: str, playlist_name: str) -> str:
+        """
+        Обработка запроса медиаплейлиста без ожидания MinIO и RabbitMQ.
+
+        Возвращает ready (плейлист не может относиться к отложенной ступени)
+        или accepted (проверка и постановка задачи запущены в фоне).
+        """
+        height = self._deferrable_height(video_uuid, playlist_name)
+        if height is None:
+            return 'ready'
+        key = f"{video_uuid}:{height}"
+        if key not in self._tasks:
+            task = asyncio.create_task(self._request_in_background(video_uuid, playlist_name))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return 'accepted'
+
+    async def _request_in_background(self, video_uuid: str, playlist_name: str):
+        try:
+            await self.request(video_uuid, playlist_name)
+        except Exception as e:
+            print(f"Error requesting deferred rendition {playlist_name} of {video_uuid}: {e}")
+
+    def _deferrable_height(self, video_uuid: str, playlist_name: str) -> int | None:
+        """Высота ступени из имени медиаплейлиста, если ступень может быть отложенной."""
+        match = MEDIA_PLAYLIST_PATTERN.match(playlist_name)
+        if not match or match.group(2) != video_uuid or int(match.group(1)) < self.config.jit_min_height:
+            return None
+        return int(match.group(1))
+
+    async def request(self, video_uuid: str, playlist_name: str) -> str:
+        """
+        Обработка запроса медиаплейлиста playlist_name видео video_uuid.
+
+        Возвращает queued (задача поставлена), pending (уже в очереди
+        или кодируется) или ready (плейлист не относится к отложенной ступени).
+        """
+        height = self._deferrable_height(video_uuid, playlist_name)
+        if height is None:
+            return 'ready'
+
+        status, _, _ = await self._status(video_uuid, height)
+        if status != 'queued':
+            return status
+        async with JobLease(self.s3_service, self.lease_name(video_uuid), self.lease_ttl):
+            # Под арендой запись перечитывается: задачу мог поставить другой процесс
+            status, deferred, rendition = await self._status(video_uuid, height)
+            if status != 'queued':
+                return status
+            deferred.requested[rendition] = time.time()
+            await deferred.save(self.s3_service, video_uuid)
+            await self.channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=json.dumps({"uuid": video_uuid, "video_path": deferred.video_path,
+                                     "rendition": rendition}).encode(),
+                    content_type="application/json",
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    message_id=f"{video_uuid}:{rendition}"
+                ),
+                routing_key=DEFERRED_QUEUE
+            )
+        print(f"Queued deferred rendition {rendition} of {video_uuid}")
+        return 'queued'
+
+    async def _status(self, video_uuid: str, height: int) -> tuple[str, DeferredRenditions | None, str | None]:
+        """Состояние отложенной ступени высоты height: queued (задачу нужно поставить), pending или ready."""
+        deferred = await DeferredRenditions.load(self.s3_service, video_uuid)
+        if deferred is None:
+            return 'ready', None, None
+        rendition = next((
+            resolution for resolution in deferred.renditions
+            if min(int(side) for side in resolution.split(':')) == height
+        ), None)
+        if rendition is None:
+            return 'ready', deferred, None
+        requested_at = deferred.requested.get(rendition)
+        if requested_at is not None and time.time() - requested_at < self.config.jit_request_ttl:
+            return 'pending', deferred, rendition
+        return 'queued', deferred, rendition
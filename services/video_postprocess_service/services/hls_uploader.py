@@ -0,0 +1,193 @@
+import asyncio
+import os
+import time
+
+from services.metrics import JOB_UPLOAD_SECONDS
+from services.s3 import S3Service
+
+
+class HLSUploader:
+    """
+    Потоковая выгрузка HLS-файлов в MinIO во время кодирования.
+
+    Периодически перечитывает медиаплейлисты в каталоге вывода FFmpeg.
+    Сегмент считается готовым, как только FFmpeg добавил его в плейлист
+    (при -hls_flags temp_file и сегменты, и плейлисты пишутся через
+    временный файл и переименование). Готовые сегменты выгружаются и сразу
+    удаляются с диска, после них выгружается снимок плейлиста, поэтому
+    опубликованный плейлист никогда не ссылается на отсутствующий сегмент
+    или init-файл (#EXT-X-MAP).
+    Мастер-плейлист публикуется через publish_master только после
+    синхронизации перечисленных в нем рендишенов. Размеры и длительности
+    выгруженных сегментов запоминаются для расчета битрейта рендишенов.
+    Время синхронизаций суммируется (upload_seconds) и при успешном
+    выходе один раз на задачу попадает в гистограмму JOB_UPLOAD_SECONDS;
+    время отдельных запросов видно в S3_OPERATION_SECONDS.
+
+    Рендишен в одном fMP4-файле (сегменты адресуются EXT-X-BYTERANGE)
+    дописывается FFmpeg до конца кодирования, поэтому он выгружается
+    целиком (multipart-загрузкой), когда в плейлисте появился
+    #EXT-X-ENDLIST; размеры сегментов берутся из диапазонов байт.
+
+    Используется как асинхронный контекстный менеджер вокруг кодирования:
+    при успешном выходе выполняется финальная синхронизация, при ошибке
+    фоновая выгрузка отменяется.
+    """
+
+    MASTER_PLAYLIST = "master.m3u8"
+
+    def __init__(self, s3_service: S3Service, output_dir: str, s3_prefix: str, poll_interval: float = 1.0):
+        self.s3_service = s3_service
+        self.output_dir = output_dir
+        self.s3_prefix = s3_prefix
+        self.poll_interval = poll_interval
+        self._uploaded_segments: set[str] = set()
+        self._uploaded_playlists: dict[str, str] = {}
+        self._segment_stats: dict[str, list[tuple[float, int]]] = {}
+        self._task: asyncio.Task | None = None
+        self._sync_lock = asyncio.Lock()
+        self.upload_seconds = 0.0
+
+    async def __aenter__(self) -> 'HLSUploader':
+        self._task = asyncio.create_task(self._watch())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if exc_type is None:
+            await self.sync()
+            JOB_UPLOAD_SECONDS.observe(self.upload_seconds)
+
+    async def _watch(self):
+        """Фоновый цикл синхронизации каталога вывода."""
+        while True:
+            await self.sync()
+            await asyncio.sleep(self.poll_interval)
+
+    async def sync(self):
+        """Выгрузка новых готовых сегментов и изменившихся медиаплейлистов."""
+        async with self._sync_lock:
+            started = time.monotonic()
+            try:
+                await asyncio.gather(*(
+                    self._sync_playlist(filename) for filename in sorted(os.listdir(self.output_dir))
+                    if filename.endswith('.m3u8') and filename != self.MASTER_PLAYLIST
+                ))
+            finally:
+                self.upload_seconds += time.monotonic() - started
+
+    async def _sync_playlist(self, playlist_name: str):
+        """Выгрузка сегментов одного медиаплейлиста, затем самого плейлиста."""
+        try:
+            with open(os.path.join(self.output_dir, playlist_name)) as playlist_file:
+                content = playlist_file.read()
+        except FileNotFoundError:
+            return
+
+        if self._uploaded_playlists.get(playlist_name) == content:
+            return
+
+        entries = self.parse_segment_entries(content)
+        if any(length is not None for _, _, length in entries) and '#EXT-X-ENDLIST' not in content:
+            # Файл рендишена еще дописывается
+            return
+
+        new_segments = [
+            (segment_name, duration, length) for segment_name, duration, length in entries
+            if segment_name not in self._uploaded_segments
+        ]
+        new_files = list(dict.fromkeys(
+            [uri for uri in self.parse_map_uris(content) if uri not in self._uploaded_segments]
+            + [segment_name for segment_name, _, _ in new_segments]
+        ))
+        await self.s3_service.upload_files([
+            (os.path.join(self.output_dir, segment_name), self._s3_path(segment_name))
+            for segment_name in new_files
+        ])
+        stats = self._segment_stats.setdefault(playlist_name, [])
+        for segment_name, duration, length in new_segments:
+            if length is None:
+                length = os.path.getsize(os.path.join(self.output_dir, segment_name))
+            stats.append((duration, length))
+        for segment_name in new_files:
+            os.remove(os.path.join(self.output_dir, segment_name))
+            self._uploaded_segments.add(segment_name)
+        if new_segments:
+            print(f"Uploaded {len(new_segments)} segments of {playlist_name}")
+
+        await self.s3_service.upload_bytes(content.encode(), self._s3_path(playlist_name))
+        self._uploaded_playlists[playlist_name] = content
+
+    async def publish_master(self):
+        """Публикация мастер-плейлиста после выгрузки всех рендишенов."""
+        await self.s3_service.upload_file(
+            os.path.join(self.output_dir, self.MASTER_PLAYLIST),
+            self._s3_path(self.MASTER_PLAYLIST)
+        )
+        print(f"Uploaded: {self._s3_path(self.MASTER_PLAYLIST)}")
+
+    @property
+    def segment_count(self) -> int:
+        """Количество выгруженных сегментов."""
+        return sum(len(stats) for stats in self._segment_stats.values())
+
+    @property
+    def uploaded_bytes(self) -> int:
+        """Объем выгруженных сегментов."""
+        return sum(size for stats in self._segment_stats.values() for _, size in stats)
+
+    def bitrates(self, playlist_name: str) -> tuple[int, int] | None:
+        """
+        Пиковый и средний битрейт рендишена (бит/с) по выгруженным сегментам.
+        
+        Пиковый - максимальный битрейт отдельного сегмента (BANDWIDTH),
+        средний - общий объем, деленный на общую длительность
+        (AVERAGE-BANDWIDTH). None, если сегментов еще нет.
+        """
+        stats = [(duration, size) for duration, size in self._segment_stats.get(playlist_name, []) if duration > 0]
+        if not stats:
+            return None
+        peak = max(size * 8 / duration for duration, size in stats)
+        average = sum(size for _, size in stats) * 8 / sum(duration for duration, _ in stats)
+        return round(peak), round(average)
+
+    @staticmethod
+    def parse_segment_entries(playlist_content: str) -> list[tuple[str, float, int | None]]:
+        """
+        Сегменты в порядке воспроизведения: URI, длительность из #EXTINF
+        и длина из #EXT-X-BYTERANGE (None, если сегмент - отдельный файл).
+        """
+        entries = []
+        duration = 0.0
+        length = None
+        for line in playlist_content.splitlines():
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line.startswith('#EXT-X-BYTERANGE:'):
+                length = int(line[len('#EXT-X-BYTERANGE:'):].split('@')[0])
+            elif line and not line.startswith('#'):
+                entries.append((line, duration, length))
+                duration = 0.0
+                length = None
+        return entries
+
+    @staticmethod
+    def parse_map_uris(playlist_content: str) -> list[str]:
+        """URI init-файлов из #EXT-X-MAP."""
+        uris = []
+        for line in playlist_content.splitlines():
+            line = line.strip()
+            if line.startswith('#EXT-X-MAP:'):
+                for attribute in line[len('#EXT-X-MAP:'):].split(','):
+                    name, _, value = attribute.partition('=')
+                    if name.strip() == 'URI':
+                        uris.append(value.strip().strip('"'))
+        return uris
+
+    def _s3_path(self, filename: str) -> str:
+        return f"{self.s3_prefix}/{filename}"
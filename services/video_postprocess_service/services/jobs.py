@@ -0,0 +1,139 @@
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Literal
+
+from pydantic import BaseModel, Field, computed_field
+
+
+class EncodeProgress(BaseModel):
+    """
+    Прогресс одного запуска FFmpeg по данным -progress.
+
+    speed - во сколько раз быстрее реального времени идет кодирование,
+    speed_per_core - та же скорость в пересчете на одно выделенное ядро
+    (для оценки мощности: сколько секунд видео в секунду дает ядро).
+    """
+    label: str
+    threads: int | None = None
+    status: Literal['running', 'done', 'failed'] = 'running'
+    encoded_seconds: float = 0.0
+    speed: float | None = None
+    fps: float | None = None
+    started_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+    finished_at: float | None = None
+
+    @computed_field
+    @property
+    def speed_per_core(self) -> float | None:
+        if self.speed is None or not self.threads:
+            return None
+        return round(self.speed / self.threads, 3)
+
+    def update(self, fields: dict[str, str]):
+        """Обновление по одному блоку key=value из -progress."""
+        out_time_us = fields.get('out_time_us', 'N/A')
+        if out_time_us.lstrip('-').isdigit():
+            self.encoded_seconds = max(int(out_time_us), 0) / 1_000_000
+        speed = fields.get('speed', 'N/A').strip().rstrip('x')
+        if speed not in ('', 'N/A'):
+            self.speed = float(speed)
+        fps = fields.get('fps', '')
+        if fps:
+            self.fps = float(fps)
+        self.updated_at = time.time()
+
+    def finish(self, success: bool):
+        self.status = 'done' if success else 'failed'
+        self.finished_at = self.updated_at = time.time()
+
+
+class JobState(BaseModel):
+    """
+    Состояние задачи обработки видео (куска при распределенном кодировании
+    или отложенной ступени, кодируемой по первому запросу).
+
+    stage - этап: waiting (ожидание допуска), preparing, probing, encoding,
+    publishing, done или failed. encodes - все запуски FFmpeg задачи,
+    running_encodes - те, что выполняются сейчас.
+    """
+    uuid: str
+    kind: Literal['video', 'chunk', 'rendition'] = 'video'
+    video_path: str | None = None
+    stage: str = 'waiting'
+    duration: float | None = None
+    resolutions: list[str] = []
+    error: str | None = None
+    started_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+    finished_at: float | None = None
+    encodes: list[EncodeProgress] = []
+
+    @computed_field
+    @property
+    def running_encodes(self) -> list[str]:
+        return [encode.label for encode in self.encodes if encode.status == 'running']
+
+    @computed_field
+    @property
+    def seconds_since_update(self) -> float:
+        """Время с последнего обновления; растет у зависших задач."""
+        last_update = max([self.updated_at, *(encode.updated_at for encode in self.encodes)])
+        return round(time.time() - last_update, 1)
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+        self.updated_at = time.time()
+
+    def start_encode(self, label: str, threads: int | None = None) -> EncodeProgress:
+        encode = EncodeProgress(label=label, threads=threads)
+        self.encodes.append(encode)
+        return encode
+
+    def summary(self) -> dict:
+        """Краткое состояние для списка задач."""
+        return self.model_dump(exclude={'encodes'})
+
+
+class JobRegistry:
+    """
+    Состояние задач процесса для API статуса.
+
+    Выполняющиеся задачи хранятся все, завершенные - последние
+    history_size. Каждый процесс uvicorn видит только свои задачи.
+    """
+
+    def __init__(self, history_size: int = 100):
+        self.history_size = history_size
+        self._jobs: OrderedDict[str, JobState] = OrderedDict()
+
+    def start(self, uuid: str, video_path: str | None = None, kind: str = 'video') -> JobState:
+        job = JobState(uuid=uuid, video_path=video_path, kind=kind)
+        self._jobs.pop(uuid, None)
+        self._jobs[uuid] = job
+        return job
+
+    def finish(self, job: JobState, success: bool):
+        job.set_stage('done' if success else 'failed')
+        job.finished_at = job.updated_at
+        finished = [uuid for uuid, state in self._jobs.items() if state.finished_at is not None]
+        for uuid in finished[:max(len(finished) - self.history_size, 0)]:
+            del self._jobs[uuid]
+
+    def get(self, uuid: str) -> JobState | None:
+        return self._jobs.get(uuid)
+
+    def list(self) -> list[JobState]:
+        return list(reversed(self._jobs.values()))
+
+
+# Задача, в контексте которой выполняется текущая корутина (наследуется дочерними задачами asyncio)
+current_job: ContextVar[JobState | None] = ContextVar('current_job', default=None)
+
+
+def set_stage(stage: str):
+    """Смена этапа текущей задачи, если она есть."""
+    job = current_job.get()
+    if job is not None:
+        job.set_stage(stage)
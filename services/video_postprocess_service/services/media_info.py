@@ -0,0 +1,107 @@
+from pydantic import BaseModel
+
+# Поля ffprobe -show_entries, которые разбирает MediaInfo.from_ffprobe
+FFPROBE_ENTRIES = (
+    'format=duration,bit_rate'
+    ':stream=index,codec_type,codec_name,profile,level,pix_fmt,width,height,avg_frame_rate'
+    ':stream_side_data=rotation'
+)
+
+# Поля ffprobe для поиска ключевых кадров (вместе с -select_streams v:0)
+FFPROBE_KEYFRAME_ENTRIES = 'packet=pts_time,flags'
+
+
+def parse_keyframes(data: dict) -> list[float]:
+    """Времена ключевых кадров из JSON-вывода ffprobe с полями FFPROBE_KEYFRAME_ENTRIES."""
+    return sorted(
+        float(packet['pts_time']) for packet in data.get('packets', [])
+        if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A')
+    )
+
+
+def max_keyframe_interval(keyframes: list[float], end: float | None) -> float | None:
+    """Максимальный интервал между ключевыми кадрами, включая хвост до end."""
+    if not keyframes:
+        return None
+    boundaries = keyframes + ([end] if end else [])
+    return max((later - earlier for earlier, later in zip(boundaries, boundaries[1:])), default=0.0)
+
+
+class MediaInfo(BaseModel):
+    """
+    Параметры исходного видео, полученные одним вызовом ffprobe.
+
+    width/height - размер кадра в потоке, rotation - поворот из side data
+    (телефоны пишут вертикальное видео горизонтальным кадром с поворотом
+    на 90 градусов). FFmpeg при кодировании применяет поворот, поэтому
+    лестница разрешений выбирается по display_width/display_height.
+    keyframe_interval - максимальный интервал между ключевыми кадрами
+    в начале видео (None, если не измерялся).
+    """
+    duration: float | None = None
+    bit_rate: int | None = None
+    width: int
+    height: int
+    rotation: int = 0
+    frame_rate: float | None = None
+    video_codec: str | None = None
+    video_profile: str | None = None
+    video_level: int | None = None
+    pix_fmt: str | None = None
+    has_audio: bool = False
+    audio_codec: str | None = None
+    audio_profile: str | None = None
+    keyframe_interval: float | None = None
+
+    @property
+    def is_rotated(self) -> bool:
+        """Повернут ли кадр на 90 или 270 градусов."""
+        return abs(self.rotation) % 180 == 90
+
+    @property
+    def display_width(self) -> int:
+        return self.height if self.is_rotated else self.width
+
+    @property
+    def display_height(self) -> int:
+        return self.width if self.is_rotated else self.height
+
+    def summary(self) -> dict:
+        """Параметры для сообщений другим сервисам (с размерами кадра с учетом поворота)."""
+        return {
+            **self.model_dump(exclude={'width', 'height'}),
+            'width': self.display_width,
+            'height': self.display_height
+        }
+
+    @classmethod
+    def from_ffprobe(cls, data: dict) -> 'MediaInfo':
+        """Разбор JSON-вывода ffprobe с полями FFPROBE_ENTRIES."""
+        streams = data.get('streams', [])
+        video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+        if video is None:
+            raise ValueError("No video stream found")
+        audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), {})
+        media_format = data.get('format', {})
+
+        frame_rate = None
+        numerator, _, denominator = video.get('avg_frame_rate', '0/0').partition('/')
+        if float(numerator or 0) > 0 and float(denominator or 0) > 0:
+            frame_rate = float(numerator) / float(denominator)
+
+        return cls(
+            duration=float(media_format['duration']) if media_format.get('duration') else None,
+            bit_rate=int(media_format['bit_rate']) if media_format.get('bit_rate') else None,
+            width=video['width'],
+            height=video['height'],
+            rotation=next((int(side_data['rotation']) for side_data in video.get('side_data_list', [])
+                           if 'rotation' in side_data), 0),
+            frame_rate=frame_rate,
+            video_codec=video.get('codec_name'),
+            video_profile=video.get('profile'),
+            video_level=video.get('level'),
+            pix_fmt=video.get('pix_fmt'),
+            has_audio=bool(audio),
+            audio_codec=audio.get('codec_name'),
+            audio_profile=audio.get('profile')
+        )
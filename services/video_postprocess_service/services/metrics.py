@@ -0,0 +1,87 @@
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+
+# Корзины длительностей: от долей секунды (запросы к S3) до часов (кодирование длинных видео)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+# Корзины объемов: от 1 МБ до 64 ГБ
+BYTES_BUCKETS = tuple(2 ** power for power in range(20, 37, 2))
+
+# Корзины количества сегментов в задаче
+SEGMENTS_BUCKETS = (1, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+STAGE_SECONDS = Histogram(
+    'video_postprocess_stage_seconds',
+    'Длительность этапов обработки видео (download, probe, job)',
+    ['stage'],
+    buckets=DURATION_BUCKETS
+)
+
+ENCODE_SECONDS = Histogram(
+    'video_postprocess_encode_seconds',
+    'Длительность кодирования рендишена (mode: encode, remux, single_decode, chunk, stitch)',
+    ['rendition', 'mode'],
+    buckets=DURATION_BUCKETS
+)
+
+S3_OPERATION_SECONDS = Histogram(
+    'video_postprocess_s3_operation_seconds',
+    'Длительность операций с MinIO (upload, download, read_range, head, delete, list, copy)',
+    ['operation'],
+    buckets=DURATION_BUCKETS
+)
+
+S3_BYTES = Counter(
+    'video_postprocess_s3_bytes',
+    'Объем переданных в MinIO и из MinIO данных',
+    ['direction']
+)
+
+JOB_BYTES = Histogram(
+    'video_postprocess_job_bytes',
+    'Объем исходника (in) и опубликованных сегментов (out) одной задачи',
+    ['direction'],
+    buckets=BYTES_BUCKETS
+)
+
+JOB_SEGMENTS = Histogram(
+    'video_postprocess_job_segments',
+    'Количество опубликованных HLS-сегментов одной задачи',
+    buckets=SEGMENTS_BUCKETS
+)
+
+JOB_UPLOAD_SECONDS = Histogram(
+    'video_postprocess_job_upload_seconds',
+    'Суммарное время выгрузки HLS одной задачи в MinIO (синхронизации во время и после кодирования)',
+    buckets=DURATION_BUCKETS
+)
+
+QUEUE_WAIT_SECONDS = Histogram(
+    'video_postprocess_queue_wait_seconds',
+    'Время от публикации сообщения до его получения обработчиком',
+    buckets=DURATION_BUCKETS
+)
+
+JOBS = Counter(
+    'video_postprocess_jobs',
+    'Завершенные задачи: status - success или failure, stage - этап, на котором задача упала',
+    ['status', 'stage']
+)
+
+# Направление передачи для операций S3Service
+S3_DIRECTIONS = {'upload': 'out', 'download': 'in', 'read_range': 'in'}
+
+
+def render_metrics() -> bytes:
+    """
+    Метрики в текстовом формате Prometheus.
+
+    При нескольких процессах uvicorn (PROMETHEUS_MULTIPROC_DIR задан)
+    метрики собираются со всех процессов.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -1,33 +1,177 @@
 import asyncio
 import aio_pika
 import json
+import time
+from datetime import datetime, timezone
+
+# Заголовки сообщений, которые ведет RetryTopology
+ATTEMPT_HEADER = "x-attempt"
+FAILURE_REASON_HEADER = "x-failure-reason"
+FAILED_AT_HEADER = "x-failed-at"
+
+
+class RetryTopology:
+    """
+    Повторные попытки и dead-letter очередь для очереди задач.
+
+    Число неудачных попыток хранится в заголовке x-attempt сообщения.
+    Упавшее сообщение переиздается в очередь задержки <queue>.retry.<N>s
+    без потребителей: по истечении x-message-ttl RabbitMQ через
+    dead-letter exchange возвращает его в исходную очередь. Задержка
+    растет экспоненциально от номера попытки; у каждой задержки своя
+    очередь, поэтому короткие задержки не ждут за длинными. После
+    max_attempts попыток (или сразу для сообщений, которые невозможно
+    обработать) сообщение с причиной ошибки уходит в <queue>.dead,
+    откуда его можно вернуть в работу через replay.
+
+    .. note::
+        Аргументы исходной очереди не меняются (ее также объявляет
+        channel_actions_service), поэтому упавшее сообщение переиздается
+        обработчиком явно, а не через x-dead-letter-exchange исходной очереди.
+    """
+
+    def __init__(self, queue: str, config):
+        self.queue = queue
+        self.config = config
+        self.dead_queue = f"{queue}.dead"
+        self.channel = None
+
+    async def declare(self, channel: aio_pika.abc.AbstractChannel):
+        """Объявление очередей задержки и dead-letter очереди."""
+        self.channel = channel
+        for attempt in range(1, self.config.max_attempts):
+            await channel.declare_queue(self.retry_queue(attempt), durable=True, arguments={
+                "x-message-ttl": int(self.delay(attempt) * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": self.queue
+            })
+        await channel.declare_queue(self.dead_queue, durable=True)
+
+    def delay(self, attempt: int) -> float:
+        """Задержка перед попыткой после attempt неудачных, секунды."""
+        return min(self.config.base_delay * 2 ** (attempt - 1), self.config.max_delay)
+
+    def retry_queue(self, attempt: int) -> str:
+        """Очередь задержки после attempt неудачных попыток (имя включает задержку: TTL очереди неизменяем)."""
+        return f"{self.queue}.retry.{self.delay(attempt):g}s"
+
+    @staticmethod
+    def attempts(message: aio_pika.abc.AbstractIncomingMessage) -> int:
+        """Число неудачных попыток обработки сообщения."""
+        return int((message.headers or {}).get(ATTEMPT_HEADER, 0))
+
+    async def retry(self, message: aio_pika.abc.AbstractIncomingMessage, reason: str):
+        """
+        Отложенный повтор упавшего сообщения или перенос в dead-letter
+        очередь, если попытки исчерпаны. Исходное сообщение подтверждается.
+        """
+        attempt = self.attempts(message) + 1
+        if attempt >= self.config.max_attempts:
+            await self.dead_letter(message, reason, attempt)
+            return
+
+        delay = self.delay(attempt)
+        # timestamp - момент возврата в основную очередь (для метрики ожидания в очереди)
+        returns_at = datetime.fromtimestamp(time.time() + delay, tz=timezone.utc)
+        await self._republish(message, self.retry_queue(attempt), {ATTEMPT_HEADER: attempt}, returns_at)
+        await message.ack()
+        print(f"Retrying message in {delay:g}s (attempt {attempt} failed): {reason}")
+
+    async def dead_letter(self, message: aio_pika.abc.AbstractIncomingMessage, reason: str,
+                          attempt: int | None = None):
+        """Перенос сообщения в dead-letter очередь с причиной ошибки."""
+        await self._republish(message, self.dead_queue, {
+            ATTEMPT_HEADER: attempt if attempt is not None else self.attempts(message) + 1,
+            FAILURE_REASON_HEADER: reason[:1000],
+            FAILED_AT_HEADER: time.time()
+        })
+        await message.ack()
+        print(f"Message dead-lettered to {self.dead_queue}: {reason}")
+
+    async def dead_letter_count(self) -> int:
+        """Количество сообщений в dead-letter очереди."""
+        dead_queue = await self.channel.declare_queue(self.dead_queue, durable=True)
+        return dead_queue.declaration_result.message_count
+
+    async def replay(self, limit: int | None = None) -> int:
+        """
+        Возврат сообщений из dead-letter очереди в исходную очередь
+        со сброшенным счетчиком попыток. Возвращает число перенесенных.
+        """
+        dead_queue = await self.channel.declare_queue(self.dead_queue, durable=True)
+        replayed = 0
+        while limit is None or replayed < limit:
+            message = await dead_queue.get(fail=False)
+            if message is None:
+                break
+            headers = {
+                key: value for key, value in (message.headers or {}).items()
+                if key not in (ATTEMPT_HEADER, FAILURE_REASON_HEADER, FAILED_AT_HEADER)
+            }
+            await self._publish(message, self.queue, headers, datetime.now(timezone.utc))
+            await message.ack()
+            replayed += 1
+        print(f"Replayed {replayed} messages from {self.dead_queue}")
+        return replayed
+
+    async def _republish(self, message: aio_pika.abc.AbstractIncomingMessage, routing_key: str,
+                         headers: dict, timestamp: datetime | None = None):
+        """Публикация копии сообщения с дополненными заголовками."""
+        await self._publish(message, routing_key, {**(message.headers or {}), **headers}, timestamp)
+
+    async def _publish(self, message: aio_pika.abc.AbstractIncomingMessage, routing_key: str,
+                       headers: dict, timestamp: datetime | None = None):
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=message.body,
+                headers=headers,
+                content_type=message.content_type,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                message_id=message.message_id,
+                timestamp=timestamp
+            ),
+            routing_key=routing_key
+        )
+
 
 class RabbitMQClient:
-    def __init__(self, config):
+    def __init__(self, config, retry_config):
         self.config = config
+        self.retry_config = retry_config
         self.connection = None
-        
+
     async def connect(self):
-        self.connection = await aio_pika.connect_robust(self.config.rabbitmq_url)
+        self.connection = await aio_pika.connect_robust(self.config.url)
         self.channel = await self.connection.channel()
-        
+
         await self.channel.declare_queue("convert_video_to_hls", durable=True)
-    
+
     async def publish(self, queue: str, message: str):
         await self.channel.default_exchange.publish(
             aio_pika.Message(body=message.encode()),
             routing_key=queue
         )
-    
+
     async def consume(self, queue: str, callback):
+        """Потребление очереди; неуспешные сообщения повторяются с задержкой через RetryTopology."""
         queue_obj = await self.channel.declare_queue(queue, durable=True)
-        
+        retry = RetryTopology(queue, self.retry_config)
+        await retry.declare(self.channel)
+
         async for message in queue_obj:
-            async with message.process():
+            try:
                 success = await callback(json.loads(message.body.decode()))
-                if not success:
-                    await message.nack(requeue=True)
-    
+            except json.JSONDecodeError as e:
+                await retry.dead_letter(message, f"Invalid JSON: {e}")
+                continue
+            except Exception as e:
+                await retry.retry(message, str(e))
+                continue
+            if success:
+                await message.ack()
+            else:
+                await retry.retry(message, "Callback returned failure")
+
     async def close(self):
         if self.connection:
             await self.connection.close()
@@ -1,37 +1,108 @@
 import asyncio
-import aiofiles
 import json
-import boto3
-from botocore.config import Config
+import os
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import aiofiles
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+
+from services.metrics import S3_OPERATION_SECONDS, S3_BYTES, S3_DIRECTIONS
+
+# Максимальный объект для CopyObject и размер части UploadPartCopy для копирования больших объектов
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3
+MAX_COPY_PART_SIZE = 512 * 1024 ** 2
+
+
+class S3Metrics:
+    """
+    Счетчики операций с S3.
+
+    Для каждой операции (download, upload, delete, ...) накапливает
+    количество вызовов, суммарное время и количество переданных байт
+    и дублирует их в метрики Prometheus.
+    """
+
+    def __init__(self):
+        self.operations: dict[str, dict[str, float]] = {}
+
+    def record(self, operation: str, seconds: float, nbytes: int = 0):
+        stats = self.operations.setdefault(operation, {"count": 0, "seconds": 0.0, "bytes": 0})
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        stats["bytes"] += nbytes
+        S3_OPERATION_SECONDS.labels(operation).observe(seconds)
+        if operation in S3_DIRECTIONS:
+            S3_BYTES.labels(S3_DIRECTIONS[operation]).inc(nbytes)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        return {operation: dict(stats) for operation, stats in self.operations.items()}
 
 
 class S3Service:
+    """
+    Асинхронный клиент MinIO/S3 на aiobotocore.
+
+    Держит один клиент с явно заданным размером пула соединений,
+    ограничивает число одновременных передач семафором, большие файлы
+    выгружает multipart-загрузкой с параллельной отправкой частей.
+    Перед использованием нужно вызвать connect(), по завершении close().
+    """
+
     def __init__(self, config):
         self.config = config
-        self.client = boto3.client(
-            's3',
-            endpoint_url=config.endpoint_url,
-            aws_access_key_id=config.access_key,
-            aws_secret_access_key=config.secret_key,
-            region_name=config.region,
-            config=Config(signature_version='s3v4')
-        )
         self.video_files_folder = "video_files"
-        self._ensure_bucket_and_policy()
-        
-    def _ensure_bucket_and_policy(self):
+        self.client = None
+        self.metrics = S3Metrics()
+        self._exit_stack = AsyncExitStack()
+        self._transfers = asyncio.Semaphore(config.max_concurrency)
+
+    async def connect(self, bootstrap: bool = True):
+        """
+        Создание клиента и настройка bucket.
+
+        bootstrap=False - без настройки bucket (ее уже выполнил
+        HTTP-процесс в режиме супервизора).
+        """
+        self.client = await self._exit_stack.enter_async_context(
+            get_session().create_client(
+                's3',
+                endpoint_url=self.config.endpoint_url,
+                aws_access_key_id=self.config.access_key,
+                aws_secret_access_key=self.config.secret_key,
+                region_name=self.config.region,
+                config=AioConfig(
+                    signature_version='s3v4',
+                    max_pool_connections=self.config.max_pool_connections
+                )
+            )
+        )
+        if bootstrap:
+            await self._ensure_bucket_and_policy()
+
+    async def close(self):
+        """Закрытие клиента и пула соединений."""
+        await self._exit_stack.aclose()
+        self.client = None
+
+    async def _ensure_bucket_and_policy(self):
         """Создает bucket и настраивает политику доступа как в Go коде."""
         try:
             # Проверяем существует ли bucket
-            self.client.head_bucket(Bucket=self.config.bucket)
+            await self.client.head_bucket(Bucket=self.config.bucket)
             print(f"Bucket {self.config.bucket} already exists")
         except Exception:
             # Создаем bucket если не существует
-            self.client.create_bucket(Bucket=self.config.bucket)
-            print(f"Created bucket {self.config.bucket}")
-        
+            try:
+                await self.client.create_bucket(Bucket=self.config.bucket)
+                print(f"Created bucket {self.config.bucket}")
+            except self.client.exceptions.BucketAlreadyOwnedByYou:
+                # bucket одновременно создал другой процесс
+                print(f"Bucket {self.config.bucket} already exists")
+
         try:
-            self.client.put_object(
+            await self.client.put_object(
                 Bucket=self.config.bucket,
                 Key=f"{self.video_files_folder}/",
                 Body=b''
@@ -39,7 +110,7 @@ class S3Service:
             print(f"Created folder {self.video_files_folder}/")
         except Exception as e:
             print(f"Folder {self.video_files_folder} already exists or error: {e}")
-        
+
         policy = {
             "Version": "2012-10-17",
             "Statement": [
@@ -51,53 +122,287 @@ class S3Service:
                 }
             ]
         }
-        
+
         try:
-            self.client.put_bucket_policy(
+            await self.client.put_bucket_policy(
                 Bucket=self.config.bucket,
                 Policy=json.dumps(policy)
             )
             print("Bucket policy set for public read access to video_files/*")
         except Exception as e:
             print(f"Error setting bucket policy: {e}")
-        
-    async def download_file(self, s3_path: str, local_path: str):
-        """Скачивание файла из S3 (аналог FGetObject)."""
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            None, 
-            lambda: self.client.download_file(self.config.bucket, s3_path, local_path)
+
+    @asynccontextmanager
+    async def _measure(self, operation: str, nbytes: int = 0):
+        """Ограничение параллельности и учет времени и объема операции."""
+        async with self._transfers:
+            transfer = {"bytes": nbytes}
+            started = time.perf_counter()
+            yield transfer
+            self.metrics.record(operation, time.perf_counter() - started, transfer["bytes"])
+
+    async def download_file(self, s3_path: str, local_path: str, digest=None):
+        """
+        Скачивание файла из S3 (аналог FGetObject), большие файлы скачиваются параллельными диапазонами.
+
+        digest - объект hashlib, который дополняется содержимым файла:
+        при последовательном скачивании - по мере получения частей,
+        при параллельном (части приходят не по порядку) - чтением
+        скачанного файла из page cache.
+        """
+        size = await self.get_file_size(s3_path)
+        if size >= self.config.multipart_threshold:
+            await self._ranged_download(s3_path, local_path, size)
+            if digest is not None:
+                await asyncio.to_thread(self._hash_file, local_path, digest)
+            return
+
+        async with self._measure('download') as transfer:
+            response = await self.client.get_object(Bucket=self.config.bucket, Key=s3_path)
+            # __aenter__ StreamingBody возвращает ответ aiohttp, а не сам StreamingBody:
+            # контекст нужен только для освобождения соединения
+            body = response['Body']
+            async with body, aiofiles.open(local_path, 'wb') as local_file:
+                async for chunk in body.iter_chunks(self.config.multipart_chunksize):
+                    await local_file.write(chunk)
+                    if digest is not None:
+                        # hashlib отпускает GIL на больших буферах
+                        await asyncio.to_thread(digest.update, chunk)
+                    transfer["bytes"] += len(chunk)
+
+    def _hash_file(self, local_path: str, digest):
+        with open(local_path, 'rb') as local_file:
+            while chunk := local_file.read(self.config.multipart_chunksize):
+                digest.update(chunk)
+
+    async def _ranged_download(self, s3_path: str, local_path: str, size: int):
+        """Скачивание параллельными Range-запросами с записью частей по смещениям."""
+        part_size = self.config.multipart_chunksize
+        part_slots = asyncio.Semaphore(self.config.multipart_concurrency)
+        started = time.perf_counter()
+
+        async with aiofiles.open(local_path, 'wb') as local_file:
+            await local_file.truncate(size)
+
+        async def download_part(offset: int):
+            async with part_slots:
+                data = await self.read_range(s3_path, offset, part_size)
+                async with aiofiles.open(local_path, 'r+b') as local_file:
+                    await local_file.seek(offset)
+                    await local_file.write(data)
+
+        await asyncio.gather(*(download_part(offset) for offset in range(0, size, part_size)))
+        self.metrics.record('download', time.perf_counter() - started, size)
+
+    async def read_range(self, s3_path: str, offset: int, length: int) -> bytes:
+        """Чтение диапазона байт объекта (Range-запрос)."""
+        async with self._measure('read_range') as transfer:
+            response = await self.client.get_object(
+                Bucket=self.config.bucket,
+                Key=s3_path,
+                Range=f"bytes={offset}-{offset + length - 1}"
+            )
+            body = response['Body']
+            async with body:
+                data = await body.read()
+            transfer["bytes"] = len(data)
+        return data
+
+    async def get_bytes(self, s3_path: str) -> bytes | None:
+        """Чтение небольшого объекта целиком в память; None, если объекта нет."""
+        async with self._measure('download') as transfer:
+            try:
+                response = await self.client.get_object(Bucket=self.config.bucket, Key=s3_path)
+            except self.client.exceptions.NoSuchKey:
+                return None
+            body = response['Body']
+            async with body:
+                data = await body.read()
+            transfer["bytes"] = len(data)
+        return data
+
+    async def generate_presigned_url(self, s3_path: str, expires_in: int) -> str:
+        """Временная ссылка на чтение объекта (аналог PresignedGetObject)."""
+        return await self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.config.bucket, 'Key': s3_path},
+            ExpiresIn=expires_in
         )
 
+    async def get_file_size(self, s3_path: str) -> int:
+        """Размер объекта в S3 (аналог StatObject)."""
+        async with self._measure('head'):
+            response = await self.client.head_object(Bucket=self.config.bucket, Key=s3_path)
+        return response['ContentLength']
+
     async def upload_file(self, local_path: str, s3_path: str):
-        """Загрузка файла в S3 (аналог FPutObject)."""
-        loop = asyncio.get_event_loop()
-        
-        content_type = self._get_content_type(local_path)
-        
-        await loop.run_in_executor(
-            None,
-            lambda: self.client.upload_file(
-                local_path, 
-                self.config.bucket, 
-                s3_path,
-                ExtraArgs={'ContentType': content_type}
+        """Загрузка файла в S3 (аналог FPutObject), большие файлы загружаются частями."""
+        size = os.path.getsize(local_path)
+        if size >= self.config.multipart_threshold:
+            await self._multipart_upload(local_path, s3_path, size)
+            return
+
+        async with aiofiles.open(local_path, 'rb') as local_file:
+            data = await local_file.read()
+        await self.upload_bytes(data, s3_path)
+
+    async def upload_files(self, files: list[tuple[str, str]]):
+        """Параллельная загрузка списка пар (локальный путь, путь в S3)."""
+        await asyncio.gather(*(self.upload_file(local_path, s3_path) for local_path, s3_path in files))
+
+    async def upload_bytes(self, data: bytes, s3_path: str):
+        """Загрузка содержимого из памяти в S3 (аналог PutObject)."""
+        async with self._measure('upload', len(data)):
+            await self.client.put_object(
+                Bucket=self.config.bucket,
+                Key=s3_path,
+                Body=data,
+                **self._object_metadata(s3_path)
             )
+
+    async def _multipart_upload(self, local_path: str, s3_path: str, size: int):
+        """Multipart-загрузка с параллельной отправкой частей."""
+        upload = await self.client.create_multipart_upload(
+            Bucket=self.config.bucket,
+            Key=s3_path,
+            **self._object_metadata(s3_path)
         )
+        upload_id = upload['UploadId']
+        part_size = self.config.multipart_chunksize
+        part_slots = asyncio.Semaphore(self.config.multipart_concurrency)
+        started = time.perf_counter()
+
+        async def upload_part(part_number: int) -> dict:
+            async with part_slots, self._transfers:
+                async with aiofiles.open(local_path, 'rb') as local_file:
+                    await local_file.seek((part_number - 1) * part_size)
+                    data = await local_file.read(part_size)
+                response = await self.client.upload_part(
+                    Bucket=self.config.bucket,
+                    Key=s3_path,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=data
+                )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+        try:
+            part_count = (size + part_size - 1) // part_size
+            parts = await asyncio.gather(*(upload_part(number) for number in range(1, part_count + 1)))
+            await self.client.complete_multipart_upload(
+                Bucket=self.config.bucket,
+                Key=s3_path,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            await self.client.abort_multipart_upload(Bucket=self.config.bucket, Key=s3_path, UploadId=upload_id)
+            raise
+        self.metrics.record('upload', time.perf_counter() - started, size)
+
+    async def list_files(self, prefix: str) -> list[tuple[str, int]]:
+        """Ключи и размеры объектов с префиксом (аналог ListObjects)."""
+        files = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        async with self._measure('list'):
+            async for page in paginator.paginate(Bucket=self.config.bucket, Prefix=prefix):
+                files.extend((item['Key'], item['Size']) for item in page.get('Contents', []))
+        return files
+
+    async def copy_file(self, source_path: str, s3_path: str, size: int):
+        """
+        Копирование объекта на стороне S3 (аналог CopyObject) с сохранением
+        Content-Type и Cache-Control. Объекты больше лимита CopyObject
+        (5 ГБ) копируются частями через UploadPartCopy.
+        """
+        copy_source = {'Bucket': self.config.bucket, 'Key': source_path}
+        if size <= MAX_COPY_OBJECT_SIZE:
+            async with self._measure('copy'):
+                await self.client.copy_object(Bucket=self.config.bucket, Key=s3_path, CopySource=copy_source)
+            return
+
+        upload = await self.client.create_multipart_upload(
+            Bucket=self.config.bucket,
+            Key=s3_path,
+            **self._object_metadata(s3_path)
+        )
+        upload_id = upload['UploadId']
+        part_size = max(self.config.multipart_chunksize, MAX_COPY_PART_SIZE)
+        part_slots = asyncio.Semaphore(self.config.multipart_concurrency)
+        started = time.perf_counter()
+
+        async def copy_part(part_number: int) -> dict:
+            offset = (part_number - 1) * part_size
+            async with part_slots, self._transfers:
+                response = await self.client.upload_part_copy(
+                    Bucket=self.config.bucket,
+                    Key=s3_path,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    CopySource=copy_source,
+                    CopySourceRange=f"bytes={offset}-{min(offset + part_size, size) - 1}"
+                )
+                return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+        try:
+            part_count = (size + part_size - 1) // part_size
+            parts = await asyncio.gather(*(copy_part(number) for number in range(1, part_count + 1)))
+            await self.client.complete_multipart_upload(
+                Bucket=self.config.bucket,
+                Key=s3_path,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            await self.client.abort_multipart_upload(Bucket=self.config.bucket, Key=s3_path, UploadId=upload_id)
+            raise
+        self.metrics.record('copy', time.perf_counter() - started)
 
     async def delete_file(self, s3_path: str):
         """Удаление файла из S3 (аналог RemoveObject)."""
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            None,
-            lambda: self.client.delete_object(Bucket=self.config.bucket, Key=s3_path)
-        )
-    
+        async with self._measure('delete'):
+            await self.client.delete_object(Bucket=self.config.bucket, Key=s3_path)
+
+    async def delete_files(self, s3_paths: list[str]):
+        """Пакетное удаление файлов из S3 (по 1000 ключей на запрос, пакеты параллельно)."""
+        async def delete_batch(batch: list[str]):
+            async with self._measure('delete'):
+                await self.client.delete_objects(
+                    Bucket=self.config.bucket,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+
+        await asyncio.gather(*(delete_batch(s3_paths[i:i + 1000]) for i in range(0, len(s3_paths), 1000)))
+
+    def _object_metadata(self, s3_path: str) -> dict[str, str]:
+        """Content-Type объекта и Cache-Control для опубликованных HLS-файлов."""
+        metadata = {'ContentType': self._get_content_type(s3_path)}
+        cache_control = self._get_cache_control(s3_path)
+        if cache_control:
+            metadata['CacheControl'] = cache_control
+        return metadata
+
+    def _get_cache_control(self, s3_path: str) -> str | None:
+        """
+        Cache-Control по типу объекта в video_files/: сегменты и init-файлы
+        неизменяемы, плейлисты перезаписываются. Остальные объекты
+        (исходники, служебные файлы задач) не кешируются.
+        """
+        if not s3_path.startswith(f"{self.video_files_folder}/"):
+            return None
+        if s3_path.endswith('.m3u8'):
+            return self.config.playlist_cache_control
+        if s3_path.endswith(('.ts', '.mp4', '.m4s')):
+            return self.config.segment_cache_control
+        return None
+
     def _get_content_type(self, filename: str) -> str:
         """Определение content type как в Go."""
         if filename.endswith('.m3u8'):
             return 'application/vnd.apple.mpegurl'
         elif filename.endswith('.ts'):
             return 'video/MP2T'
+        elif filename.endswith(('.mp4', '.m4s')):
+            return 'video/mp4'
         else:
             return 'application/octet-stream'
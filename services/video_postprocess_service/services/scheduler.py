@@ -0,0 +1,135 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import aio_pika
+
+# Заголовок с оценкой стоимости задачи (секунды видео 1080p)
+JOB_COST_HEADER = "x-job-cost"
+
+
+class JobScheduler:
+    """
+    Планировщик задач по стоимости: короткие задачи вперед длинных.
+
+    Задачи из входной очереди раскладываются route по очередям
+    <queue>.short и <queue>.long по оценке стоимости. Планировщик держит
+    max_concurrent_jobs слотов; освободившийся слот забирает сообщение
+    (basic.get) из очереди, выбранной взвешенным циклическим обходом
+    (smooth weighted round-robin): при весах 3:1 из четырех задач три
+    берутся из short и одна из long, если обе очереди не пусты. Если
+    выбранная очередь пуста, берется задача из другой, поэтому слоты
+    не простаивают. Длинных задач одновременно выполняется не больше
+    long_max_jobs.
+
+    С admission слот берется через AdmissionController.acquire: сообщение
+    забирается только при свободных ресурсах машины.
+    """
+
+    def __init__(self, queue: str, job_config,
+                 handler: Callable[[aio_pika.abc.AbstractIncomingMessage], Awaitable[asyncio.Task]],
+                 admission=None):
+        self.job_config = job_config
+        self.handler = handler
+        self.admission = admission
+        self.short_queue = f"{queue}.short"
+        self.long_queue = f"{queue}.long"
+        self.weights = {self.short_queue: job_config.short_weight, self.long_queue: job_config.long_weight}
+        self.channel = None
+        self._queues = {}
+        self._current_weights = {name: 0 for name in self.weights}
+        self._slots = asyncio.Semaphore(job_config.max_concurrent_jobs)
+        self._running_long = 0
+        self._task: asyncio.Task | None = None
+
+    async def start(self, channel: aio_pika.abc.AbstractChannel):
+        """Объявление очередей классов задач и запуск цикла выборки."""
+        self.channel = channel
+        for name in self.weights:
+            self._queues[name] = await channel.declare_queue(name, durable=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def queue_for(self, cost: float | None) -> str:
+        """Очередь для задачи; задача без оценки считается длинной."""
+        if cost is not None and cost <= self.job_config.short_job_max_cost:
+            return self.short_queue
+        return self.long_queue
+
+    async def route(self, message: aio_pika.abc.AbstractIncomingMessage, cost: float | None):
+        """Перекладывание сообщения из входной очереди в очередь его класса."""
+        queue = self.queue_for(cost)
+        headers = dict(message.headers or {})
+        if cost is not None:
+            headers[JOB_COST_HEADER] = round(cost, 1)
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=message.body,
+                headers=headers,
+                content_type=message.content_type,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                message_id=message.message_id,
+                timestamp=message.timestamp
+            ),
+            routing_key=queue
+        )
+        await message.ack()
+        print(f"Routed job to {queue}" + (f" (cost {cost:.0f})" if cost is not None else ""))
+
+    def pick_order(self) -> list[str]:
+        """Порядок опроса очередей для следующего слота (smooth weighted round-robin)."""
+        for name, weight in self.weights.items():
+            self._current_weights[name] += weight
+        return sorted(self.weights, key=lambda name: self._current_weights[name], reverse=True)
+
+    async def _run(self):
+        """Цикл выборки: ожидание свободного слота и запуск следующей задачи."""
+        while True:
+            await self._acquire_slot()
+            try:
+                queue, message = await self._next_message()
+            except BaseException:
+                self._release_slot()
+                raise
+            task = await self.handler(message)
+            is_long = queue == self.long_queue
+            if is_long:
+                self._running_long += 1
+            task.add_done_callback(lambda _, is_long=is_long: self._release(is_long))
+
+    async def _next_message(self) -> tuple[str, aio_pika.abc.AbstractIncomingMessage]:
+        """Сообщение из первой непустой очереди в порядке pick_order."""
+        while True:
+            order = self.pick_order()
+            for name in order:
+                if name == self.long_queue and self.job_config.long_max_jobs is not None \
+                        and self._running_long >= self.job_config.long_max_jobs:
+                    continue
+                message = await self._queues[name].get(fail=False)
+                if message is not None:
+                    self._current_weights[name] -= sum(self.weights.values())
+                    return name, message
+            # Очереди пусты: откат начисленных весов, чтобы простой не копил очередность
+            for name, weight in self.weights.items():
+                self._current_weights[name] -= weight
+            await asyncio.sleep(self.job_config.scheduler_poll_interval)
+
+    async def _acquire_slot(self):
+        if self.admission:
+            await self.admission.acquire()
+        else:
+            await self._slots.acquire()
+
+    def _release_slot(self):
+        if self.admission:
+            self.admission.release()
+        else:
+            self._slots.release()
+
+    def _release(self, is_long: bool):
+        if is_long:
+            self._running_long -= 1
+        self._release_slot()
@@ -0,0 +1,184 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import tempfile
+import time
+
+from services.jobs import JobState
+
+# Период проверки процессов-потребителей, секунды
+MONITOR_INTERVAL = 0.5
+
+
+def run_worker(index: int, status_queue):
+    """Точка входа процесса-потребителя."""
+    asyncio.run(_worker_main(index, status_queue))
+
+
+async def _worker_main(index: int, status_queue):
+    """
+    Процесс-потребитель: VideoProcessor без HTTP-сервера.
+
+    Завершается по SIGTERM/SIGINT, состояние задач периодически
+    отправляется супервизору через status_queue.
+    """
+    from config import RABBITMQ_SETTINGS, MINIO_SETTINGS, TRANSCODE_SETTINGS, JOB_SETTINGS, \
+        DISTRIBUTED_SETTINGS, RETRY_SETTINGS, SUPERVISOR_SETTINGS
+    from services.video_processor import VideoProcessor
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    processor = VideoProcessor(RABBITMQ_SETTINGS, MINIO_SETTINGS, TRANSCODE_SETTINGS, JOB_SETTINGS,
+                               DISTRIBUTED_SETTINGS, RETRY_SETTINGS)
+    await processor.start(bootstrap_storage=False)
+    print(f"Encoding worker {index} started (pid {os.getpid()})")
+    try:
+        while not stopping.is_set():
+            status_queue.put((index, [job.model_dump() for job in processor.job_registry.list()]))
+            try:
+                await asyncio.wait_for(stopping.wait(), SUPERVISOR_SETTINGS.status_interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        print(f"Encoding worker {index} stopping")
+        await processor.stop()
+
+
+class WorkerJobs:
+    """
+    Задачи процессов-потребителей для API статуса.
+
+    Интерфейс как у JobRegistry (list, get); данные - последние снимки
+    состояния, полученные от каждого процесса.
+    """
+
+    def __init__(self):
+        self._snapshots: dict[int, list[JobState]] = {}
+
+    def update(self, index: int, jobs: list[dict]):
+        self._snapshots[index] = [JobState.model_validate(job) for job in jobs]
+
+    def drop(self, index: int):
+        self._snapshots.pop(index, None)
+
+    def get(self, uuid: str) -> JobState | None:
+        return next((job for job in self.list() if job.uuid == uuid), None)
+
+    def list(self) -> list[JobState]:
+        jobs = [job for snapshot in self._snapshots.values() for job in snapshot]
+        return sorted(jobs, key=lambda job: job.started_at, reverse=True)
+
+
+class WorkerSlot:
+    """Слот процесса-потребителя: текущий процесс и счетчик быстрых падений."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.failures = 0
+
+
+class WorkerSupervisor:
+    """
+    Пул процессов-потребителей с перезапуском упавших.
+
+    Каждый процесс запускает свой VideoProcessor (без настройки bucket),
+    поэтому число одновременно кодируемых видео - workers *
+    max_concurrent_jobs и не зависит от HTTP-процесса. Упавший процесс
+    перезапускается с экспоненциальной задержкой; его неподтвержденные
+    сообщения RabbitMQ доставит заново, а аренда задачи истечет через
+    lease_ttl. Процессы создаются через spawn: дочерний процесс
+    не наследует event loop и соединения родителя.
+
+    .. note::
+        Метрики процессов-потребителей собираются через мультипроцессный
+        режим prometheus_client: если PROMETHEUS_MULTIPROC_DIR не задан,
+        супервизор создает временный каталог до запуска процессов.
+    """
+
+    def __init__(self, config, target=run_worker):
+        self.config = config
+        self.target = target
+        self.jobs = WorkerJobs()
+        self._context = multiprocessing.get_context('spawn')
+        self._status_queue = None
+        self._slots = [WorkerSlot(index) for index in range(config.workers)]
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        """Запуск процессов-потребителей и наблюдения за ними."""
+        os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='video-postprocess-metrics-'))
+        self._status_queue = self._context.Queue()
+        for slot in self._slots:
+            self._spawn(slot)
+        self._task = asyncio.create_task(self._monitor())
+        print(f"Supervisor started {len(self._slots)} encoding workers")
+
+    async def stop(self):
+        """Остановка наблюдения и процессов (SIGTERM, по таймауту - SIGKILL)."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        processes = [slot.process for slot in self._slots if slot.process is not None]
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + self.config.shutdown_timeout
+        for process in processes:
+            await asyncio.to_thread(process.join, max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                print(f"Encoding worker {process.pid} did not stop in time, killing")
+                process.kill()
+                await asyncio.to_thread(process.join)
+        if self._status_queue is not None:
+            self._status_queue.close()
+
+    async def _monitor(self):
+        while True:
+            self.check_workers()
+            self.collect_status()
+            await asyncio.sleep(MONITOR_INTERVAL)
+
+    def check_workers(self):
+        """Обнаружение упавших процессов и перезапуск по истечении задержки."""
+        now = time.monotonic()
+        for slot in self._slots:
+            if slot.process is None:
+                if now >= slot.restart_at:
+                    self._spawn(slot)
+                continue
+            if slot.process.is_alive():
+                continue
+
+            lived = now - slot.started_at
+            slot.failures = slot.failures + 1 if lived < self.config.stable_after else 1
+            delay = min(self.config.restart_delay * 2 ** (slot.failures - 1), self.config.max_restart_delay)
+            print(f"Encoding worker {slot.index} (pid {slot.process.pid}) exited with code "
+                  f"{slot.process.exitcode} after {lived:.0f}s, restarting in {delay:g}s")
+            slot.process = None
+            slot.restart_at = now + delay
+            self.jobs.drop(slot.index)
+
+    def collect_status(self):
+        """Прием снимков состояния задач от процессов."""
+        while True:
+            try:
+                index, jobs = self._status_queue.get_nowait()
+            except queue.Empty:
+                return
+            if self._slots[index].process is not None:
+                self.jobs.update(index, jobs)
+
+    def _spawn(self, slot: WorkerSlot):
+        slot.process = self._context.Process(
+            target=self.target, args=(slot.index, self._status_queue),
+            name=f"encoding-worker-{slot.index}", daemon=False
+        )
+        slot.process.start()
+        slot.started_at = time.monotonic()
@@ -1,43 +1,343 @@
 import asyncio
+import hashlib
 import json
 import os
 import tempfile
-from typing import Dict, Any
+import time
+from typing import TYPE_CHECKING, Dict, Any, Callable, Awaitable
 
 import aio_pika
 
+from services.admission import AdmissionController
+from services.checkpoint import JobCheckpoint, JobLease, LeaseLostError
+from services.chunked_transcoder import ChunkedTranscoder
+from services.dedup import MissingOutputError, SourceIndex, SourceIndexEntry
+from services.deferred import DeferredRenditions, DEFERRED_QUEUE
+from services.hls_uploader import HLSUploader
+from services.jobs import JobRegistry, current_job, set_stage
+from services.media_info import MediaInfo, FFPROBE_ENTRIES, FFPROBE_KEYFRAME_ENTRIES, parse_keyframes, \
+    max_keyframe_interval
+from services.rabbitmq import RetryTopology
+from services.scheduler import JobScheduler
+from services.metrics import STAGE_SECONDS, ENCODE_SECONDS, JOB_BYTES, JOB_SEGMENTS, QUEUE_WAIT_SECONDS, JOBS
 from services.s3 import S3Service
 
+if TYPE_CHECKING:
+    from config import LadderRung
+
+
+# Предел числа верхнеуровневых атомов MP4 при поиске moov
+MAX_MP4_TOP_LEVEL_BOXES = 32
+
+# Длительность HLS-сегмента, секунды
+HLS_SEGMENT_TIME = 5
+
+# Коды профилей H.264 (по названиям ffprobe) для атрибута CODECS (profile_idc + constraint flags, RFC 6381)
+H264_PROFILE_CODES = {'Constrained Baseline': '42C0', 'Baseline': '4200', 'Main': '4D40', 'High': '6400'}
+
+# Профили, которые выдает libx264 для значений -profile:v
+X264_PROFILES = {'baseline': 'Constrained Baseline', 'main': 'Main', 'high': 'High'}
+
+# Кодек звука HLS-рендишенов (AAC-LC)
+AAC_LC_CODEC = 'mp4a.40.2'
+
+# Ключ общего звукового рендишена (вместо разрешения) и его группа в мастер-плейлисте
+AUDIO_RENDITION = 'audio'
+AUDIO_GROUP = 'audio'
+
+# Битрейт звукового рендишена, пока он не измерен при выгрузке (AAC по умолчанию)
+AUDIO_BANDWIDTH = 128000
+
+# Максимальный интервал между ключевыми кадрами исходника для нарезки без перекодирования, секунды
+REMUX_MAX_KEYFRAME_INTERVAL = 2 * HLS_SEGMENT_TIME
+
+# Кадр, в пикселях которого считается стоимость задачи (секунды видео 1080p)
+JOB_COST_REFERENCE_PIXELS = 1920 * 1080
+
+# Поля ffprobe для оценки стоимости задачи (только заголовок, без чтения пакетов)
+FFPROBE_COST_ENTRIES = 'format=duration:stream=index,codec_type,width,height'
+
+# Начало видео, по которому измеряется интервал ключевых кадров для remux, секунды
+KEYFRAME_PROBE_WINDOW = 60
+
+# Программные кодировщики дополнительных кодеков для вариантов верхних ступеней
+VARIANT_ENCODERS = {'hevc': 'libx265', 'av1': 'libsvtav1'}
+
+# Сдвиг CRF варианта относительно CRF ступени (шкалы кодировщиков различаются)
+VARIANT_CRF_OFFSETS = {'hevc': 5, 'av1': 12}
+
+# Доля maxrate ступени для варианта: то же качество при меньшем битрейте
+VARIANT_BITRATE_RATIOS = {'hevc': 0.6, 'av1': 0.5}
+
+# Стоимость кодирования варианта относительно H.264 той же ступени (для планировщика)
+VARIANT_COST_FACTORS = {'hevc': 4, 'av1': 6}
+
+# Уровни HEVC и AV1 вариантов по высоте ступени (с запасом на 60 fps)
+VARIANT_LEVELS = ((480, 3.1), (720, 4.0), (1080, 4.1), (1440, 5.0), (2160, 5.1))
+
+# BANDWIDTH ступени без maxrate, пока ее битрейт не измерен (по высоте ступени)
+DEFAULT_BANDWIDTHS = {
+    144: 500000, 240: 750000, 360: 1000000,
+    480: 1500000, 720: 2500000, 1080: 5000000,
+    1440: 8000000, 2160: 16000000
+}
+
+
+def h264_codec(profile: str, level: int) -> str:
+    """Значение CODECS для H.264 по названию профиля и level_idc."""
+    return f"avc1.{H264_PROFILE_CODES[profile]}{level:02X}"
+
+
+def hevc_codec(level: float) -> str:
+    """Значение CODECS для HEVC Main (Main tier) по уровню."""
+    return f"hvc1.1.6.L{round(level * 30)}.B0"
+
+
+def av1_codec(level: float) -> str:
+    """Значение CODECS для AV1 Main 8 бит по уровню (seq_level_idx)."""
+    major, minor = divmod(round(level * 10), 10)
+    return f"av01.0.{(major - 2) * 4 + minor:02d}M.08"
+
+
+def split_variant(resolution: str) -> tuple[str, str | None]:
+    """Разрешение и кодек рендишена: 'W:H' - H.264 ступень (кодек None), 'W:H@hevc' - вариант."""
+    resolution, _, codec = resolution.partition('@')
+    return resolution, codec or None
+
+
+def rendition_height(resolution: str) -> int:
+    """Высота ступени в смысле "1080p" - меньшая сторона кадра (для вертикального видео - ширина)."""
+    width, height = (int(side) for side in split_variant(resolution)[0].split(':'))
+    return min(width, height)
+
+
+def resolution_pixels(resolution: str) -> int:
+    """Количество пикселей в кадре для разрешения вида 'W:H' (или варианта 'W:H@codec')."""
+    width, height = split_variant(resolution)[0].split(":")
+    return int(width) * int(height)
+
+
+def variant_level(resolution: str) -> float:
+    """Уровень HEVC/AV1 варианта по высоте ступени."""
+    height = rendition_height(resolution)
+    return next((level for max_height, level in VARIANT_LEVELS if height <= max_height), VARIANT_LEVELS[-1][1])
+
+
+class RenditionScheduler:
+    """
+    Планировщик параллельного кодирования рендишенов в пределах бюджета ядер.
+    
+    Каждому рендишену выделяется число потоков FFmpeg, пропорциональное
+    его доле пикселей в лестнице. Задачи запускаются от большего разрешения
+    к меньшему; освободившиеся ядра сразу занимают следующие задачи,
+    которые помещаются в остаток бюджета. Бюджет общий для всех задач,
+    запущенных через один экземпляр планировщика.
+    """
+    
+    def __init__(self, cpu_budget: int):
+        self.cpu_budget = max(1, cpu_budget)
+        self._free_cores = self.cpu_budget
+        self._cores_released = asyncio.Condition()
+    
+    def allocate_threads(self, resolutions: list) -> Dict[str, int]:
+        """Распределение бюджета ядер между рендишенами пропорционально пикселям."""
+        total_pixels = sum(resolution_pixels(resolution) for resolution in resolutions)
+        allocation = {}
+        for resolution in resolutions:
+            share = round(self.cpu_budget * resolution_pixels(resolution) / total_pixels)
+            allocation[resolution] = min(self.cpu_budget, max(1, share))
+        return allocation
+    
+    async def run(self, resolutions: list, encode: Callable[[str, int], Awaitable[None]]):
+        """
+        Кодирование всех рендишенов через encode(resolution, threads).
+        
+        При ошибке одного рендишена остальные задачи отменяются,
+        а исключение пробрасывается вызывающему.
+        """
+        allocation = self.allocate_threads(resolutions)
+        tasks = [
+            asyncio.create_task(self._encode(resolution, allocation[resolution], encode))
+            for resolution in sorted(resolutions, key=resolution_pixels, reverse=True)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _encode(self, resolution: str, threads: int, encode: Callable[[str, int], Awaitable[None]]):
+        """Ожидание свободных ядер и кодирование одного рендишена."""
+        async with self._cores_released:
+            await self._cores_released.wait_for(lambda: self._free_cores >= threads)
+            self._free_cores -= threads
+        try:
+            await encode(resolution, threads)
+        finally:
+            async with self._cores_released:
+                self._free_cores += threads
+                self._cores_released.notify_all()
+
 
 class VideoProcessor:
-    def __init__(self, rabbitmq_config, minio_config):
+    def __init__(self, rabbitmq_config, minio_config, transcode_config, job_config, distributed_config, retry_config):
         self.rabbitmq_config = rabbitmq_config
         self.minio_config = minio_config
-        self.s3_service = S3Service(minio_config)
+        self.transcode_config = transcode_config
+        self.job_config = job_config
+        self.distributed_config = distributed_config
+        self.s3_service = None
         self.connection = None
         self.channel = None
+        self.rendition_scheduler = RenditionScheduler(transcode_config.cpu_budget)
+        self.admission = AdmissionController(job_config)
+        self.chunked_transcoder = ChunkedTranscoder(self, distributed_config, HLS_SEGMENT_TIME)
+        self._jobs: set[asyncio.Task] = set()
+        self.job_registry = JobRegistry(job_config.status_history)
+        self.retry = RetryTopology("convert_video_to_hls", retry_config)
+        self.job_scheduler = JobScheduler("convert_video_to_hls", job_config, self.on_message, self.admission)
+        self._consumer: asyncio.Task | None = None
         
-    async def start(self):
-        """Запуск процессора - подключение к RabbitMQ и запуск потребителей."""
+    async def start(self, bootstrap_storage: bool = True):
+        """
+        Запуск процессора - подключение к RabbitMQ и запуск потребителей.
+        
+        bootstrap_storage=False - без настройки bucket MinIO (процесс-потребитель
+        в режиме супервизора).
+        """
+        self.s3_service = S3Service(self.minio_config)
+        await self.s3_service.connect(bootstrap=bootstrap_storage)
         self.connection = await aio_pika.connect_robust(self.rabbitmq_config.url)
         self.channel = await self.connection.channel()
-        await self.channel.set_qos(prefetch_count=1)
+        await self.channel.set_qos(prefetch_count=self.job_config.max_concurrent_jobs)
         
         await self.channel.declare_queue("convert_video_to_hls", durable=True)
         await self.channel.declare_queue("confirm_video_hls_converting", durable=True)
+        await self.retry.declare(self.channel)
         
         queue = await self.channel.declare_queue("convert_video_to_hls", durable=True)
-        await queue.consume(self.process_message)
+        if self.job_config.scheduler_enabled:
+            await self.job_scheduler.start(self.channel)
+            await queue.consume(self.route_message)
+        else:
+            self._consumer = asyncio.create_task(self.consume_jobs(queue))
+        
+        if self.transcode_config.jit_enabled:
+            # Отложенные ступени ждет зритель: их задачи идут мимо планировщика
+            deferred_queue = await self.channel.declare_queue(DEFERRED_QUEUE, durable=True)
+            await deferred_queue.consume(self.on_deferred_message)
         
-        print("Video processor started and listening for messages...")
+        if self.distributed_config.enabled:
+            await self.chunked_transcoder.start(self.connection)
+        
+        print(f"Video processor started and listening for messages "
+              f"(up to {self.job_config.max_concurrent_jobs} concurrent jobs)...")
         
     async def stop(self):
-        """Остановка процессора - закрытие соединений."""
+        """Остановка процессора - отмена задач и закрытие соединений."""
+        await self.job_scheduler.stop()
+        if self._consumer:
+            self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+        for job in self._jobs:
+            job.cancel()
+        await asyncio.gather(*self._jobs, return_exceptions=True)
         if self.connection:
             await self.connection.close()
+        if self.s3_service:
+            await self.s3_service.close()
+    
+    async def on_message(self, message: aio_pika.IncomingMessage) -> asyncio.Task:
+        """Запуск обработки сообщения отдельной задачей."""
+        job = asyncio.create_task(self.process_message(message))
+        self._jobs.add(job)
+        job.add_done_callback(self._jobs.discard)
+        return job
+    
+    async def consume_jobs(self, queue: aio_pika.abc.AbstractQueue):
+        """
+        Выборка задач из входной очереди (basic.get) только при свободном слоте
+        и ресурсах машины: пока воркер занят, задачи остаются в очереди
+        и достаются свободным воркерам.
+        """
+        while True:
+            await self.admission.acquire()
+            try:
+                message = await queue.get(fail=False)
+                while message is None:
+                    await asyncio.sleep(self.job_config.scheduler_poll_interval)
+                    message = await queue.get(fail=False)
+            except BaseException:
+                self.admission.release()
+                raise
+            job = await self.on_message(message)
+            job.add_done_callback(lambda _: self.admission.release())
+    
+    async def on_deferred_message(self, message: aio_pika.IncomingMessage) -> asyncio.Task:
+        """Запуск кодирования отложенной ступени отдельной задачей."""
+        job = asyncio.create_task(self.process_deferred_message(message))
+        self._jobs.add(job)
+        job.add_done_callback(self._jobs.discard)
+        return job
+    
+    async def route_message(self, message: aio_pika.IncomingMessage):
+        """
+        Оценка стоимости задачи из входной очереди и перекладывание
+        в очередь коротких или длинных задач планировщика.
+        """
+        try:
+            data = json.loads(message.body.decode())
+            video_path = data['video_path']
+        except (UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError):
+            # Невалидные сообщения отправит в dead-letter обычная обработка
+            await self.process_message(message)
+            return
+        
+        cost = await self.estimate_job_cost(video_path, data.get('popularity'))
+        try:
+            await self.job_scheduler.route(message, cost)
+        except Exception as e:
+            print(f"Error routing message: {e}")
+            await message.nack(requeue=True)
+    
+    async def estimate_job_cost(self, video_path: str, popularity: int | None = None) -> float | None:
+        """
+        Оценка стоимости задачи по заголовку исходника: длительность
+        * пиксели всех ступеней лестницы, в секундах видео 1080p.
+        Варианты в дополнительных кодеках учитываются с множителем
+        VARIANT_COST_FACTORS.
+        
+        ffprobe читает только заголовок по presigned-ссылке, без скачивания
+        исходника. None, если оценить не удалось.
+        """
+        try:
+            url = await self.s3_service.generate_presigned_url(video_path, self.transcode_config.presigned_url_ttl)
+            output = await self._run_ffprobe(['-show_entries', FFPROBE_COST_ENTRIES, '-of', 'json', url])
+            media_info = MediaInfo.from_ffprobe(json.loads(output))
+        except Exception as e:
+            print(f"Error estimating job cost for {video_path}: {e}")
+            return None
+        if not media_info.duration:
+            return None
+        resolutions = self.select_resolutions(media_info.width, media_info.height)
+        resolutions += self.select_variants(resolutions, media_info, popularity)
+        pixels = sum(
+            resolution_pixels(resolution) * VARIANT_COST_FACTORS.get(split_variant(resolution)[1], 1)
+            for resolution in resolutions
+        )
+        return media_info.duration * pixels / JOB_COST_REFERENCE_PIXELS
     
     async def process_message(self, message: aio_pika.IncomingMessage):
-        """Обработка входящего сообщения из RabbitMQ."""
+        """
+        Обработка входящего сообщения из RabbitMQ.
+        
+        Упавшая задача повторяется с задержкой через RetryTopology,
+        сообщения, которые невозможно обработать, сразу уходят
+        в dead-letter очередь. Слот задачи занимает потребитель до получения
+        сообщения; если задаче не хватает места во временном каталоге,
+        она возвращается в очередь.
+        """
         try:
             message_body = message.body.decode()
             print(f"Received message: {message_body}")
@@ -46,159 +346,719 @@ class VideoProcessor:
             
             if 'video_path' not in data or 'uuid' not in data:
                 print(f"Missing required fields: {data}")
-                await message.ack()
+                await self.retry.dead_letter(message, "Missing required fields: video_path, uuid")
+                return
+            
+            required_disk = await self.estimate_job_disk(data['video_path'])
+            reason = self.admission.disk_shortage(required_disk)
+            if reason:
+                # Задача возвращается в очередь: ее возьмет воркер, у которого хватает места
+                print(f"Admission rejected for {data['uuid']}, requeueing: {reason}")
+                await message.nack(requeue=True)
+                await asyncio.sleep(self.job_config.admission_poll_interval)
                 return
-                
-            success = await self.process_video(data)
+            
+            self.observe_queue_wait(message, data)
+            
+            job = self.job_registry.start(data['uuid'], data['video_path'])
+            job_token = current_job.set(job)
+            success = False
+            try:
+                # Аренда берется только после допуска задачи
+                async with self.admission.reserve_disk(required_disk), \
+                        JobLease(self.s3_service, data['uuid'], self.job_config.lease_ttl):
+                    checkpoint = await JobCheckpoint.load(self.s3_service, data['uuid'])
+                    if checkpoint.manifest.completed:
+                        print(f"Video already processed: {data['uuid']}")
+                        success = True
+                    else:
+                        success = await self.process_video(data, checkpoint)
+            finally:
+                current_job.reset(job_token)
+                JOBS.labels('success' if success else 'failure', '' if success else job.stage).inc()
+                self.job_registry.finish(job, success)
             
             if success:
                 await message.ack()
                 print(f"Video processed successfully: {data['uuid']}")
             else:
-                await message.nack(requeue=False)
                 print(f"Video processing failed: {data['uuid']}")
+                await self.fail_message(message, job.error or "Video processing failed")
                 
-        except json.JSONDecodeError as e:
-            print(f"Invalid JSON: {e}")
+        except LeaseLostError as e:
+            # Задачу продолжает процесс, перехвативший аренду по своей доставке сообщения
+            print(f"Video processing interrupted: {e}")
             await message.ack()
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            print(f"Invalid JSON: {e}")
+            await self.retry.dead_letter(message, f"Invalid JSON: {e}")
         except Exception as e:
             print(f"Error processing message: {e}")
-            await message.nack(requeue=False)
+            await self.fail_message(message, str(e))
     
-    async def process_video(self, data: Dict[str, Any]):
-        """Основной метод обработки видео."""
+    async def fail_message(self, message: aio_pika.IncomingMessage, reason: str):
+        """Отложенный повтор упавшей задачи."""
+        try:
+            await self.retry.retry(message, reason)
+        except Exception as e:
+            # Переиздать сообщение не удалось - проблема с брокером, а не с задачей
+            print(f"Error scheduling retry: {e}")
+            await message.nack(requeue=True)
+    
+    def observe_queue_wait(self, message: aio_pika.IncomingMessage, data: dict):
+        """Время ожидания в очереди: по timestamp сообщения или полю published_at."""
+        published_at = message.timestamp.timestamp() if message.timestamp else data.get('published_at')
+        if published_at:
+            QUEUE_WAIT_SECONDS.observe(max(time.time() - float(published_at), 0))
+    
+    async def estimate_job_disk(self, video_path: str) -> int:
+        """Оценка места во временном каталоге, необходимого для обработки видео."""
+        try:
+            source_size = await self.s3_service.get_file_size(video_path)
+        except Exception as e:
+            print(f"Error getting source size for {video_path}: {e}")
+            source_size = 0
+        JOB_BYTES.labels('in').observe(source_size)
+        disk_factor = self.job_config.disk_factor
+        if self.transcode_config.source_mode == 'stream':
+            # исходник не скачивается, на диске остаются только рендишены
+            disk_factor = max(disk_factor - 1, 0)
+        return int(source_size * disk_factor)
+    
+    async def prepare_input(self, video_path: str, temp_dir: str, digest=None) -> str:
+        """
+        Подготовка входа для ffprobe/FFmpeg.
+        
+        В режиме stream возвращает presigned-ссылку на исходник в MinIO,
+        иначе (или если исходник требует произвольного доступа) скачивает
+        его во временный каталог и возвращает локальный путь.
+        digest (hashlib) при скачивании дополняется содержимым исходника.
+        """
+        if self.transcode_config.source_mode == 'stream':
+            if await self.source_is_streamable(video_path):
+                print(f"Streaming video from MinIO: {video_path}")
+                return await self.s3_service.generate_presigned_url(
+                    video_path, self.transcode_config.presigned_url_ttl
+                )
+            print(f"Source has moov atom after media data, falling back to download: {video_path}")
+        
+        input_file = os.path.join(temp_dir, os.path.basename(video_path))
+        print(f"Downloading video from MinIO: {video_path}")
+        with STAGE_SECONDS.labels('download').time():
+            await self.s3_service.download_file(video_path, input_file, digest)
+        return input_file
+    
+    async def source_is_streamable(self, video_path: str) -> bool:
+        """
+        Проверка, можно ли читать исходник последовательно по сети.
+        
+        Обходит верхнеуровневые атомы MP4/MOV Range-запросами заголовков:
+        если mdat встречается раньше moov, для чтения метаданных нужен
+        переход в конец файла, и такой исходник лучше скачать.
+        Остальные контейнеры считаются потоковыми.
+        """
+        source_size = await self.s3_service.get_file_size(video_path)
+        offset = 0
+        for _ in range(MAX_MP4_TOP_LEVEL_BOXES):
+            if offset >= source_size:
+                return True
+            header = await self.s3_service.read_range(video_path, offset, 16)
+            if len(header) < 8:
+                return True
+            
+            size = int.from_bytes(header[0:4], 'big')
+            box_type = header[4:8]
+            if offset == 0 and box_type != b'ftyp':
+                return True
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+            
+            if size == 1 and len(header) == 16:
+                size = int.from_bytes(header[8:16], 'big')
+            if size < 8:
+                return True
+            offset += size
+        return True
+    
+    async def process_video(self, data: Dict[str, Any], checkpoint: JobCheckpoint | None = None):
+        """
+        Основной метод обработки видео.
+        
+        checkpoint - контрольные точки задачи: рендишены, выгруженные
+        предыдущими попытками, не кодируются повторно, а каждый новый
+        выгруженный рендишен записывается в манифест.
+        """
         try:
             video_path = data['video_path']
             video_uuid = data['uuid']
+            checkpoint = checkpoint or JobCheckpoint(self.s3_service, video_uuid)
             
             print(f"Starting video processing: {video_path} for UUID: {video_uuid}")
+            started = time.perf_counter()
             
             with tempfile.TemporaryDirectory(prefix=video_uuid) as temp_dir:
-                input_file = os.path.join(temp_dir, os.path.basename(video_path))
+                set_stage('preparing')
+                digest = hashlib.sha256() if self.transcode_config.dedup_enabled else None
+                input_file = await self.prepare_input(video_path, temp_dir, digest)
+                # Хеш посчитан, только если исходник скачан
+                source_hash = digest.hexdigest() if digest and os.path.isfile(input_file) else None
+                if source_hash:
+                    duplicate = await SourceIndex(self.s3_service).lookup(source_hash)
+                    if duplicate and duplicate.uuid != video_uuid and await self.publish_duplicate(
+                            duplicate, source_hash, video_uuid, video_path, checkpoint):
+                        STAGE_SECONDS.labels('job').observe(time.perf_counter() - started)
+                        return True
                 
-                print(f"Downloading video from MinIO: {video_path}")
-                await self.s3_service.download_file(video_path, input_file)
+                set_stage('probing')
+                media_info = await self.get_media_info(video_uuid, input_file)
+                print(f"Video resolution: {media_info.display_width}x{media_info.display_height}"
+                      + (f" (rotated {media_info.rotation})" if media_info.rotation else ""))
                 
-                print("Getting video resolution...")
-                width, height = await self.get_video_resolution(input_file)
-                print(f"Video resolution: {width}x{height}")
-                
-                resolutions = [
-                    (3840, 2160),  # 4k
-                    (2560, 1440),  # 2k
-                    (1920, 1080),  # 1080p
-                    (1280, 720),   # 720p
-                    (854, 480),    # 480p
-                    (640, 360),    # 360p
-                    (426, 240),    # 240p
-                ]
-                
-                supported_res = ["256:144"]
-                for w, h in resolutions:
-                    if w <= width and h <= height:
-                        supported_res.append(f"{w}:{h}")
-                
-                print(f"Supported resolutions: {supported_res}")
+                ladder_res = self.select_resolutions(media_info.display_width, media_info.display_height)
+                deferred_res = self.select_deferred(ladder_res)
+                encoded_res = [res for res in ladder_res if res not in deferred_res]
+                variant_res = self.select_variants(encoded_res, media_info, data.get('popularity'))
+                supported_res = ladder_res + variant_res
+                print(f"Supported resolutions: {supported_res}"
+                      + (f", deferred until requested: {deferred_res}" if deferred_res else ""))
+                done_res = checkpoint.completed_renditions(supported_res)
+                if done_res:
+                    print(f"Resuming, already uploaded: {done_res}")
+                pending_res = [res for res in encoded_res if res not in done_res]
+                pending_variants = [res for res in variant_res if res not in done_res]
+                # Общий звуковой рендишен: мастер-плейлист учитывает его битрейт
+                audio_res = [AUDIO_RENDITION] if self.shares_audio(media_info) else []
+                if job := current_job.get():
+                    job.duration, job.resolutions = media_info.duration, supported_res
+                set_stage('encoding')
                 
                 output_dir = os.path.join(temp_dir, "hls")
                 os.makedirs(output_dir, exist_ok=True)
                 
-                for resolution in supported_res:
-                    await self.convert_to_hls(input_file, video_uuid, resolution, output_dir)
+                async with HLSUploader(self.s3_service, output_dir, f"video_files/{video_uuid}") as uploader:
+                    published_res = list(done_res)
+                    publish_lock = asyncio.Lock()
+                    codecs = checkpoint.codecs()
+                    
+                    async def record_rendition(resolution: str):
+                        """Запись контрольной точки выгруженного рендишена."""
+                        bitrates = self._measured_bitrates(uploader, video_uuid, [resolution], checkpoint)
+                        await checkpoint.record_rendition(resolution, bitrates[resolution], codecs.get(resolution))
+                    
+                    async def publish_rendition(resolution: str):
+                        """Выгрузка готового рендишена и перепубликация мастера с уже готовыми разрешениями."""
+                        async with publish_lock:
+                            await uploader.sync()
+                            published_res.append(resolution)
+                            ready_res = [res for res in supported_res if res in published_res]
+                            await self.create_master_playlist(
+                                video_uuid, ready_res, output_dir, media_info,
+                                self._measured_bitrates(uploader, video_uuid, audio_res + ready_res, checkpoint),
+                                codecs
+                            )
+                            await uploader.publish_master()
+                            await record_rendition(resolution)
+                    
+                    async def upload_rendition(resolution: str):
+                        """Выгрузка готового рендишена без публикации мастера."""
+                        async with publish_lock:
+                            await uploader.sync()
+                            await record_rendition(resolution)
+                    
+                    distribute = self.chunked_transcoder.should_distribute(media_info)
+                    
+                    remux_res = None
+                    if not distribute:
+                        remux_res = self.select_remux_resolution(media_info, ladder_res)
+                    if remux_res:
+                        print(f"Source matches {remux_res}, remuxing it without re-encoding")
+                        codecs[remux_res] = self._codecs(
+                            media_info.has_audio, h264_codec(media_info.video_profile, media_info.video_level)
+                        )
+                    
+                    if audio_res and not checkpoint.completed_renditions(audio_res):
+                        # Звук кодируется первым: на него ссылается мастер-плейлист с первой публикации
+                        await self.encode_audio_rendition(input_file, video_uuid, output_dir)
+                        await upload_rendition(AUDIO_RENDITION)
+                    
+                    progressive = self.transcode_config.progressive_publishing and len(encoded_res) > 1
+                    on_rendition_done = publish_rendition if progressive else upload_rendition
+                    if distribute:
+                        playable_sent = False
+                        
+                        async def chunked_done(resolution: str):
+                            """Выгрузка склеенной ступени; при прогрессивной публикации первая - "playable"."""
+                            nonlocal playable_sent
+                            await on_rendition_done(resolution)
+                            if progressive and not playable_sent:
+                                playable_sent = True
+                                await self.send_confirmation(video_uuid, "playable", media_info)
+                        
+                        await self.chunked_transcoder.transcode(input_file, video_uuid, pending_res, output_dir,
+                                                                video_path, media_info,
+                                                                on_rendition_done=chunked_done)
+                    elif progressive:
+                        first_res = encoded_res[0]
+                        other_res = [res for res in pending_res if res != first_res]
+                        if first_res in pending_res:
+                            if first_res == remux_res:
+                                # CODECS ступени уже взяты из исходного потока: ступень нарезается без кодирования
+                                await self.remux_to_hls(input_file, video_uuid, first_res, output_dir)
+                            else:
+                                await self.convert_to_hls(input_file, video_uuid, first_res, output_dir,
+                                                          align_keyframes=remux_res is not None)
+                            await on_rendition_done(first_res)
+                        await self.send_confirmation(video_uuid, "playable", media_info)
+                        
+                        await self.encode_renditions(input_file, video_uuid, other_res, output_dir,
+                                                     on_rendition_done=on_rendition_done, remux_res=remux_res)
+                    else:
+                        await self.encode_renditions(input_file, video_uuid, pending_res, output_dir,
+                                                     on_rendition_done=on_rendition_done, remux_res=remux_res)
+                    
+                    await self.encode_variants(input_file, video_uuid, pending_variants, output_dir,
+                                               on_rendition_done=on_rendition_done)
                 
-                await self.create_master_playlist(video_uuid, supported_res, output_dir)
+                set_stage('publishing')
+                if deferred_res:
+                    deferred = DeferredRenditions(
+                        video_path=video_path, renditions=deferred_res,
+                        fallback=max(encoded_res, key=resolution_pixels), master=supported_res,
+                        align_keyframes=remux_res is not None
+                    )
+                    await self.publish_deferred(video_uuid, deferred)
+                await self.create_master_playlist(
+                    video_uuid, supported_res, output_dir, media_info,
+                    self._measured_bitrates(uploader, video_uuid, audio_res + supported_res, checkpoint), codecs
+                )
+                await uploader.publish_master()
                 
-                print("Uploading HLS files to MinIO...")
-                for filename in os.listdir(output_dir):
-                    local_path = os.path.join(output_dir, filename)
-                    s3_path = f"video_files/{video_uuid}/{filename}"
-                    await self.s3_service.upload_file(local_path, s3_path)
-                    print(f"Uploaded: {s3_path}")
+                await self.send_confirmation(video_uuid, "complete", media_info)
+                await checkpoint.complete()
                 
-                print(f"Removing original video: {video_path}")
-                await self.s3_service.delete_file(video_path)
-                
-                await self.send_confirmation(video_uuid)
+                if deferred_res:
+                    # Исходник и параметры нужны для кодирования отложенных ступеней;
+                    # в индекс дедупликации видео попадет без отложенных ступеней
+                    print(f"Keeping original video for deferred renditions: {video_path}")
+                else:
+                    print(f"Removing original video: {video_path}")
+                    await self.s3_service.delete_files([video_path, self.media_info_key(video_uuid)])
+                    if source_hash:
+                        await SourceIndex(self.s3_service).record(source_hash, video_uuid, media_info)
                 
+                STAGE_SECONDS.labels('job').observe(time.perf_counter() - started)
+                JOB_BYTES.labels('out').observe(uploader.uploaded_bytes)
+                JOB_SEGMENTS.observe(uploader.segment_count)
                 print(f"Video processing completed successfully: {video_uuid}")
                 return True
                 
         except Exception as e:
             print(f"Error in process_video: {e}")
+            if job := current_job.get():
+                job.error = str(e)
             return False
     
-    async def get_video_resolution(self, file_path: str) -> tuple[int, int]:
-        """Получение разрешения видео через ffprobe"""
+    async def publish_duplicate(self, duplicate: SourceIndexEntry, source_hash: str, video_uuid: str,
+                                video_path: str, checkpoint: JobCheckpoint) -> bool:
+        """
+        Публикация повторно загруженного видео без кодирования: копия HLS
+        уже обработанного видео с тем же исходником, подтверждение complete
+        с его параметрами и удаление исходника, как после обычной обработки.
+        
+        Если HLS найденного видео уже удален, запись индекса удаляется
+        и возвращается False: видео кодируется обычным образом.
+        """
+        print(f"Source matches already processed video {duplicate.uuid}, copying its HLS to {video_uuid}")
+        if job := current_job.get():
+            job.duration = duplicate.media_info.duration
+        set_stage('publishing')
+        index = SourceIndex(self.s3_service)
         try:
-            cmd = [
-                'ffprobe',
-                '-v', 'error',
-                '-select_streams', 'v:0',
-                '-show_entries', 'stream=width,height',
-                '-of', 'csv=p=0',
-                file_path
-            ]
-            
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                error_msg = stderr.decode() if stderr else "Unknown error"
-                raise Exception(f"ffprobe failed: {error_msg}")
-            
-            output = stdout.decode().strip()
-            width_str, height_str = output.split(',')
-            
-            return int(width_str), int(height_str)
+            copied = await index.copy_output(duplicate.uuid, video_uuid)
+        except MissingOutputError as e:
+            print(f"{e}, dropping its dedup record and encoding {video_uuid}")
+            await index.forget(source_hash)
+            return False
+        print(f"Copied {copied} objects from video_files/{duplicate.uuid}/")
+        
+        await self.send_confirmation(video_uuid, "complete", duplicate.media_info)
+        await checkpoint.complete()
+        
+        print(f"Removing original video: {video_path}")
+        await self.s3_service.delete_files([video_path])
+        return True
+    
+    async def encode_renditions(self, input_file: str, video_uuid: str, resolutions: list, output_dir: str,
+                                on_rendition_done: Callable[[str], Awaitable[None]] | None = None,
+                                remux_res: str | None = None):
+        """
+        Кодирование всех рендишенов в режиме из настроек перекодирования.
+        
+        on_rendition_done вызывается для каждого разрешения сразу после того,
+        как его кодирование завершено. Разрешение remux_res нарезается
+        без перекодирования первым, остальные тогда кодируются с ключевыми
+        кадрами исходника.
+        """
+        if not resolutions:
+            return
+        align_keyframes = remux_res is not None
+        if remux_res in resolutions:
+            await self.remux_to_hls(input_file, video_uuid, remux_res, output_dir)
+            if on_rendition_done:
+                await on_rendition_done(remux_res)
+            resolutions = [resolution for resolution in resolutions if resolution != remux_res]
+            if not resolutions:
+                return
+        
+        async def encode(resolution: str, threads: int | None = None):
+            await self.convert_to_hls(input_file, video_uuid, resolution, output_dir, threads, align_keyframes)
+            if on_rendition_done:
+                await on_rendition_done(resolution)
+        
+        if self.transcode_config.encode_mode == 'single_decode':
+            await self.convert_to_hls_single_decode(input_file, video_uuid, resolutions, output_dir, align_keyframes)
+            if on_rendition_done:
+                for resolution in resolutions:
+                    await on_rendition_done(resolution)
+        elif self.transcode_config.encode_mode == 'parallel':
+            await self.rendition_scheduler.run(resolutions, encode)
+        else:
+            for resolution in resolutions:
+                await encode(resolution)
+    
+    async def publish_deferred(self, video_uuid: str, deferred: DeferredRenditions):
+        """
+        Публикация отложенных ступеней до их кодирования: под именем каждой
+        выгружается медиаплейлист ступени fallback (URI сегментов в нем
+        относительные, поэтому плеер получает сегменты меньшего разрешения),
+        затем сохраняется запись DeferredRenditions.
+        """
+        folder = f"{self.s3_service.video_files_folder}/{video_uuid}"
+        
+        def playlist_key(resolution: str) -> str:
+            return f"{folder}/{self._rendition_name(resolution, video_uuid)}.m3u8"
+        
+        fallback = await self.s3_service.get_bytes(playlist_key(deferred.fallback))
+        if fallback is None:
+            raise Exception(f"Fallback rendition {deferred.fallback} is not uploaded")
+        for resolution in deferred.renditions:
+            await self.s3_service.upload_bytes(fallback, playlist_key(resolution))
+        await deferred.save(self.s3_service, video_uuid)
+        print(f"Published {deferred.renditions} as {deferred.fallback} until requested")
+    
+    async def process_deferred_message(self, message: aio_pika.IncomingMessage):
+        """
+        Обработка задачи кодирования отложенной ступени.
+        
+        Задача выполняется под арендой видео (как и обработка при загрузке),
+        поэтому одновременные дубли ступень не кодируют дважды. Сообщение
+        подтверждается и при ошибке: отметка запроса снимается,
+        и следующий запрос плейлиста поставит задачу снова.
+        """
+        try:
+            data = json.loads(message.body.decode())
+            video_uuid, video_path, rendition = data['uuid'], data['video_path'], data['rendition']
+        except (UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError) as e:
+            print(f"Invalid deferred rendition message: {e}")
+            await message.ack()
+            return
+        
+        job = self.job_registry.start(f"{video_uuid}/{rendition}", video_path, kind='rendition')
+        job_token = current_job.set(job)
+        success = False
+        try:
+            required_disk = await self.estimate_job_disk(video_path)
+            async with self.admission.admit(required_disk), \
+                    JobLease(self.s3_service, video_uuid, self.job_config.lease_ttl):
+                success = await self.process_deferred(video_uuid, rendition)
+        except LeaseLostError as e:
+            print(f"Deferred rendition interrupted: {e}")
+        except Exception as e:
+            print(f"Error processing deferred rendition: {e}")
+            job.error = str(e)
+        finally:
+            current_job.reset(job_token)
+            JOBS.labels('success' if success else 'failure', '' if success else job.stage).inc()
+            self.job_registry.finish(job, success)
+        await message.ack()
+    
+    async def process_deferred(self, video_uuid: str, rendition: str) -> bool:
+        """
+        Кодирование отложенной ступени: медиаплейлист ступени заменяет
+        плейлист fallback после выгрузки ее сегментов, мастер-плейлист
+        перепубликуется с измеренным битрейтом. Когда отложенных ступеней
+        не осталось, исходник удаляется.
+        """
+        deferred = await DeferredRenditions.load(self.s3_service, video_uuid)
+        if deferred is None or rendition not in deferred.renditions:
+            print(f"Deferred rendition {rendition} of {video_uuid} is already encoded")
+            return True
+        try:
+            checkpoint = await JobCheckpoint.load(self.s3_service, video_uuid)
+            with tempfile.TemporaryDirectory(prefix=video_uuid) as temp_dir:
+                set_stage('preparing')
+                input_file = await self.prepare_input(deferred.video_path, temp_dir)
+                set_stage('probing')
+                media_info = await self.get_media_info(video_uuid, input_file)
+                if job := current_job.get():
+                    job.duration, job.resolutions = media_info.duration, [rendition]
+                
+                set_stage('encoding')
+                output_dir = os.path.join(temp_dir, "hls")
+                os.makedirs(output_dir, exist_ok=True)
+                await self.convert_to_hls(input_file, video_uuid, rendition, output_dir,
+                                          align_keyframes=deferred.align_keyframes)
+                
+                set_stage('publishing')
+                audio_res = [AUDIO_RENDITION] if self.shares_audio(media_info) else []
+                async with HLSUploader(self.s3_service, output_dir, f"video_files/{video_uuid}") as uploader:
+                    await uploader.sync()
+                    bitrates = self._measured_bitrates(uploader, video_uuid, audio_res + deferred.master, checkpoint)
+                    await checkpoint.record_rendition(rendition, bitrates[rendition], None)
+                    await self.create_master_playlist(video_uuid, deferred.master, output_dir, media_info, bitrates,
+                                                      checkpoint.codecs())
+                    await uploader.publish_master()
             
+            # Запись перечитывается: пока ступень кодировалась, могли быть запрошены другие
+            deferred = await DeferredRenditions.load(self.s3_service, video_uuid) or deferred
+            deferred.renditions.remove(rendition)
+            deferred.requested.pop(rendition, None)
+            if deferred.renditions:
+                await deferred.save(self.s3_service, video_uuid)
+            else:
+                print(f"All deferred renditions encoded, removing original video: {deferred.video_path}")
+                await self.s3_service.delete_files([
+                    deferred.video_path, self.media_info_key(video_uuid), DeferredRenditions.key(video_uuid)
+                ])
+            print(f"Deferred rendition {rendition} of {video_uuid} published")
+            return True
+        
         except Exception as e:
-            print(f"Error getting video resolution: {e}")
-            raise
+            print(f"Error encoding deferred rendition {rendition}: {e}")
+            if job := current_job.get():
+                job.error = str(e)
+            # Снятие отметки запроса: следующий запрос плейлиста поставит задачу снова
+            deferred = await DeferredRenditions.load(self.s3_service, video_uuid) or deferred
+            deferred.requested.pop(rendition, None)
+            await deferred.save(self.s3_service, video_uuid)
+            return False
+    
+    async def encode_variants(self, input_file: str, video_uuid: str, variants: list, output_dir: str,
+                              on_rendition_done: Callable[[str], Awaitable[None]] | None = None):
+        """
+        Кодирование вариантов верхних ступеней в дополнительных кодеках.
+        
+        Варианты кодируются после всей лестницы H.264: программные HEVC и AV1
+        в разы медленнее и не должны задерживать совместимые рендишены.
+        В режиме parallel варианты делят бюджет ядер через планировщик
+        рендишенов, в остальных режимах кодируются по одному.
+        """
+        if not variants:
+            return
+        
+        async def encode(variant: str, threads: int | None = None):
+            await self.convert_to_hls(input_file, video_uuid, variant, output_dir, threads)
+            if on_rendition_done:
+                await on_rendition_done(variant)
+        
+        if self.transcode_config.encode_mode == 'parallel':
+            await self.rendition_scheduler.run(variants, encode)
+        else:
+            for variant in variants:
+                await encode(variant)
+    
+    def select_resolutions(self, width: int, height: int) -> list[str]:
+        """
+        Выбор разрешений лестницы, не превышающих разрешение исходника.
+        
+        Минимальная ступень выбирается всегда и идет первой, остальные -
+        от большего разрешения к меньшему. Для вертикального видео ступени
+        лестницы поворачиваются (1080:1920 и т.д.).
+        """
+        portrait = height > width
+        long_side, short_side = max(width, height), min(width, height)
+        ladder = sorted(self.transcode_config.ladder, key=lambda rung: rung.width * rung.height)
+        rungs = [ladder[0]] + [
+            rung for rung in reversed(ladder[1:]) if rung.width <= long_side and rung.height <= short_side
+        ]
+        return [f"{rung.height}:{rung.width}" if portrait else f"{rung.width}:{rung.height}" for rung in rungs]
     
-    async def convert_to_hls(self, input_file: str, video_uuid: str, resolution: str, output_dir: str):
-        """Конвертация в HLS используя прямое выполнение команд FFmpeg"""
+    def select_deferred(self, resolutions: list) -> list[str]:
+        """
+        Ступени, кодирование которых откладывается до первого запроса:
+        не ниже jit_min_height; минимальная ступень кодируется всегда.
+        """
+        if not self.transcode_config.jit_enabled:
+            return []
+        return [
+            resolution for resolution in resolutions[1:]
+            if rendition_height(resolution) >= self.transcode_config.jit_min_height
+        ]
+    
+    def select_variants(self, resolutions: list, media_info: MediaInfo, popularity: int | None = None) -> list[str]:
+        """
+        Варианты верхних ступеней в дополнительных кодеках (политика стоимости).
+        
+        Варианты кодируются, только если видео не короче variant_min_duration
+        или его популярность (поле popularity сообщения - суммарные просмотры
+        канала автора) не меньше variant_min_popularity: для короткого видео
+        малоизвестного автора экономия трафика не окупает кодирование.
+        Берутся variant_rungs самых больших ступеней из resolutions
+        не ниже variant_min_height, для каждого кодека из variant_codecs.
+        """
+        config = self.transcode_config
+        if not config.variant_codecs:
+            return []
+        long_enough = config.variant_min_duration is not None and media_info.duration is not None \
+            and media_info.duration >= config.variant_min_duration
+        popular = config.variant_min_popularity is not None and popularity is not None \
+            and popularity >= config.variant_min_popularity
+        if not (long_enough or popular):
+            return []
+        top_res = [
+            resolution for resolution in sorted(resolutions, key=resolution_pixels, reverse=True)
+            if rendition_height(resolution) >= config.variant_min_height
+        ][:config.variant_rungs]
+        return [f"{resolution}@{codec}" for codec in config.variant_codecs for resolution in top_res]
+    
+    def ladder_rung(self, resolution: str) -> 'LadderRung':
+        """
+        Ступень лестницы для разрешения (в том числе повернутого и варианта
+        в дополнительном кодеке); для разрешения вне лестницы - ближайшая
+        по числу пикселей.
+        """
+        sides = sorted((int(side) for side in split_variant(resolution)[0].split(':')), reverse=True)
+        for rung in self.transcode_config.ladder:
+            if [rung.width, rung.height] == sides:
+                return rung
+        pixels = resolution_pixels(resolution)
+        return min(self.transcode_config.ladder, key=lambda rung: abs(rung.width * rung.height - pixels))
+    
+    def select_remux_resolution(self, media_info: MediaInfo, resolutions: list) -> str | None:
+        """
+        Ступень лестницы, которую можно получить из исходника без перекодирования.
+        
+        Исходник должен быть H.264 допустимого профиля в yuv420p без поворота,
+        звук (если есть) - AAC-LC, разрешение - совпадать со ступенью,
+        а ключевые кадры идти не реже REMUX_MAX_KEYFRAME_INTERVAL, иначе
+        сегменты этой ступени получатся слишком длинными.
+        """
+        if not self.transcode_config.remux_enabled:
+            return None
+        if (media_info.video_codec != 'h264'
+                or media_info.video_profile not in self.transcode_config.remux_profiles
+                or media_info.video_profile not in H264_PROFILE_CODES
+                or media_info.video_level is None
+                or media_info.pix_fmt != 'yuv420p'
+                or media_info.rotation):
+            return None
+        if media_info.has_audio and (media_info.audio_codec != 'aac' or media_info.audio_profile != 'LC'):
+            return None
+        
+        resolution = f"{media_info.width}:{media_info.height}"
+        if resolution not in resolutions:
+            return None
+        
+        keyframe_interval = media_info.keyframe_interval
+        if keyframe_interval is None or keyframe_interval > REMUX_MAX_KEYFRAME_INTERVAL:
+            return None
+        return resolution
+    
+    async def get_media_info(self, video_uuid: str, input_file: str) -> MediaInfo:
+        """
+        Параметры исходника по заголовку (ffprobe без чтения пакетов).
+        
+        Интервал ключевых кадров нужен только для remux и измеряется
+        для H.264 исходника по первым KEYFRAME_PROBE_WINDOW секундам
+        видеопотока. Результат сохраняется в MinIO рядом с задачей,
+        поэтому повторная обработка того же видео (после сбоя)
+        не запускает ffprobe снова.
+        """
+        cache_key = self.media_info_key(video_uuid)
+        cached = await self.s3_service.get_bytes(cache_key)
+        if cached is not None:
+            print(f"Using cached media info: {cache_key}")
+            return MediaInfo.model_validate_json(cached)
+        
+        with STAGE_SECONDS.labels('probe').time():
+            output = await self._run_ffprobe(['-show_entries', FFPROBE_ENTRIES, '-of', 'json', input_file])
+            media_info = MediaInfo.from_ffprobe(json.loads(output))
+            if self.transcode_config.remux_enabled and media_info.video_codec == 'h264':
+                keyframes = await self.probe_keyframes(input_file, KEYFRAME_PROBE_WINDOW)
+                window_end = min(media_info.duration, KEYFRAME_PROBE_WINDOW) if media_info.duration \
+                    else KEYFRAME_PROBE_WINDOW
+                media_info.keyframe_interval = max_keyframe_interval(keyframes, window_end)
+        await self.s3_service.upload_bytes(media_info.model_dump_json().encode(), cache_key)
+        return media_info
+    
+    async def probe_keyframes(self, input_file: str, window: float | None = None) -> list[float]:
+        """
+        Времена ключевых кадров видеопотока: пакеты только первого
+        видеопотока, при window - только первые window секунд.
+        """
+        interval_args = ['-read_intervals', f'%+{window:g}'] if window else []
+        output = await self._run_ffprobe([
+            '-select_streams', 'v:0', *interval_args,
+            '-show_entries', FFPROBE_KEYFRAME_ENTRIES, '-of', 'json', input_file
+        ])
+        return parse_keyframes(json.loads(output))
+    
+    @staticmethod
+    def media_info_key(video_uuid: str) -> str:
+        """Путь сохраненного MediaInfo в MinIO."""
+        return f"jobs/{video_uuid}/media_info.json"
+    
+    async def _run_ffprobe(self, args: list[str]) -> str:
+        """Запуск ffprobe и получение stdout."""
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'error', *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        
+        stdout, stderr = await process.communicate()
+        
+        if process.returncode != 0:
+            error_msg = stderr.decode() if stderr else "Unknown error"
+            raise Exception(f"ffprobe failed: {error_msg}")
+        
+        return stdout.decode()
+    
+    async def convert_to_hls(self, input_file: str, video_uuid: str, resolution: str, output_dir: str,
+                             threads: int | None = None, align_keyframes: bool = False):
+        """
+        Конвертация в HLS используя прямое выполнение команд FFmpeg
+        
+        threads ограничивает число потоков декодера и кодировщика;
+        без него FFmpeg выбирает количество потоков сам.
+        align_keyframes - ключевые кадры только там же, где у исходника
+        (для совместимости с рендишеном, нарезанным без перекодирования).
+        """
         try:
-            res_parts = resolution.split(":")
-            res_name = f"{res_parts[1]}p-{video_uuid}"
+            res_name = self._rendition_name(resolution, video_uuid)
             output_file = os.path.join(output_dir, f"{res_name}.m3u8")
             
-            print(f"Converting to {resolution} -> {res_name}")
+            print(f"Converting to {resolution} -> {res_name}" + (f" with {threads} threads" if threads else ""))
             
+            thread_args = ['-threads', str(threads)] if threads else []
             cmd = [
                 'ffmpeg',
-                '-i', input_file,
-                '-vf', f'scale={resolution}',
-                '-c:v', 'libx264',
-                '-preset', 'fast',
-                '-profile:v', 'baseline',
-                '-level', '3.0',
                 '-loglevel', 'warning',
-                '-start_number', '0',
-                '-hls_time', '5',
-                '-hls_list_size', '0',
-                '-f', 'hls',
-                output_file
+                *thread_args,
+                *self._input_args(input_file),
+                '-vf', f'scale={split_variant(resolution)[0]}',
+                *self._rendition_audio_args(),
+                *thread_args,
+                *self._hls_output_args(output_file, resolution, align_keyframes)
             ]
             
             print(f"Running FFmpeg command for {resolution}")
-            
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                error_output = stderr.decode() if stderr else "No error output"
-                print(f"FFmpeg error output: {error_output}")
-                raise Exception(f"FFmpeg command failed with return code {process.returncode}")
+            codec = split_variant(resolution)[1]
+            rendition = f"{rendition_height(resolution)}p" + (f"-{codec}" if codec else "")
+            with ENCODE_SECONDS.labels(rendition, 'encode').time():
+                await self._run_ffmpeg(cmd, resolution, threads)
             
             if not os.path.exists(output_file):
                 raise FileNotFoundError(f"Output file {output_file} was not created")
@@ -209,41 +1069,376 @@ class VideoProcessor:
             print(f"Error converting {resolution}: {e}")
             raise
     
-    async def create_master_playlist(self, video_uuid: str, resolutions: list, output_dir: str):
-        """Создание мастер-плейлиста."""
-        master_content = "#EXTM3U\n#EXT-X-VERSION:3\n"
+    async def remux_to_hls(self, input_file: str, video_uuid: str, resolution: str, output_dir: str):
+        """Нарезка исходника в HLS без перекодирования (ступень, совпадающая с исходником)."""
+        res_name = self._rendition_name(resolution, video_uuid)
+        output_file = os.path.join(output_dir, f"{res_name}.m3u8")
+        
+        print(f"Remuxing {resolution} -> {res_name}")
+        with ENCODE_SECONDS.labels(f"{rendition_height(resolution)}p", 'remux').time():
+            await self._run_ffmpeg([
+                'ffmpeg',
+                '-loglevel', 'warning',
+                *self._input_args(input_file),
+                '-map', '0:v:0',
+                *([] if self.transcode_config.shared_audio else ['-map', '0:a:0?']),
+                '-c', 'copy',
+                *self._hls_muxer_args(output_file)
+            ], f"{resolution} remux", threads=1)
+        
+        if not os.path.exists(output_file):
+            raise FileNotFoundError(f"Output file {output_file} was not created")
+    
+    async def encode_audio_rendition(self, input_file: str, video_uuid: str, output_dir: str):
+        """Однократное кодирование звука в отдельный HLS-рендишен, общий для всех разрешений."""
+        output_file = os.path.join(output_dir, f"{self._rendition_name(AUDIO_RENDITION, video_uuid)}.m3u8")
+        
+        print(f"Encoding shared audio rendition -> {os.path.basename(output_file)}")
+        with ENCODE_SECONDS.labels(AUDIO_RENDITION, 'encode').time():
+            await self._run_ffmpeg([
+                'ffmpeg',
+                '-loglevel', 'warning',
+                *self._input_args(input_file),
+                '-map', '0:a:0',
+                '-vn',
+                '-c:a', 'aac',
+                *self._hls_muxer_args(output_file)
+            ], AUDIO_RENDITION, threads=1)
+        
+        if not os.path.exists(output_file):
+            raise FileNotFoundError(f"Output file {output_file} was not created")
+    
+    def shares_audio(self, media_info: MediaInfo | None) -> bool:
+        """Выносится ли звук видео в общий звуковой рендишен."""
+        return self.transcode_config.shared_audio and media_info is not None and media_info.has_audio
+    
+    def _rendition_audio_args(self) -> list[str]:
+        """Параметры звука видеорендишена: при общем звуковом рендишене звук в него не пишется."""
+        return ['-an'] if self.transcode_config.shared_audio else []
+    
+    async def convert_to_hls_single_decode(self, input_file: str, video_uuid: str, resolutions: list,
+                                           output_dir: str, align_keyframes: bool = False):
+        """
+        Конвертация во все разрешения одним запуском FFmpeg.
+        
+        Исходник декодируется один раз, кадры раздаются фильтром split
+        на ветки scale, каждая ветка кодируется в свой HLS-выход.
+        """
+        try:
+            print(f"Converting to {resolutions} with a single decode")
+            
+            cmd = [
+                'ffmpeg',
+                '-loglevel', 'warning',
+                *self._input_args(input_file),
+                '-filter_complex', self._build_split_filter(resolutions)
+            ]
+            
+            output_files = []
+            for index, resolution in enumerate(resolutions):
+                output_file = os.path.join(output_dir, f"{self._rendition_name(resolution, video_uuid)}.m3u8")
+                output_files.append(output_file)
+                cmd += [
+                    '-map', f'[v{index}out]',
+                    *([] if self.transcode_config.shared_audio else ['-map', '0:a?']),
+                    *self._hls_output_args(output_file, resolution, align_keyframes)
+                ]
+            
+            with ENCODE_SECONDS.labels('all', 'single_decode').time():
+                await self._run_ffmpeg(cmd, ",".join(resolutions))
+            
+            for output_file in output_files:
+                if not os.path.exists(output_file):
+                    raise FileNotFoundError(f"Output file {output_file} was not created")
+            
+            print(f"Successfully converted to {resolutions}")
+            
+        except Exception as e:
+            print(f"Error converting {resolutions}: {e}")
+            raise
+    
+    def _input_args(self, input_file: str) -> list[str]:
+        """Параметры входа FFmpeg; для чтения по ссылке включается переподключение."""
+        if input_file.startswith(('http://', 'https://')):
+            return [
+                '-reconnect', '1',
+                '-reconnect_on_network_error', '1',
+                '-reconnect_delay_max', '10',
+                '-i', input_file
+            ]
+        return ['-i', input_file]
+    
+    def _build_split_filter(self, resolutions: list) -> str:
+        """Построение filter_complex: split исходного видео на ветки scale по разрешениям."""
+        labels = [f"v{index}" for index in range(len(resolutions))]
+        split = f"[0:v]split={len(resolutions)}" + "".join(f"[{label}]" for label in labels)
+        scales = [f"[{label}]scale={resolution}[{label}out]" for label, resolution in zip(labels, resolutions)]
+        return ";".join([split, *scales])
+    
+    def _hls_output_args(self, output_file: str, resolution: str, align_keyframes: bool = False) -> list[str]:
+        """
+        Параметры кодирования и HLS-муксера для одного выхода.
+        
+        Варианты в дополнительных кодеках всегда пишутся в fMP4
+        (HEVC и AV1 в HLS не передаются в MPEG-TS) с ключевыми кадрами
+        по GOP ступени.
+        """
+        if split_variant(resolution)[1]:
+            rung = self.ladder_rung(resolution)
+            keyframe_args = ['-force_key_frames', f'expr:gte(t,n_forced*{rung.gop:g})']
+            return [*self._video_codec_args(resolution), *keyframe_args, *self._hls_muxer_args(output_file, 'fmp4')]
+        if align_keyframes:
+            # Ключевые кадры ровно на ключевых кадрах исходника
+            keyframe_args = self._forced_keyframe_args('source')
+        else:
+            rung = self.ladder_rung(resolution)
+            keyframe_args = ['-force_key_frames', f'expr:gte(t,n_forced*{rung.gop:g})']
+            if rung.align_keyframes:
+                keyframe_args += ['-sc_threshold', '0']
+        return [*self._video_codec_args(resolution), *keyframe_args, *self._hls_muxer_args(output_file)]
+    
+    @staticmethod
+    def _forced_keyframe_args(force_key_frames: str) -> list[str]:
+        """Ключевые кадры только в точках force_key_frames: без собственных GOP и scenecut x264."""
+        return ['-force_key_frames', force_key_frames, '-x264-params', 'keyint=infinite:scenecut=0']
+    
+    def _video_codec_args(self, resolution: str) -> list[str]:
+        """Параметры видеокодировщика ступени: профиль, уровень и CRF с ограничением битрейта (VBV)."""
+        rung = self.ladder_rung(resolution)
+        codec = split_variant(resolution)[1]
+        if codec:
+            return self._variant_codec_args(codec, rung)
+        args = [
+            '-c:v', 'libx264',
+            '-preset', 'fast',
+            '-profile:v', rung.profile,
+            '-level', rung.level,
+            '-crf', str(rung.crf)
+        ]
+        if rung.maxrate:
+            args += ['-maxrate', str(rung.maxrate), '-bufsize', str(rung.bufsize or 2 * rung.maxrate)]
+        return args
+    
+    def _variant_codec_args(self, codec: str, rung: 'LadderRung') -> list[str]:
+        """
+        Параметры программного кодировщика варианта ступени rung.
+        
+        8 бит 4:2:0 (профиль Main) задается явно, чтобы CODECS
+        в мастер-плейлисте совпадал с потоком и для 10-битного исходника.
+        Смены сцен не добавляют ключевых кадров, GOP закрытый: сегменты
+        начинаются с ключевых кадров на тех же отметках, что у ступени.
+        """
+        args = ['-c:v', VARIANT_ENCODERS[codec], '-pix_fmt', 'yuv420p']
+        crf = rung.crf + VARIANT_CRF_OFFSETS[codec]
+        if codec == 'hevc':
+            # hvc1: параметры в init-сегменте, как требуют плееры Apple
+            args += ['-preset', 'medium', '-profile:v', 'main', '-tag:v', 'hvc1', '-crf', str(crf),
+                     '-x265-params', 'open-gop=0:scenecut=0']
+        else:
+            args += ['-preset', '8', '-crf', str(crf), '-svtav1-params', f'keyint={2 * HLS_SEGMENT_TIME}s:scd=0']
+        if rung.maxrate:
+            maxrate = round(rung.maxrate * VARIANT_BITRATE_RATIOS[codec])
+            bufsize = round((rung.bufsize or 2 * rung.maxrate) * VARIANT_BITRATE_RATIOS[codec])
+            args += ['-maxrate', str(maxrate), '-bufsize', str(bufsize)]
+        return args
+    
+    def _hls_muxer_args(self, output_file: str, segment_format: str | None = None) -> list[str]:
+        """
+        Параметры HLS-муксера; segment_format - формат сегментов,
+        если он отличается от настроек перекодирования.
+        
+        В формате fmp4 рендишен пишется одним fMP4-файлом рядом с плейлистом
+        (init-сегмент и фрагменты адресуются EXT-X-BYTERANGE).
+        """
+        if (segment_format or self.transcode_config.segment_format) == 'fmp4':
+            segment_args = [
+                '-hls_flags', 'single_file',
+                '-hls_segment_type', 'fmp4',
+                '-hls_segment_filename', f"{os.path.splitext(output_file)[0]}.mp4"
+            ]
+        else:
+            segment_args = ['-hls_flags', 'temp_file']
+        return [
+            '-start_number', '0',
+            '-hls_time', str(HLS_SEGMENT_TIME),
+            '-hls_list_size', '0',
+            *segment_args,
+            '-f', 'hls',
+            output_file
+        ]
+    
+    async def _run_ffmpeg(self, cmd: list[str], label: str | None = None, threads: int | None = None):
+        """
+        Запуск FFmpeg и проверка кода возврата.
+        
+        FFmpeg пишет прогресс (-progress) в stdout, он разбирается по мере
+        поступления в EncodeProgress текущей задачи под именем label.
+        threads - число выделенных ядер (для скорости на ядро); без него
+        FFmpeg занимает все ядра бюджета.
+        """
+        job = current_job.get()
+        progress = None
+        if job is not None:
+            progress = job.start_encode(label or "ffmpeg", threads or self.transcode_config.cpu_budget)
+        
+        process = await asyncio.create_subprocess_exec(
+            cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:],
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stderr_task = asyncio.create_task(process.stderr.read())
+        
+        try:
+            fields = {}
+            async for line in process.stdout:
+                key, _, value = line.decode().strip().partition('=')
+                fields[key] = value
+                if key == 'progress':
+                    if progress:
+                        progress.update(fields)
+                    fields = {}
+            stderr = await stderr_task
+            await process.wait()
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            stderr_task.cancel()
+            if progress:
+                progress.finish(success=False)
+            raise
+        
+        if progress:
+            progress.finish(success=process.returncode == 0)
+        if process.returncode != 0:
+            error_output = stderr.decode() if stderr else "No error output"
+            print(f"FFmpeg error output: {error_output}")
+            raise Exception(f"FFmpeg command failed with return code {process.returncode}")
+    
+    def _rendition_name(self, resolution: str, video_uuid: str) -> str:
+        """Имя HLS-рендишена (без расширения) для разрешения, варианта или общего звукового рендишена."""
+        if resolution == AUDIO_RENDITION:
+            return f"{AUDIO_RENDITION}-{video_uuid}"
+        codec = split_variant(resolution)[1]
+        return f"{rendition_height(resolution)}p-{codec}-{video_uuid}" if codec \
+            else f"{rendition_height(resolution)}p-{video_uuid}"
+    
+    async def create_master_playlist(self, video_uuid: str, resolutions: list, output_dir: str,
+                                     media_info: MediaInfo | None = None, bitrates: dict | None = None,
+                                     codecs: dict | None = None):
+        """
+        Создание мастер-плейлиста.
+        
+        bitrates - измеренные (пиковый, средний) битрейты рендишенов; для
+        рендишенов без измерений BANDWIDTH - maxrate ступени лестницы (_get_bandwidth).
+        media_info - параметры исходника для CODECS и FRAME-RATE.
+        codecs - CODECS рендишенов, кодированных не нашим кодировщиком
+        (например, нарезанных из исходника без перекодирования).
+        
+        При общем звуковом рендишене он объявляется группой EXT-X-MEDIA,
+        на которую ссылаются все видеоварианты (их битрейт включает звук),
+        а в конце добавляется вариант только со звуком для очень медленных сетей.
+        """
+        bitrates = bitrates or {}
+        codecs = codecs or {}
+        # EXT-X-MAP и EXT-X-BYTERANGE с fMP4 (в том числе у вариантов в дополнительных кодеках) требуют версии 7
+        fmp4 = self.transcode_config.segment_format == 'fmp4' or any(split_variant(res)[1] for res in resolutions)
+        version = 7 if fmp4 else 3
+        master_content = f"#EXTM3U\n#EXT-X-VERSION:{version}\n"
+        
+        shared_audio = self.shares_audio(media_info)
+        audio_peak = audio_average = 0
+        if shared_audio:
+            audio_name = self._rendition_name(AUDIO_RENDITION, video_uuid)
+            audio_peak, audio_average = bitrates.get(AUDIO_RENDITION) or (AUDIO_BANDWIDTH, AUDIO_BANDWIDTH)
+            master_content += (f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="{AUDIO_GROUP}",NAME="default",'
+                               f'DEFAULT=YES,AUTOSELECT=YES,URI="{audio_name}.m3u8"\n')
         
         for resolution in resolutions:
-            res_parts = resolution.split(":")
-            res_name = f"{res_parts[1]}p-{video_uuid}"
-            bandwidth = self._get_bandwidth(resolution)
-            master_content += f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={resolution}\n{res_name}.m3u8\n'
+            res_name = self._rendition_name(resolution, video_uuid)
+            attributes = []
+            if bitrates.get(resolution):
+                peak, average = bitrates[resolution]
+                attributes += [f'BANDWIDTH={peak + audio_peak}', f'AVERAGE-BANDWIDTH={average + audio_average}']
+            else:
+                attributes.append(f'BANDWIDTH={self._get_bandwidth(resolution)}')
+            codec = codecs.get(resolution) or self._codecs(media_info.has_audio if media_info else True,
+                                                           resolution=resolution)
+            attributes.append(f'CODECS="{codec}"')
+            attributes.append(f'RESOLUTION={split_variant(resolution)[0].replace(":", "x")}')
+            if media_info and media_info.frame_rate:
+                attributes.append(f'FRAME-RATE={media_info.frame_rate:.3f}')
+            if shared_audio:
+                attributes.append(f'AUDIO="{AUDIO_GROUP}"')
+            master_content += f'#EXT-X-STREAM-INF:{",".join(attributes)}\n{res_name}.m3u8\n'
+        
+        if shared_audio:
+            master_content += (f'#EXT-X-STREAM-INF:BANDWIDTH={audio_peak},AVERAGE-BANDWIDTH={audio_average},'
+                               f'CODECS="{AAC_LC_CODEC}",AUDIO="{AUDIO_GROUP}"\n{audio_name}.m3u8\n')
         
         master_file = os.path.join(output_dir, "master.m3u8")
         with open(master_file, 'w') as f:
             f.write(master_content)
         print("Created master playlist")
     
-    def _get_bandwidth(self, resolution: str) -> int:
-        """Определение битрейта для разрешения."""
-        height = int(resolution.split(':')[1])
-        bitrates = {
-            144: 500000, 240: 750000, 360: 1000000, 
-            480: 1500000, 720: 2500000, 1080: 5000000, 
-            1440: 8000000, 2160: 16000000
+    def _measured_bitrates(self, uploader: HLSUploader, video_uuid: str, resolutions: list,
+                           checkpoint: JobCheckpoint | None = None) -> dict:
+        """
+        Измеренные при выгрузке битрейты рендишенов; для рендишенов,
+        выгруженных предыдущими попытками задачи, - из манифеста checkpoint.
+        """
+        return {
+            resolution: uploader.bitrates(f"{self._rendition_name(resolution, video_uuid)}.m3u8")
+            or (checkpoint.bitrates(resolution) if checkpoint else None)
+            for resolution in resolutions
         }
-        return bitrates.get(height, 500000)
     
-    async def send_confirmation(self, video_uuid: str):
-        """Отправка подтверждения."""
-        message = {"uuid": video_uuid}
+    def _codecs(self, has_audio: bool, video_codec: str | None = None, resolution: str | None = None) -> str:
+        """
+        Значение CODECS (RFC 6381); без video_codec видеокодек берется
+        из профиля и уровня ступени лестницы resolution (по умолчанию минимальной),
+        для варианта в дополнительном кодеке - из уровня по высоте ступени.
+        """
+        codec = split_variant(resolution)[1] if resolution else None
+        if video_codec is None and codec:
+            level = variant_level(resolution)
+            video_codec = hevc_codec(level) if codec == 'hevc' else av1_codec(level)
+        if video_codec is None:
+            rung = self.ladder_rung(resolution) if resolution else \
+                min(self.transcode_config.ladder, key=lambda ladder_rung: ladder_rung.width * ladder_rung.height)
+            video_codec = h264_codec(X264_PROFILES[rung.profile], round(float(rung.level) * 10))
+        codecs = [video_codec]
+        if has_audio:
+            codecs.append(AAC_LC_CODEC)
+        return ",".join(codecs)
+    
+    def _get_bandwidth(self, resolution: str) -> int:
+        """
+        Определение битрейта для разрешения: maxrate ступени или типичный битрейт по высоте;
+        для варианта в дополнительном кодеке - его доля VARIANT_BITRATE_RATIOS.
+        """
+        rung = self.ladder_rung(resolution)
+        bandwidth = rung.maxrate or DEFAULT_BANDWIDTHS.get(rendition_height(resolution), 500000)
+        codec = split_variant(resolution)[1]
+        return round(bandwidth * VARIANT_BITRATE_RATIOS[codec]) if codec else bandwidth
+    
+    async def send_confirmation(self, video_uuid: str, status: str, media_info: MediaInfo | None = None):
+        """
+        Отправка подтверждения.
+        
+        status: "playable" - опубликовано минимальное разрешение, видео можно смотреть;
+        "complete" - опубликованы все разрешения.
+        media_info - параметры исходника (длительность, разрешение и т.д.).
+        """
+        message = {"uuid": video_uuid, "status": status}
+        if media_info:
+            message["media_info"] = media_info.summary()
         await self.channel.default_exchange.publish(
             aio_pika.Message(
                 body=json.dumps(message).encode(),
                 content_type="application/json",
                 delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                message_id=video_uuid
+                message_id=f"{video_uuid}:{status}"
             ),
             routing_key="confirm_video_hls_converting"
         )
-        print(f"Sent confirmation for: {video_uuid}")
+        print(f"Sent {status} confirmation for: {video_uuid}")
@@ -0,0 +1,1696 @@
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import warnings
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+os.environ['DEBUG_MODE'] = 'True'
+os.environ['VIDEO_POSTPROCESS_WORKERS'] = '1'
+os.environ['RABBITMQ_DEFAULT_USER'] = 'test_user'
+os.environ['RABBITMQ_DEFAULT_PASS'] = 'test_password'
+os.environ['MINIO_SERVER_URL'] = 'localhost:9000'
+os.environ['MINIO_ROOT_USER'] = 'test_user'
+os.environ['MINIO_ROOT_PASSWORD'] = 'test_password'
+
+from fastapi.testclient import TestClient
+
+from main import app
+from config import RABBITMQ_SETTINGS, MINIO_SETTINGS, TRANSCODE_SETTINGS, JOB_SETTINGS, \
+    DISTRIBUTED_SETTINGS, RETRY_SETTINGS, SUPERVISOR_SETTINGS, ADMIN_SETTINGS, TranscodeSettings
+from services.admission import AdmissionController
+from services.checkpoint import JobCheckpoint, JobLease, LeaseLostError
+from services.chunked_transcoder import ChunkedTranscoder, plan_chunks, forced_keyframe_times
+from services.deferred import DeferredRenditions, RenditionDemand
+from services.dedup import SourceIndex
+from services.hls_uploader import HLSUploader
+from services.jobs import JobRegistry, JobState, current_job
+from services.media_info import MediaInfo, parse_keyframes, max_keyframe_interval
+from services.metrics import JOBS, JOB_UPLOAD_SECONDS, QUEUE_WAIT_SECONDS
+from services.rabbitmq import RetryTopology
+from services.s3 import S3Service
+from services.scheduler import JobScheduler
+from services.supervisor import WorkerSupervisor
+from services.video_processor import VideoProcessor, RenditionScheduler, HLS_SEGMENT_TIME, h264_codec
+
+
+def make_processor() -> VideoProcessor:
+    """Создание процессора без подключения к MinIO и RabbitMQ"""
+    return VideoProcessor(RABBITMQ_SETTINGS, MINIO_SETTINGS, TRANSCODE_SETTINGS, JOB_SETTINGS, DISTRIBUTED_SETTINGS,
+                          RETRY_SETTINGS)
+
+
+def make_fake_convert_to_hls(processor: VideoProcessor, encoded: list):
+    """Замена convert_to_hls: пишет один сегмент и медиаплейлист ступени, запоминает (uuid, разрешение)"""
+    async def convert_to_hls(input_file, video_uuid, resolution, output_dir, threads=None, align_keyframes=False):
+        encoded.append((video_uuid, resolution))
+        name = processor._rendition_name(resolution, video_uuid)
+        with open(os.path.join(output_dir, f"{name}0.ts"), 'wb') as segment:
+            segment.write(b'segment')
+        with open(os.path.join(output_dir, f"{name}.m3u8"), 'w') as playlist:
+            playlist.write(f"#EXTM3U\n#EXTINF:5.0,\n{name}0.ts\n#EXT-X-ENDLIST\n")
+    return convert_to_hls
+
+
+def make_test_video(path: str, size: str = '640x360', duration: int = 6):
+    """Генерация синтетического видео через lavfi"""
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc=size={size}:rate=25:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=duration={duration}',
+        '-pix_fmt', 'yuv420p', '-c:v', 'libx264', '-c:a', 'aac', '-shortest',
+        path
+    ], check=True)
+
+
+class TestResolutionLadder(unittest.TestCase):
+    """Тесты выбора лестницы разрешений"""
+
+    def setUp(self):
+        """Настройка перед каждым тестом"""
+        self.processor = make_processor()
+
+    def test_select_resolutions_1080p(self):
+        """Тест выбора разрешений для 1080p исходника"""
+        self.assertEqual(
+            self.processor.select_resolutions(1920, 1080),
+            ["256:144", "1920:1080", "1280:720", "854:480", "640:360", "426:240"]
+        )
+
+    def test_select_resolutions_tiny_source(self):
+        """Тест: для маленького исходника остается только 144p"""
+        self.assertEqual(self.processor.select_resolutions(200, 100), ["256:144"])
+
+    def test_select_resolutions_portrait(self):
+        """Тест: для вертикального видео ступени лестницы повернуты"""
+        self.assertEqual(
+            self.processor.select_resolutions(720, 1280),
+            ["144:256", "720:1280", "480:854", "360:640", "240:426"]
+        )
+        self.assertEqual(self.processor._rendition_name("720:1280", "test"), "720p-test")
+
+    def test_rung_encoding_parameters(self):
+        """Тест: профиль, уровень, CRF/VBV и ключевые кадры берутся из ступени лестницы, в том числе повернутой"""
+        args = self.processor._hls_output_args('out.m3u8', '1080:1920')
+        self.assertEqual(args[args.index('-profile:v') + 1:args.index('-profile:v') + 10], [
+            'high', '-level', '4.2', '-crf', '22', '-maxrate', '6000000', '-bufsize', '12000000'
+        ])
+        self.assertEqual(args[args.index('-force_key_frames') + 1], 'expr:gte(t,n_forced*2.5)')
+        self.assertIn('-sc_threshold', args)
+        self.assertEqual(self.processor._codecs(False, resolution='1920:1080'), 'avc1.64002A')
+        self.assertEqual(self.processor._get_bandwidth('1920:1080'), 6000000)
+
+    def test_custom_ladder_from_environment(self):
+        """Тест: лестница из VIDEO_LADDER задает выбор ступеней и параметры кодирования"""
+        ladder = [
+            {'width': 1280, 'height': 720, 'profile': 'main', 'level': '3.1', 'crf': 20, 'gop': 5},
+            {'width': 640, 'height': 360, 'crf': 27, 'maxrate': 800000, 'align_keyframes': False},
+        ]
+        with patch.dict(os.environ, {'VIDEO_LADDER': json.dumps(ladder)}):
+            processor = VideoProcessor(RABBITMQ_SETTINGS, MINIO_SETTINGS, TranscodeSettings(), JOB_SETTINGS,
+                                       DISTRIBUTED_SETTINGS, RETRY_SETTINGS)
+
+        self.assertEqual(processor.select_resolutions(1920, 1080), ["640:360", "1280:720"])
+        self.assertEqual(processor.select_resolutions(320, 180), ["640:360"])
+        args = processor._hls_output_args('out.m3u8', '640:360')
+        self.assertEqual(args[args.index('-maxrate') + 1:args.index('-maxrate') + 4], ['800000', '-bufsize', '1600000'])
+        self.assertNotIn('-sc_threshold', args)
+        self.assertNotIn('-maxrate', processor._video_codec_args('1280:720'))
+        self.assertEqual(processor._codecs(True, resolution='1280:720'), 'avc1.4D401F,mp4a.40.2')
+
+
+class TestMediaInfo(unittest.TestCase):
+    """Тесты разбора вывода ffprobe"""
+
+    FFPROBE_OUTPUT = {
+        "streams": [
+            {"index": 0, "codec_name": "h264", "profile": "High", "codec_type": "video", "width": 1920,
+             "height": 1080, "pix_fmt": "yuv420p", "level": 40, "avg_frame_rate": "30000/1001",
+             "side_data_list": [{"side_data_type": "Display Matrix", "rotation": -90}]},
+            {"index": 1, "codec_name": "aac", "profile": "LC", "codec_type": "audio"},
+        ],
+        "format": {"duration": "5.000000", "bit_rate": "12000000"}
+    }
+
+    FFPROBE_KEYFRAMES = {
+        "packets": [
+            {"pts_time": "0.000000", "flags": "K__"},
+            {"pts_time": "0.033333", "flags": "___"},
+            {"pts_time": "2.000000", "flags": "K__"},
+        ]
+    }
+
+    def test_rotated_phone_video(self):
+        """Тест: повернутое видео дает вертикальные размеры и звук, ключевые кадры - только в отдельном запуске"""
+        media_info = MediaInfo.from_ffprobe(self.FFPROBE_OUTPUT)
+
+        self.assertEqual((media_info.display_width, media_info.display_height), (1080, 1920))
+        self.assertIsNone(media_info.keyframe_interval)
+        self.assertEqual(max_keyframe_interval(parse_keyframes(self.FFPROBE_KEYFRAMES), 5.0), 3.0)
+        self.assertAlmostEqual(media_info.frame_rate, 29.97, places=2)
+        self.assertTrue(media_info.has_audio)
+        self.assertEqual(media_info.summary()["width"], 1080)
+
+    def test_cached_media_info_skips_ffprobe(self):
+        """Тест: при повторной обработке MediaInfo берется из MinIO без ffprobe"""
+        processor = make_processor()
+        processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={'remux_enabled': True})
+        stored = {}
+
+        class CacheS3Service:
+            async def get_bytes(self, s3_path):
+                return stored.get(s3_path)
+
+            async def upload_bytes(self, data, s3_path):
+                stored[s3_path] = data
+
+        processor.s3_service = CacheS3Service()
+        ffprobe = AsyncMock(side_effect=[json.dumps(self.FFPROBE_OUTPUT), json.dumps(self.FFPROBE_KEYFRAMES)])
+        with patch.object(processor, '_run_ffprobe', ffprobe):
+            first = asyncio.run(processor.get_media_info('test', 'source.mp4'))
+            second = asyncio.run(processor.get_media_info('test', 'source.mp4'))
+
+        # Заголовок и ключевые кадры первых секунд только видеопотока
+        self.assertEqual(ffprobe.await_count, 2)
+        self.assertNotIn('packet', ffprobe.await_args_list[0].args[0][1])
+        self.assertEqual(ffprobe.await_args_list[1].args[0][:4], ['-select_streams', 'v:0', '-read_intervals', '%+60'])
+        self.assertEqual(first.keyframe_interval, 3.0)
+        self.assertEqual(first, second)
+        self.assertIn('jobs/test/media_info.json', stored)
+
+
+class TestSingleDecode(unittest.TestCase):
+    """Тесты режима однократного декодирования"""
+
+    def setUp(self):
+        """Настройка перед каждым тестом"""
+        self.processor = make_processor()
+
+    def test_split_filter(self):
+        """Тест построения filter_complex со split/scale ветками"""
+        self.assertEqual(
+            self.processor._build_split_filter(["256:144", "1280:720"]),
+            "[0:v]split=2[v0][v1];[v0]scale=256:144[v0out];[v1]scale=1280:720[v1out]"
+        )
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_single_decode_creates_all_renditions(self):
+        """Тест: один запуск FFmpeg создает плейлисты всех разрешений"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'source.mp4')
+            make_test_video(input_file)
+
+            asyncio.run(self.processor.convert_to_hls_single_decode(
+                input_file, 'test', ["256:144", "426:240"], temp_dir
+            ))
+
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, '144p-test.m3u8')))
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, '240p-test.m3u8')))
+
+
+class TestFragmentedMP4(unittest.TestCase):
+    """Тесты вывода рендишенов одним fMP4-файлом"""
+
+    def setUp(self):
+        self.processor = make_processor()
+        self.processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={'segment_format': 'fmp4'})
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_rendition_is_single_byterange_file(self):
+        """Тест: рендишен - один .mp4 с init-сегментом, сегменты адресуются EXT-X-BYTERANGE"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'source.mp4')
+            make_test_video(input_file, duration=12)
+            output_dir = os.path.join(temp_dir, 'hls')
+            os.makedirs(output_dir)
+
+            asyncio.run(self.processor.convert_to_hls(input_file, 'test', '256:144', output_dir))
+
+            self.assertEqual(sorted(os.listdir(output_dir)), ['144p-test.m3u8', '144p-test.mp4'])
+            with open(os.path.join(output_dir, '144p-test.m3u8')) as playlist:
+                content = playlist.read()
+            self.assertIn('#EXT-X-MAP:URI="144p-test.mp4",BYTERANGE=', content)
+            entries = HLSUploader.parse_segment_entries(content)
+            self.assertGreater(len(entries), 1)
+            self.assertTrue(all(uri == '144p-test.mp4' and length for uri, _, length in entries))
+
+    def test_master_playlist_version(self):
+        """Тест: мастер-плейлист fMP4-рендишенов объявляет версию 7"""
+        with tempfile.TemporaryDirectory() as output_dir:
+            asyncio.run(self.processor.create_master_playlist('test', ['256:144'], output_dir))
+            with open(os.path.join(output_dir, 'master.m3u8')) as master:
+                self.assertTrue(master.read().startswith('#EXTM3U\n#EXT-X-VERSION:7\n'))
+
+
+class TestMasterPlaylist(unittest.TestCase):
+    """Тесты мастер-плейлиста"""
+
+    def test_measured_attributes(self):
+        """Тест: в мастере измеренные битрейты, CODECS, RESOLUTION и FRAME-RATE"""
+        processor = make_processor()
+        with tempfile.TemporaryDirectory() as output_dir:
+            asyncio.run(processor.create_master_playlist(
+                'test', ["256:144", "426:240"], output_dir,
+                MediaInfo(width=1920, height=1080, frame_rate=30000 / 1001, has_audio=True),
+                {"256:144": (180000, 120000), "426:240": None}
+            ))
+            with open(os.path.join(output_dir, 'master.m3u8')) as master:
+                lines = master.read().splitlines()
+
+        self.assertEqual(lines[2], '#EXT-X-STREAM-INF:BANDWIDTH=180000,AVERAGE-BANDWIDTH=120000,'
+                                   'CODECS="avc1.42C01E,mp4a.40.2",RESOLUTION=256x144,FRAME-RATE=29.970')
+        self.assertEqual(lines[4], '#EXT-X-STREAM-INF:BANDWIDTH=750000,'
+                                   'CODECS="avc1.42C01E,mp4a.40.2",RESOLUTION=426x240,FRAME-RATE=29.970')
+
+    def test_codecs_without_audio(self):
+        """Тест: для видео без звука CODECS содержит только видеокодек"""
+        self.assertEqual(make_processor()._codecs(has_audio=False), "avc1.42C01E")
+
+
+def ffmpeg_has_encoder(encoder: str) -> bool:
+    """Есть ли кодировщик в установленном FFmpeg"""
+    if not shutil.which('ffmpeg'):
+        return False
+    output = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True).stdout
+    return any(line.split()[1:2] == [encoder] for line in output.splitlines())
+
+
+class TestCodecVariants(unittest.TestCase):
+    """Тесты вариантов верхних ступеней в HEVC и AV1"""
+
+    def setUp(self):
+        self.processor = make_processor()
+        self.processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={
+            'variant_codecs': ['hevc', 'av1'], 'variant_min_duration': 600.0, 'variant_min_popularity': 1000
+        })
+
+    def test_cost_policy(self):
+        """Тест: варианты верхних ступеней только для длинного или популярного видео"""
+        resolutions = self.processor.select_resolutions(1920, 1080)
+        short_video = MediaInfo(width=1920, height=1080, duration=60.0)
+        long_video = MediaInfo(width=1920, height=1080, duration=900.0)
+        expected = ["1920:1080@hevc", "1280:720@hevc", "1920:1080@av1", "1280:720@av1"]
+
+        self.assertEqual(self.processor.select_variants(resolutions, short_video), [])
+        self.assertEqual(self.processor.select_variants(resolutions, short_video, popularity=10), [])
+        self.assertEqual(self.processor.select_variants(resolutions, short_video, popularity=5000), expected)
+        self.assertEqual(self.processor.select_variants(resolutions, long_video), expected)
+        # Для исходника ниже variant_min_height вариантов нет
+        self.assertEqual(self.processor.select_variants(["256:144", "640:360"], long_video), [])
+
+    def test_variant_encoding_parameters(self):
+        """Тест: варианты пишутся в fMP4 своим кодировщиком с уменьшенным maxrate"""
+        args = self.processor._hls_output_args('out.m3u8', '1920:1080@hevc')
+        self.assertEqual(args[args.index('-c:v') + 1], 'libx265')
+        self.assertEqual(args[args.index('-tag:v') + 1], 'hvc1')
+        self.assertEqual(args[args.index('-crf') + 1], '27')
+        self.assertEqual(args[args.index('-maxrate') + 1], '3600000')
+        self.assertEqual(args[args.index('-hls_segment_type') + 1], 'fmp4')
+        self.assertEqual(self.processor._video_codec_args('1920:1080@av1')[1], 'libsvtav1')
+        self.assertEqual(self.processor._rendition_name('1080:1920@av1', 'test'), '1080p-av1-test')
+
+    def test_master_playlist_codecs(self):
+        """Тест: варианты объявлены в мастере с CODECS своего кодека"""
+        with tempfile.TemporaryDirectory() as output_dir:
+            asyncio.run(self.processor.create_master_playlist(
+                'test', ["256:144", "1920:1080", "1920:1080@hevc", "3840:2160@av1"], output_dir,
+                MediaInfo(width=3840, height=2160, has_audio=True)
+            ))
+            with open(os.path.join(output_dir, 'master.m3u8')) as master:
+                lines = master.read().splitlines()
+
+        self.assertEqual(lines[1], '#EXT-X-VERSION:7')
+        self.assertEqual(lines[6], '#EXT-X-STREAM-INF:BANDWIDTH=3600000,'
+                                   'CODECS="hvc1.1.6.L123.B0,mp4a.40.2",RESOLUTION=1920x1080')
+        self.assertEqual(lines[7], '1080p-hevc-test.m3u8')
+        self.assertEqual(lines[8], '#EXT-X-STREAM-INF:BANDWIDTH=10000000,'
+                                   'CODECS="av01.0.13M.08,mp4a.40.2",RESOLUTION=3840x2160')
+
+    @unittest.skipUnless(ffmpeg_has_encoder('libx265'), 'ffmpeg is built without libx265')
+    def test_hevc_variant_rendition(self):
+        """Тест: HEVC-вариант - fMP4-рендишен с init-сегментом hvc1 и при сегментах MPEG-TS у лестницы"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'source.mp4')
+            make_test_video(input_file, size='1280x720', duration=12)
+            output_dir = os.path.join(temp_dir, 'hls')
+            os.makedirs(output_dir)
+
+            asyncio.run(self.processor.encode_variants(input_file, 'test', ['1280:720@hevc'], output_dir))
+
+            self.assertEqual(sorted(os.listdir(output_dir)), ['720p-hevc-test.m3u8', '720p-hevc-test.mp4'])
+            with open(os.path.join(output_dir, '720p-hevc-test.m3u8')) as playlist:
+                entries = HLSUploader.parse_segment_entries(playlist.read())
+            self.assertEqual([round(duration) for _, duration, _ in entries], [5, 5, 2])
+            with open(os.path.join(output_dir, '720p-hevc-test.mp4'), 'rb') as rendition:
+                self.assertIn(b'hvc1', rendition.read(4096))
+
+
+PHONE_MEDIA_INFO = MediaInfo(
+    duration=8.0, frame_rate=30.0, has_audio=True, video_codec="h264", video_profile="High", video_level=40,
+    pix_fmt="yuv420p", width=1920, height=1080, audio_codec="aac", audio_profile="LC",
+    keyframe_interval=2.0
+)
+
+
+class TestSharedAudio(unittest.TestCase):
+    """Тесты общего звукового рендишена"""
+
+    def setUp(self):
+        self.processor = make_processor()
+        self.processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={'shared_audio': True})
+
+    def test_master_references_audio_group(self):
+        """Тест: видеоварианты ссылаются на группу звука, битрейт включает звук, вариант только со звуком - последний"""
+        media_info = MediaInfo(width=640, height=360, has_audio=True)
+        bitrates = {'audio': (140000, 130000), '256:144': (300000, 250000)}
+        with tempfile.TemporaryDirectory() as output_dir:
+            asyncio.run(self.processor.create_master_playlist('test', ['256:144'], output_dir, media_info, bitrates))
+            with open(os.path.join(output_dir, 'master.m3u8')) as master:
+                lines = master.read().splitlines()
+
+        self.assertEqual(lines[2], '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="default",'
+                                   'DEFAULT=YES,AUTOSELECT=YES,URI="audio-test.m3u8"')
+        self.assertEqual(lines[3], '#EXT-X-STREAM-INF:BANDWIDTH=440000,AVERAGE-BANDWIDTH=380000,'
+                                   'CODECS="avc1.42C01E,mp4a.40.2",RESOLUTION=256x144,AUDIO="audio"')
+        self.assertEqual(lines[5:], ['#EXT-X-STREAM-INF:BANDWIDTH=140000,AVERAGE-BANDWIDTH=130000,'
+                                     'CODECS="mp4a.40.2",AUDIO="audio"', 'audio-test.m3u8'])
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_audio_encoded_once(self):
+        """Тест: звук - отдельный рендишен, видеорендишены без звуковой дорожки"""
+        self.processor.transcode_config = self.processor.transcode_config.model_copy(update={'segment_format': 'fmp4'})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'source.mp4')
+            make_test_video(input_file)
+            output_dir = os.path.join(temp_dir, 'hls')
+            os.makedirs(output_dir)
+
+            asyncio.run(self.processor.encode_audio_rendition(input_file, 'test', output_dir))
+            asyncio.run(self.processor.convert_to_hls(input_file, 'test', '256:144', output_dir))
+
+            def streams(name: str) -> str:
+                return subprocess.run(['ffmpeg', '-hide_banner', '-i', os.path.join(output_dir, name)],
+                                      capture_output=True, text=True).stderr
+
+            self.assertNotIn('Video:', streams('audio-test.mp4'))
+            self.assertIn('Audio: aac', streams('audio-test.mp4'))
+            self.assertNotIn('Audio:', streams('144p-test.mp4'))
+
+
+class TestRemux(unittest.TestCase):
+    """Тесты нарезки совпадающей ступени без перекодирования"""
+
+    def setUp(self):
+        """Настройка перед каждым тестом"""
+        self.processor = make_processor()
+        self.processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={'remux_enabled': True})
+        self.resolutions = self.processor.select_resolutions(1920, 1080)
+
+    def select(self, **changes) -> str | None:
+        return self.processor.select_remux_resolution(PHONE_MEDIA_INFO.model_copy(update=changes), self.resolutions)
+
+    def test_matching_h264_source_is_remuxed(self):
+        """Тест: H.264/AAC 1080p с частыми ключевыми кадрами дает ступень 1080p"""
+        self.assertEqual(self.select(), "1920:1080")
+
+    def test_unsuitable_sources_are_encoded(self):
+        """Тест: поворот, HEVC, 10 бит, не-ступень или редкие ключевые кадры отключают remux"""
+        for changes in ({"rotation": -90}, {"video_codec": "hevc"}, {"pix_fmt": "yuv420p10le"},
+                        {"width": 1916}, {"audio_profile": "HE-AAC"}, {"keyframe_interval": 11.0},
+                        {"keyframe_interval": None}):
+            with self.subTest(changes=changes):
+                self.assertIsNone(self.select(**changes))
+
+    def test_remuxed_rendition_codecs(self):
+        """Тест: CODECS ступени без перекодирования описывает исходный поток"""
+        self.assertEqual(self.processor._codecs(True, h264_codec("High", 40)), "avc1.640028,mp4a.40.2")
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_remux_segments_match_encoded_rungs(self):
+        """Тест: границы сегментов remux-ступени и перекодированных ступеней совпадают"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'source.mp4')
+            subprocess.run([
+                'ffmpeg', '-loglevel', 'error', '-y',
+                '-f', 'lavfi', '-i', 'testsrc=size=426x240:rate=25:duration=12',
+                '-f', 'lavfi', '-i', 'sine=duration=12',
+                '-pix_fmt', 'yuv420p', '-c:v', 'libx264', '-g', '40', '-c:a', 'aac', '-shortest',
+                input_file
+            ], check=True)
+
+            asyncio.run(self.processor.encode_renditions(input_file, 'test', ["256:144", "426:240"], temp_dir,
+                                                         remux_res="426:240"))
+
+            def durations(name: str) -> list[str]:
+                with open(os.path.join(temp_dir, name)) as playlist:
+                    return [line for line in playlist.read().splitlines() if line.startswith('#EXTINF:')]
+
+            self.assertEqual(durations('144p-test.m3u8'), durations('240p-test.m3u8'))
+            self.assertEqual(len(durations('240p-test.m3u8')), 3)
+
+
+class TestRenditionScheduler(unittest.TestCase):
+    """Тесты планировщика параллельного кодирования"""
+
+    def test_allocate_threads_proportional_to_pixels(self):
+        """Тест: большему разрешению достается больше потоков"""
+        allocation = RenditionScheduler(8).allocate_threads(["1920:1080", "1280:720", "256:144"])
+        self.assertEqual(allocation, {"1920:1080": 5, "1280:720": 2, "256:144": 1})
+
+    def test_run_respects_budget_and_order(self):
+        """Тест: бюджет ядер не превышается, крупные рендишены стартуют первыми"""
+        scheduler = RenditionScheduler(4)
+        started = []
+        busy = {"cores": 0, "peak": 0}
+
+        async def encode(resolution: str, threads: int):
+            started.append(resolution)
+            busy["cores"] += threads
+            busy["peak"] = max(busy["peak"], busy["cores"])
+            await asyncio.sleep(0.01)
+            busy["cores"] -= threads
+
+        asyncio.run(scheduler.run(["256:144", "1920:1080", "854:480", "1280:720"], encode))
+
+        self.assertEqual(started[0], "1920:1080")
+        self.assertCountEqual(started, ["256:144", "1920:1080", "854:480", "1280:720"])
+        self.assertLessEqual(busy["peak"], 4)
+
+    def test_run_propagates_errors(self):
+        """Тест: ошибка одного рендишена пробрасывается наружу"""
+        async def encode(resolution: str, threads: int):
+            if resolution == "256:144":
+                raise RuntimeError("encode failed")
+            await asyncio.sleep(0.01)
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(RenditionScheduler(2).run(["256:144", "1280:720"], encode))
+
+
+class TestAdmissionController(unittest.TestCase):
+    """Тесты контроля допуска задач"""
+
+    def setUp(self):
+        """Настройка перед каждым тестом"""
+        self.job_config = SimpleNamespace(max_concurrent_jobs=2, disk_factor=3.0, min_free_memory_mb=0,
+                                          max_cpu_load=1000.0, admission_poll_interval=0.01)
+
+    def test_first_job_admitted_without_checks(self):
+        """Тест: при отсутствии задач видео допускается даже без места на диске"""
+        admission = AdmissionController(self.job_config)
+
+        async def run():
+            async with admission.admit(required_disk=10 ** 18):
+                return True
+
+        self.assertTrue(asyncio.run(run()))
+
+    def test_second_job_waits_for_disk(self):
+        """Тест: вторая задача ждет, пока первая не освободит зарезервированное место"""
+        admission = AdmissionController(self.job_config)
+        events = []
+
+        async def job(name: str, required_disk: int):
+            async with admission.admit(required_disk):
+                events.append(f"{name} started")
+                await asyncio.sleep(0.05)
+                events.append(f"{name} finished")
+
+        async def run():
+            await asyncio.gather(job("big", 10 ** 18), job("small", 1))
+
+        asyncio.run(run())
+        self.assertEqual(events, ["big started", "big finished", "small started", "small finished"])
+
+    def test_busy_worker_leaves_jobs_in_queue(self):
+        """Тест: при занятых слотах потребитель не забирает сообщения, следующее берется после освобождения"""
+        processor = make_processor()
+        processor.job_config = JOB_SETTINGS.model_copy(update={'max_concurrent_jobs': 1,
+                                                               'scheduler_poll_interval': 0.01})
+        processor.admission = AdmissionController(processor.job_config)
+        channel = FakeChannel({'convert_video_to_hls': [make_message(b'first'), make_message(b'second')]})
+        release = asyncio.Event()
+        started = []
+
+        async def process_message(message):
+            started.append(message.body.decode())
+            await release.wait()
+
+        async def run():
+            queue = await channel.declare_queue('convert_video_to_hls')
+            consumer = asyncio.create_task(processor.consume_jobs(queue))
+            await asyncio.sleep(0.05)
+            waiting = [message.body.decode() for message in channel.queued['convert_video_to_hls']]
+            release.set()
+            await asyncio.sleep(0.05)
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+            return waiting
+
+        with patch.object(processor, 'process_message', process_message):
+            waiting = asyncio.run(run())
+
+        self.assertEqual(waiting, ['second'])
+        self.assertEqual(started, ['first', 'second'])
+
+    def test_job_without_disk_requeued_before_lease(self):
+        """Тест: задача, которой не хватает места, возвращается в очередь, не беря аренду"""
+        processor = make_processor()
+        processor.s3_service = FakeS3Service()
+        processor.s3_service.objects['raw/source.mp4'] = b'source'
+        processor.job_config = JOB_SETTINGS.model_copy(update={'admission_poll_interval': 0})
+        processor.admission = AdmissionController(processor.job_config)
+        message = make_message(json.dumps({'video_path': 'raw/source.mp4', 'uuid': 'test'}).encode())
+
+        async def run():
+            async with processor.admission.reserve_disk(10 ** 18):
+                await processor.process_message(message)
+
+        with patch.object(JobLease, 'acquire', AsyncMock()) as acquire, \
+                patch.object(processor, 'process_video', AsyncMock()) as process_video:
+            asyncio.run(run())
+
+        message.nack.assert_awaited_once_with(requeue=True)
+        acquire.assert_not_called()
+        process_video.assert_not_called()
+
+
+class FakeS3Service:
+    """Заглушка S3Service, запоминающая порядок выгрузки"""
+
+    def __init__(self):
+        self.uploaded = []
+        self.objects = {}
+
+    async def upload_file(self, local_path: str, s3_path: str):
+        self.uploaded.append(s3_path)
+
+    async def upload_files(self, files: list):
+        for local_path, s3_path in files:
+            await self.upload_file(local_path, s3_path)
+
+    async def upload_bytes(self, data: bytes, s3_path: str):
+        self.uploaded.append(s3_path)
+        self.objects[s3_path] = data
+
+    async def get_bytes(self, s3_path: str) -> bytes | None:
+        return self.objects.get(s3_path)
+
+    async def get_file_size(self, s3_path: str) -> int:
+        return len(self.objects.get(s3_path, b''))
+
+    async def delete_file(self, s3_path: str):
+        self.objects.pop(s3_path, None)
+
+    async def delete_files(self, s3_paths: list):
+        for s3_path in s3_paths:
+            await self.delete_file(s3_path)
+
+
+class FakeChannel:
+    """Заглушка канала RabbitMQ: запоминает публикации, очереди отдают заранее заданные сообщения"""
+
+    def __init__(self, queued: dict | None = None):
+        self.published = []
+        self.declared = {}
+        self.queued = queued or {}
+        self.default_exchange = SimpleNamespace(publish=self._publish)
+
+    async def _publish(self, message, routing_key: str):
+        self.published.append((routing_key, message))
+
+    async def declare_queue(self, name: str, durable: bool = False, arguments: dict | None = None):
+        self.declared[name] = arguments
+        messages = self.queued.setdefault(name, [])
+
+        async def get(fail: bool = True):
+            return messages.pop(0) if messages else None
+
+        return SimpleNamespace(get=get, declaration_result=SimpleNamespace(message_count=len(messages)))
+
+
+def make_message(body: bytes, headers: dict | None = None) -> SimpleNamespace:
+    """Входящее сообщение RabbitMQ для тестов"""
+    return SimpleNamespace(body=body, headers=headers or {}, content_type='application/json', message_id=None,
+                           timestamp=None, ack=AsyncMock(), nack=AsyncMock())
+
+
+class TestHLSUploader(unittest.TestCase):
+    """Тесты потоковой выгрузки HLS"""
+
+    def test_segments_uploaded_before_playlist_and_removed(self):
+        """Тест: сегменты выгружаются раньше плейлиста и удаляются с диска, мастер последним"""
+        s3_service = FakeS3Service()
+        with tempfile.TemporaryDirectory() as output_dir:
+            for name in ('144p-test0.ts', '144p-test1.ts', '144p-test2.ts.tmp'):
+                open(os.path.join(output_dir, name), 'wb').close()
+            with open(os.path.join(output_dir, '144p-test.m3u8'), 'w') as playlist:
+                playlist.write("#EXTM3U\n#EXTINF:5.0,\n144p-test0.ts\n#EXTINF:5.0,\n144p-test1.ts\n")
+
+            async def run():
+                async with HLSUploader(s3_service, output_dir, 'video_files/test', poll_interval=0.01) as uploader:
+                    await asyncio.sleep(0.05)
+                with open(os.path.join(output_dir, 'master.m3u8'), 'w') as master:
+                    master.write("#EXTM3U\n")
+                await uploader.publish_master()
+
+            uploads_before = JOB_UPLOAD_SECONDS._sum.get()
+            asyncio.run(run())
+
+            self.assertEqual(s3_service.uploaded, [
+                'video_files/test/144p-test0.ts',
+                'video_files/test/144p-test1.ts',
+                'video_files/test/144p-test.m3u8',
+                'video_files/test/master.m3u8',
+            ])
+            self.assertGreater(JOB_UPLOAD_SECONDS._sum.get(), uploads_before)
+            self.assertEqual(sorted(os.listdir(output_dir)), ['144p-test.m3u8', '144p-test2.ts.tmp', 'master.m3u8'])
+
+    def test_init_file_uploaded_before_playlist(self):
+        """Тест: init-файл из #EXT-X-MAP выгружается вместе с сегментами раньше плейлиста и один раз"""
+        s3_service = FakeS3Service()
+        with tempfile.TemporaryDirectory() as output_dir:
+            for name in ('144p-init.mp4', '144p-test0.m4s', '144p-test1.m4s'):
+                open(os.path.join(output_dir, name), 'wb').close()
+            header = '#EXTM3U\n#EXT-X-MAP:URI="144p-init.mp4"\n'
+            with open(os.path.join(output_dir, '144p-test.m3u8'), 'w') as playlist:
+                playlist.write(header + '#EXTINF:5.0,\n144p-test0.m4s\n')
+
+            uploader = HLSUploader(s3_service, output_dir, 'video_files/test')
+            asyncio.run(uploader.sync())
+            with open(os.path.join(output_dir, '144p-test.m3u8'), 'a') as playlist:
+                playlist.write('#EXTINF:5.0,\n144p-test1.m4s\n')
+            asyncio.run(uploader.sync())
+
+        self.assertEqual(s3_service.uploaded, [
+            'video_files/test/144p-init.mp4',
+            'video_files/test/144p-test0.m4s',
+            'video_files/test/144p-test.m3u8',
+            'video_files/test/144p-test1.m4s',
+            'video_files/test/144p-test.m3u8',
+        ])
+        self.assertEqual(uploader.segment_count, 2)
+
+    def test_bitrates_measured_from_uploaded_segments(self):
+        """Тест: пиковый битрейт - по самому плотному сегменту, средний - по всем"""
+        with tempfile.TemporaryDirectory() as output_dir:
+            for name, size in (('144p-test0.ts', 5000), ('144p-test1.ts', 1000)):
+                with open(os.path.join(output_dir, name), 'wb') as segment:
+                    segment.write(bytes(size))
+            with open(os.path.join(output_dir, '144p-test.m3u8'), 'w') as playlist:
+                playlist.write("#EXTM3U\n#EXTINF:5.0,\n144p-test0.ts\n#EXTINF:0.5,\n144p-test1.ts\n")
+
+            uploader = HLSUploader(FakeS3Service(), output_dir, 'video_files/test')
+            self.assertIsNone(uploader.bitrates('144p-test.m3u8'))
+            asyncio.run(uploader.sync())
+
+            self.assertEqual(uploader.bitrates('144p-test.m3u8'), (16000, 8727))
+
+    def test_single_file_rendition_uploaded_when_finished(self):
+        """Тест: fMP4-рендишен выгружается одним объектом после #EXT-X-ENDLIST, размеры - по диапазонам байт"""
+        s3_service = FakeS3Service()
+        playlist_content = (
+            '#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-MAP:URI="144p-test.mp4",BYTERANGE="800@0"\n'
+            '#EXTINF:5.0,\n#EXT-X-BYTERANGE:5000@800\n144p-test.mp4\n'
+            '#EXTINF:0.5,\n#EXT-X-BYTERANGE:1000@5800\n144p-test.mp4\n'
+        )
+        with tempfile.TemporaryDirectory() as output_dir:
+            with open(os.path.join(output_dir, '144p-test.mp4'), 'wb') as rendition:
+                rendition.write(bytes(6800))
+            with open(os.path.join(output_dir, '144p-test.m3u8'), 'w') as playlist:
+                playlist.write(playlist_content)
+
+            uploader = HLSUploader(s3_service, output_dir, 'video_files/test')
+            asyncio.run(uploader.sync())
+            self.assertEqual(s3_service.uploaded, [])
+
+            with open(os.path.join(output_dir, '144p-test.m3u8'), 'a') as playlist:
+                playlist.write('#EXT-X-ENDLIST\n')
+            asyncio.run(uploader.sync())
+
+            self.assertEqual(s3_service.uploaded, ['video_files/test/144p-test.mp4', 'video_files/test/144p-test.m3u8'])
+            self.assertEqual(os.listdir(output_dir), ['144p-test.m3u8'])
+        self.assertEqual((uploader.segment_count, uploader.uploaded_bytes), (2, 6000))
+        self.assertEqual(uploader.bitrates('144p-test.m3u8'), (16000, 8727))
+
+
+class TestProgressivePublishing(unittest.TestCase):
+    """Тесты прогрессивной публикации"""
+
+    def test_playable_sent_after_lowest_rendition_published(self):
+        """Тест: "playable" уходит после публикации мастера только с 144p, "complete" — в конце"""
+        processor = make_processor()
+        processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={'progressive_publishing': True})
+        processor.s3_service = FakeS3Service()
+        events = []
+
+        async def send_confirmation(video_uuid, status, media_info=None):
+            with open(master_path[0]) as master:
+                events.append((status, master.read().count('#EXT-X-STREAM-INF')))
+
+        master_path = []
+        original_create_master = processor.create_master_playlist
+
+        async def create_master_playlist(video_uuid, resolutions, output_dir, *args):
+            master_path[:] = [os.path.join(output_dir, 'master.m3u8')]
+            await original_create_master(video_uuid, resolutions, output_dir, *args)
+
+        with patch.object(processor, 'prepare_input', AsyncMock(return_value='source.mp4')), \
+                patch.object(processor, 'get_media_info', AsyncMock(return_value=MediaInfo(
+                    width=640, height=360, duration=10.0, frame_rate=25.0, has_audio=True
+                ))), \
+                patch.object(processor, 'convert_to_hls', make_fake_convert_to_hls(processor, [])), \
+                patch.object(processor, 'create_master_playlist', create_master_playlist), \
+                patch.object(processor, 'send_confirmation', send_confirmation):
+            self.assertTrue(asyncio.run(processor.process_video({'video_path': 'raw/source.mp4', 'uuid': 'test'})))
+
+        self.assertEqual(events, [("playable", 1), ("complete", 3)])
+        self.assertEqual(processor.s3_service.uploaded[:3], [
+            'video_files/test/144p-test0.ts',
+            'video_files/test/144p-test.m3u8',
+            'video_files/test/master.m3u8',
+        ])
+
+    def test_remuxed_first_rendition_published_with_source_codecs(self):
+        """Тест: совпадающая с исходником первая ступень нарезается без кодирования, частичный мастер - с CODECS исходника"""
+        processor = make_processor()
+        processor.transcode_config = TRANSCODE_SETTINGS.model_copy(
+            update={'progressive_publishing': True, 'remux_enabled': True}
+        )
+        processor.s3_service = FakeS3Service()
+        media_info = PHONE_MEDIA_INFO.model_copy(update={'width': 256, 'height': 144, 'video_profile': 'Main',
+                                                         'video_level': 30})
+        remuxed, masters, master_path = [], [], []
+        convert_to_hls = make_fake_convert_to_hls(processor, [])
+        original_create_master = processor.create_master_playlist
+
+        async def remux_to_hls(input_file, video_uuid, resolution, output_dir):
+            remuxed.append(resolution)
+            await convert_to_hls(input_file, video_uuid, resolution, output_dir)
+
+        async def create_master_playlist(video_uuid, resolutions, output_dir, *args):
+            master_path[:] = [os.path.join(output_dir, 'master.m3u8')]
+            await original_create_master(video_uuid, resolutions, output_dir, *args)
+
+        async def send_confirmation(video_uuid, status, media_info=None):
+            with open(master_path[0]) as master:
+                masters.append((status, master.read()))
+
+        with patch.object(processor, 'prepare_input', AsyncMock(return_value='source.mp4')), \
+                patch.object(processor, 'get_media_info', AsyncMock(return_value=media_info)), \
+                patch.object(processor, 'select_resolutions', return_value=["256:144", "426:240"]), \
+                patch.object(processor, 'convert_to_hls', convert_to_hls), \
+                patch.object(processor, 'remux_to_hls', remux_to_hls), \
+                patch.object(processor, 'create_master_playlist', create_master_playlist), \
+                patch.object(processor, 'send_confirmation', send_confirmation):
+            self.assertTrue(asyncio.run(processor.process_video({'video_path': 'raw/source.mp4', 'uuid': 'test'})))
+
+        self.assertEqual(remuxed, ["256:144"])
+        status, master = masters[0]
+        self.assertEqual(status, "playable")
+        self.assertIn(f'CODECS="{processor._codecs(True, h264_codec("Main", 30))}"', master)
+
+
+    def test_distributed_master_published_per_rendition_only_when_progressive(self):
+        """Тест: при распределенном кодировании частичный мастер и "playable" - только с progressive_publishing"""
+        for progressive in (False, True):
+            with self.subTest(progressive=progressive):
+                processor = make_processor()
+                processor.transcode_config = TRANSCODE_SETTINGS.model_copy(
+                    update={'progressive_publishing': progressive}
+                )
+                processor.s3_service = FakeS3Service()
+                confirmation = AsyncMock()
+                convert_to_hls = make_fake_convert_to_hls(processor, [])
+
+                async def transcode(input_file, video_uuid, resolutions, output_dir, video_path, media_info,
+                                    on_rendition_done=None):
+                    for resolution in resolutions:
+                        await convert_to_hls(input_file, video_uuid, resolution, output_dir)
+                        await on_rendition_done(resolution)
+
+                with patch.object(processor, 'prepare_input', AsyncMock(return_value='source.mp4')), \
+                        patch.object(processor, 'get_media_info', AsyncMock(return_value=MediaInfo(
+                            width=640, height=360, duration=10.0, has_audio=False
+                        ))), \
+                        patch.object(processor.chunked_transcoder, 'should_distribute', return_value=True), \
+                        patch.object(processor.chunked_transcoder, 'transcode', transcode), \
+                        patch.object(processor, 'send_confirmation', confirmation):
+                    self.assertTrue(asyncio.run(processor.process_video({'video_path': 'raw/source.mp4',
+                                                                         'uuid': 'test'})))
+
+                statuses = [call.args[1] for call in confirmation.await_args_list]
+                masters = processor.s3_service.uploaded.count('video_files/test/master.m3u8')
+                if progressive:
+                    self.assertEqual(statuses, ['playable', 'complete'])
+                    self.assertGreater(masters, 1)
+                else:
+                    self.assertEqual(statuses, ['complete'])
+                    self.assertEqual(masters, 1)
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Тесты контрольных точек и аренды задач"""
+
+    def test_resume_skips_uploaded_renditions(self):
+        """Тест: повторная попытка кодирует только недостающие ступени, битрейт прошлых берется из манифеста"""
+        processor = make_processor()
+        processor.s3_service = FakeS3Service()
+        checkpoint = JobCheckpoint(processor.s3_service, 'test')
+        asyncio.run(checkpoint.record_rendition('256:144', (300000, 250000), None))
+        encoded = []
+        master = []
+
+        async def convert_to_hls(input_file, video_uuid, resolution, output_dir, threads=None, align_keyframes=False):
+            encoded.append(resolution)
+            with open(os.path.join(output_dir, f"{processor._rendition_name(resolution, video_uuid)}.m3u8"), 'w'):
+                pass
+
+        async def publish_master(self):
+            with open(os.path.join(self.output_dir, self.MASTER_PLAYLIST)) as master_file:
+                master.append(master_file.read())
+
+        with patch.object(processor, 'prepare_input', AsyncMock(return_value='source.mp4')), \
+                patch.object(processor, 'get_media_info', AsyncMock(return_value=MediaInfo(
+                    width=640, height=360, duration=10.0, has_audio=True
+                ))), \
+                patch.object(processor, 'convert_to_hls', convert_to_hls), \
+                patch.object(processor, 'send_confirmation', AsyncMock()), \
+                patch.object(HLSUploader, 'publish_master', publish_master):
+            self.assertTrue(asyncio.run(processor.process_video({'video_path': 'raw/source.mp4', 'uuid': 'test'},
+                                                                checkpoint)))
+
+        self.assertEqual(sorted(encoded), ['426:240', '640:360'])
+        self.assertIn('BANDWIDTH=300000,AVERAGE-BANDWIDTH=250000', master[-1])
+        manifest = asyncio.run(JobCheckpoint.load(processor.s3_service, 'test')).manifest
+        self.assertEqual(set(manifest.renditions), {'256:144', '426:240', '640:360'})
+        self.assertTrue(manifest.completed)
+
+    def test_completed_job_acked_without_processing(self):
+        """Тест: повторная доставка завершенной задачи подтверждается без обработки"""
+        processor = make_processor()
+        processor.s3_service = FakeS3Service()
+        asyncio.run(JobCheckpoint(processor.s3_service, 'test').complete())
+        message = make_message(json.dumps({'video_path': 'raw/source.mp4', 'uuid': 'test'}).encode())
+
+        with patch.object(processor, 'process_video', AsyncMock()) as process_video, \
+                patch.object(JobLease, 'SETTLE_DELAY', 0):
+            asyncio.run(processor.process_message(message))
+
+        process_video.assert_not_called()
+        message.ack.assert_awaited_once()
+        self.assertNotIn(JobLease.lease_key('test'), processor.s3_service.objects)
+
+    def test_lease_waits_for_owner_and_detects_takeover(self):
+        """Тест: вторая аренда ждет освобождения первой, перехват аренды прерывает задачу"""
+        s3_service = FakeS3Service()
+        events = []
+
+        async def hold(name: str, seconds: float):
+            async with JobLease(s3_service, 'test', ttl=1.0):
+                events.append(f"{name} acquired")
+                await asyncio.sleep(seconds)
+            events.append(f"{name} released")
+
+        async def take_over():
+            async with JobLease(s3_service, 'test', ttl=0.3):
+                await asyncio.sleep(0.05)
+                await JobLease(s3_service, 'test', ttl=10.0)._write()
+                await asyncio.sleep(1.0)
+
+        async def run():
+            await asyncio.gather(hold('first', 0.2), hold('second', 0))
+            with self.assertRaises(LeaseLostError):
+                await take_over()
+
+        with patch.object(JobLease, 'SETTLE_DELAY', 0.01):
+            asyncio.run(run())
+
+        self.assertEqual(events, ['first acquired', 'first released', 'second acquired', 'second released'])
+
+
+class TestRenditionDemand(unittest.TestCase):
+    """Тесты постановки отложенных ступеней по запросу плейлиста"""
+
+    def test_submit_returns_before_queueing(self):
+        """Тест: submit отвечает сразу, задача ставится в фоне один раз, низкие ступени не проверяются"""
+        s3_service = FakeS3Service()
+        channel = SimpleNamespace(default_exchange=SimpleNamespace(publish=AsyncMock()))
+        config = TRANSCODE_SETTINGS.model_copy(update={'jit_enabled': True, 'jit_min_height': 1440})
+        demand = RenditionDemand(s3_service, channel, config, lease_ttl=1.0)
+        asyncio.run(DeferredRenditions(video_path='raw/test.mp4', renditions=['2560:1440'], fallback='1920:1080',
+                                       master=['1920:1080', '2560:1440']).save(s3_service, 'test'))
+
+        async def run():
+            statuses = [demand.submit('test', name) for name in ('1440p-test.m3u8', '1440p-test.m3u8',
+                                                                 '1080p-test.m3u8')]
+            published_on_return = channel.default_exchange.publish.await_count
+            await asyncio.gather(*demand._tasks.values())
+            return statuses, published_on_return
+
+        with patch.object(JobLease, 'SETTLE_DELAY', 0):
+            statuses, published_on_return = asyncio.run(run())
+
+        self.assertEqual(statuses, ['accepted', 'accepted', 'ready'])
+        self.assertEqual(published_on_return, 0)
+        self.assertEqual(channel.default_exchange.publish.await_count, 1)
+
+
+class TestRetry(unittest.TestCase):
+    """Тесты повторных попыток и dead-letter очереди"""
+
+    def setUp(self):
+        self.channel = FakeChannel()
+        self.retry = RetryTopology('convert_video_to_hls', RETRY_SETTINGS.model_copy(update={
+            'max_attempts': 3, 'base_delay': 30.0, 'max_delay': 45.0
+        }))
+        asyncio.run(self.retry.declare(self.channel))
+
+    def test_retry_queues_with_exponential_backoff(self):
+        """Тест: очереди задержки по попыткам с TTL и возвратом в основную очередь"""
+        self.assertEqual(self.channel.declared, {
+            'convert_video_to_hls.retry.30s': {'x-message-ttl': 30000, 'x-dead-letter-exchange': '',
+                                               'x-dead-letter-routing-key': 'convert_video_to_hls'},
+            'convert_video_to_hls.retry.45s': {'x-message-ttl': 45000, 'x-dead-letter-exchange': '',
+                                               'x-dead-letter-routing-key': 'convert_video_to_hls'},
+            'convert_video_to_hls.dead': None,
+        })
+
+    def test_attempts_counted_then_dead_lettered(self):
+        """Тест: попытки считаются в заголовке, после последней сообщение уходит в dead-letter с причиной"""
+        message = make_message(b'{}')
+        for _ in range(3):
+            asyncio.run(self.retry.retry(message, 'MinIO is unavailable'))
+            routing_key, published = self.channel.published[-1]
+            message = make_message(published.body, published.headers)
+
+        self.assertEqual([routing_key for routing_key, _ in self.channel.published], [
+            'convert_video_to_hls.retry.30s', 'convert_video_to_hls.retry.45s', 'convert_video_to_hls.dead'
+        ])
+        self.assertEqual(message.headers['x-attempt'], 3)
+        self.assertEqual(message.headers['x-failure-reason'], 'MinIO is unavailable')
+
+    def test_invalid_message_dead_lettered(self):
+        """Тест: сообщение с невалидным JSON сразу уходит в dead-letter"""
+        processor = make_processor()
+        processor.retry = self.retry
+        message = make_message(b'not json')
+
+        asyncio.run(processor.process_message(message))
+
+        message.ack.assert_awaited_once()
+        [(routing_key, published)] = self.channel.published
+        self.assertEqual(routing_key, 'convert_video_to_hls.dead')
+        self.assertTrue(published.headers['x-failure-reason'].startswith('Invalid JSON'))
+
+    def test_replay_endpoint(self):
+        """Тест: replay возвращает задачи в основную очередь со сброшенным счетчиком попыток"""
+        dead_messages = [
+            make_message(b'{"uuid": "%d"}' % index, {'x-attempt': 3, 'x-failure-reason': 'error'})
+            for index in range(3)
+        ]
+        self.channel.queued['convert_video_to_hls.dead'] = list(dead_messages)
+        app.state.job_retry = self.retry
+        client = TestClient(app, headers={'X-Admin-Token': 'secret'})
+
+        with patch.object(ADMIN_SETTINGS, 'token', 'secret'):
+            self.assertEqual(client.post('/admin/dead-letters/replay', headers={'X-Admin-Token': 'wrong'}).status_code,
+                             403)
+            self.assertEqual(client.get('/admin/dead-letters').json()['count'], 3)
+            self.assertEqual(client.post('/admin/dead-letters/replay?limit=2').json(), {'replayed': 2})
+            self.assertEqual(client.post('/admin/dead-letters/replay').json(), {'replayed': 1})
+        self.assertEqual(client.post('/admin/dead-letters/replay').status_code, 403)
+
+        self.assertEqual([routing_key for routing_key, _ in self.channel.published], ['convert_video_to_hls'] * 3)
+        self.assertEqual([message.headers for _, message in self.channel.published], [{}] * 3)
+        for message in dead_messages:
+            message.ack.assert_awaited_once()
+
+
+class TestJobScheduler(unittest.TestCase):
+    """Тесты планирования задач по стоимости"""
+
+    def make_scheduler(self, handler, **settings) -> JobScheduler:
+        job_config = JOB_SETTINGS.model_copy(update={'short_weight': 3, 'long_weight': 1,
+                                                     'scheduler_poll_interval': 0.01, **settings})
+        return JobScheduler('convert_video_to_hls', job_config, handler)
+
+    def test_job_cost_estimated_from_header(self):
+        """Тест: стоимость - длительность * пиксели лестницы в секундах 1080p, без оценки задача длинная"""
+        processor = make_processor()
+        processor.s3_service = SimpleNamespace(generate_presigned_url=AsyncMock(return_value='http://minio/source'))
+        ffprobe_output = json.dumps({
+            'format': {'duration': '100.0'},
+            'streams': [{'index': 0, 'codec_type': 'video', 'width': 1280, 'height': 720}]
+        })
+
+        with patch.object(processor, '_run_ffprobe', AsyncMock(return_value=ffprobe_output)):
+            cost = asyncio.run(processor.estimate_job_cost('raw/source.mp4'))
+        with patch.object(processor, '_run_ffprobe', AsyncMock(side_effect=Exception('ffprobe failed'))):
+            self.assertIsNone(asyncio.run(processor.estimate_job_cost('raw/source.mp4')))
+
+        ladder_pixels = 256 * 144 + 426 * 240 + 640 * 360 + 854 * 480 + 1280 * 720
+        self.assertAlmostEqual(cost, 100 * ladder_pixels / (1920 * 1080))
+        scheduler = processor.job_scheduler
+        self.assertEqual(scheduler.queue_for(cost), 'convert_video_to_hls.short')
+        self.assertEqual(scheduler.queue_for(10 * 3600), 'convert_video_to_hls.long')
+        self.assertEqual(scheduler.queue_for(None), 'convert_video_to_hls.long')
+
+    def test_weighted_pick_without_starvation(self):
+        """Тест: при весах 3:1 длинные задачи берутся каждой четвертой, при пустой short - подряд"""
+        picked = []
+
+        async def handler(message):
+            picked.append(message.body.decode())
+            return asyncio.create_task(asyncio.sleep(0))
+
+        channel = FakeChannel({
+            'convert_video_to_hls.short': [make_message(b'short') for _ in range(6)],
+            'convert_video_to_hls.long': [make_message(b'long') for _ in range(4)],
+        })
+        scheduler = self.make_scheduler(handler)
+
+        async def run():
+            await scheduler.start(channel)
+            while len(picked) < 10:
+                await asyncio.sleep(0.01)
+            await scheduler.stop()
+
+        asyncio.run(run())
+
+        self.assertEqual(picked, ['short', 'short', 'long', 'short'] * 2 + ['long', 'long'])
+
+    def test_long_jobs_limited(self):
+        """Тест: при занятых long_max_jobs слоты отдаются только коротким задачам"""
+        picked = []
+        release = asyncio.Event()
+
+        async def handler(message):
+            picked.append(message.body.decode())
+            return asyncio.create_task(release.wait())
+
+        channel = FakeChannel({'convert_video_to_hls.long': [make_message(b'long') for _ in range(3)]})
+        scheduler = self.make_scheduler(handler, max_concurrent_jobs=3, long_max_jobs=1)
+
+        async def run():
+            await scheduler.start(channel)
+            await asyncio.sleep(0.05)
+            channel.queued['convert_video_to_hls.short'].append(make_message(b'short'))
+            await asyncio.sleep(0.05)
+            release.set()
+            await scheduler.stop()
+
+        asyncio.run(run())
+
+        self.assertEqual(picked, ['long', 'short'])
+
+
+class LocalDirS3Service:
+    """Заглушка S3Service, хранящая объекты в локальном каталоге"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, s3_path: str) -> str:
+        path = os.path.join(self.root, s3_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    async def generate_presigned_url(self, s3_path: str, expires_in: int) -> str:
+        return self._path(s3_path)
+
+    async def upload_files(self, files: list):
+        for local_path, s3_path in files:
+            shutil.copy(local_path, self._path(s3_path))
+
+    async def download_file(self, s3_path: str, local_path: str):
+        shutil.copy(self._path(s3_path), local_path)
+
+
+class TestChunkedTranscoding(unittest.TestCase):
+    """Тесты распределенного кодирования по кускам"""
+
+    def test_plan_chunks_starts_on_keyframes(self):
+        """Тест: куски начинаются с ключевых кадров не чаще chunk_duration"""
+        self.assertEqual(
+            plan_chunks([0.0, 2.0, 4.1, 6.0, 8.3, 9.9], duration=11.0, chunk_duration=4.0),
+            [(0.0, 4.1), (4.1, 8.3), (8.3, 11.0)]
+        )
+
+    def test_forced_keyframes_on_absolute_segment_marks(self):
+        """Тест: ключевые кадры куска стоят на абсолютных границах сегментов"""
+        self.assertEqual(forced_keyframe_times(4.1, 12.0, 5), [0.0, 0.9, 5.9])
+
+    def test_chunks_deleted_when_dispatch_fails(self):
+        """Тест: при ошибке кодирования кусков уже выгруженные куски всех разрешений удаляются"""
+        processor = make_processor()
+        processor.s3_service = FakeS3Service()
+        transcoder = ChunkedTranscoder(processor, DISTRIBUTED_SETTINGS.model_copy(update={'chunk_duration': 4.0}),
+                                       HLS_SEGMENT_TIME)
+        resolutions = ["256:144", "426:240"]
+        for key in (transcoder.chunk_key("test", 0, "256:144"), transcoder.chunk_key("test", 1, "426:240")):
+            processor.s3_service.objects[key] = b'chunk'
+
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                patch.object(processor, 'probe_keyframes', AsyncMock(return_value=[0.0, 5.0])), \
+                patch.object(transcoder, 'dispatch_chunks', AsyncMock(side_effect=Exception("worker failed"))):
+            with self.assertRaises(Exception):
+                asyncio.run(transcoder.transcode('source.mp4', 'test', resolutions, os.path.join(temp_dir, 'hls'),
+                                                 'raw/source.mp4', MediaInfo(width=640, height=360, duration=10.0)))
+
+        self.assertEqual(processor.s3_service.objects, {})
+
+    def test_malformed_chunk_message_rejected(self):
+        """Тест: задача куска с невалидным телом отклоняется без возврата в очередь"""
+        transcoder = ChunkedTranscoder(make_processor(), DISTRIBUTED_SETTINGS, HLS_SEGMENT_TIME)
+        message = make_message(b'not json')
+        message.reject = AsyncMock()
+
+        asyncio.run(transcoder.on_chunk_message(message))
+
+        message.reject.assert_awaited_once_with(requeue=False)
+        message.ack.assert_not_awaited()
+
+    def test_late_chunk_result_deleted(self):
+        """Тест: куски из ответа, пришедшего после завершения задачи, удаляются из MinIO"""
+        processor = make_processor()
+        processor.s3_service = FakeS3Service()
+        transcoder = ChunkedTranscoder(processor, DISTRIBUTED_SETTINGS, HLS_SEGMENT_TIME)
+        key = transcoder.chunk_key("test", 3, "256:144")
+        processor.s3_service.objects[key] = b'chunk'
+        message = make_message(json.dumps({"status": "ok", "index": 3, "keys": [key]}).encode())
+        message.correlation_id = 'expired'
+
+        asyncio.run(transcoder.on_chunk_done(message))
+
+        self.assertEqual(processor.s3_service.objects, {})
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_chunks_stitched_into_rendition(self):
+        """Тест: куски, разрезанные не по границе сегмента, склеиваются в рендишен с ровными сегментами"""
+        processor = make_processor()
+        transcoder = ChunkedTranscoder(processor, DISTRIBUTED_SETTINGS, HLS_SEGMENT_TIME)
+        resolutions = ["256:144", "426:240"]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor.s3_service = LocalDirS3Service(os.path.join(temp_dir, 'bucket'))
+            make_test_video(processor.s3_service._path('raw/source.mp4'), duration=12)
+            output_dir = os.path.join(temp_dir, 'hls')
+            os.makedirs(output_dir)
+
+            async def run():
+                for index, (start, end) in enumerate([(0.0, 6.5), (6.5, 12.0)]):
+                    await transcoder.encode_chunk({"uuid": "test", "video_path": "raw/source.mp4", "index": index,
+                                                   "start": start, "end": end, "resolutions": resolutions})
+                chunk_files = []
+                for index in range(2):
+                    chunk_files.append(os.path.join(temp_dir, f"{index}.mkv"))
+                    await processor.s3_service.download_file(
+                        transcoder.chunk_key("test", index, "426:240"), chunk_files[-1]
+                    )
+                await transcoder.stitch(chunk_files, None, "426:240", "test", output_dir)
+
+            asyncio.run(run())
+
+            with open(os.path.join(output_dir, '240p-test.m3u8')) as playlist:
+                content = playlist.read()
+            durations = [float(line[len('#EXTINF:'):].rstrip(',')) for line in content.splitlines()
+                         if line.startswith('#EXTINF:')]
+            self.assertAlmostEqual(sum(durations), 12.0, delta=0.2)
+            self.assertEqual([round(duration) for duration in durations], [5, 5, 2])
+
+
+class TestJobStatus(unittest.TestCase):
+    """Тесты прогресса FFmpeg и API статуса задач"""
+
+    def test_progress_block_parsed(self):
+        """Тест: блок -progress обновляет секунды, скорость, fps и скорость на ядро"""
+        progress = JobState(uuid='test').start_encode('1920:1080', threads=4)
+        progress.update({'fps': '48.5', 'out_time_us': '12500000', 'speed': '2.4x', 'progress': 'continue'})
+
+        self.assertEqual((progress.encoded_seconds, progress.speed, progress.fps), (12.5, 2.4, 48.5))
+        self.assertEqual(progress.speed_per_core, 0.6)
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+    def test_encode_progress_recorded_for_current_job(self):
+        """Тест: запуск FFmpeg в контексте задачи записывает ее прогресс"""
+        processor = make_processor()
+        job = processor.job_registry.start('test', 'raw/source.mp4')
+
+        async def run(input_file: str, output_dir: str):
+            current_job.set(job)
+            await processor.convert_to_hls(input_file, 'test', '256:144', output_dir, threads=1)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'source.mp4')
+            make_test_video(input_file)
+            asyncio.run(run(input_file, temp_dir))
+
+        [encode] = job.encodes
+        self.assertEqual((encode.label, encode.status, encode.threads), ('256:144', 'done', 1))
+        self.assertAlmostEqual(encode.encoded_seconds, 6.0, delta=0.2)
+        self.assertIsNotNone(encode.speed)
+
+    def test_jobs_endpoints(self):
+        """Тест: список задач, детальное состояние куска и 404 для неизвестной задачи"""
+        job_registry = JobRegistry(history_size=1)
+        app.state.job_registry = job_registry
+        for uuid in ('old', 'done'):
+            job_registry.finish(job_registry.start(uuid), success=True)
+        chunk = job_registry.start('running/chunk-3', kind='chunk')
+        chunk.set_stage('encoding')
+        chunk.start_encode('chunk 3', threads=2)
+        client = TestClient(app)
+
+        jobs = client.get('/jobs').json()['jobs']
+        self.assertEqual([(job['uuid'], job['stage']) for job in jobs], [('running/chunk-3', 'encoding'), ('done', 'done')])
+        self.assertEqual(jobs[0]['running_encodes'], ['chunk 3'])
+
+        detail = client.get('/jobs/running/chunk-3').json()['job']
+        self.assertEqual(detail['encodes'][0]['label'], 'chunk 3')
+        self.assertEqual(client.get('/jobs/unknown').status_code, 404)
+
+
+
+class FakeWorkerProcess:
+    """Процесс-потребитель, который завершается по команде теста"""
+
+    def __init__(self):
+        self.pid = 1000
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.exitcode is None
+
+
+class TestWorkerSupervisor(unittest.TestCase):
+    """Тесты супервизора процессов-потребителей"""
+
+    def make_supervisor(self):
+        config = SUPERVISOR_SETTINGS.model_copy(update={
+            'workers': 2, 'restart_delay': 1.0, 'max_restart_delay': 3.0, 'stable_after': 60.0
+        })
+        supervisor = WorkerSupervisor(config)
+        supervisor._status_queue = queue.Queue()
+        supervisor.spawned = []
+
+        def spawn(slot):
+            slot.process = FakeWorkerProcess()
+            slot.started_at = time.monotonic()
+            supervisor.spawned.append(slot.index)
+
+        supervisor._spawn = spawn
+        for slot in supervisor._slots:
+            spawn(slot)
+        return supervisor
+
+    def test_crashed_worker_restarted_with_backoff(self):
+        """Тест: упавший процесс перезапускается после задержки, быстрые падения удваивают ее до предела"""
+        supervisor = self.make_supervisor()
+        slot = supervisor._slots[0]
+        delays = []
+        for _ in range(3):
+            slot.process.exitcode = 1
+            supervisor.check_workers()
+            self.assertIsNone(slot.process)
+            delays.append(round(slot.restart_at - time.monotonic()))
+            supervisor.check_workers()
+            self.assertIsNone(slot.process)
+            slot.restart_at = 0
+            supervisor.check_workers()
+            self.assertIsNotNone(slot.process)
+
+        self.assertEqual(delays, [1, 2, 3])
+        self.assertEqual(supervisor.spawned, [0, 1, 0, 0, 0])
+
+    def test_jobs_collected_from_workers(self):
+        """Тест: задачи всех процессов видны в реестре, задачи упавшего процесса убираются"""
+        supervisor = self.make_supervisor()
+        supervisor._status_queue.put((0, [JobState(uuid='first', started_at=1).model_dump()]))
+        supervisor._status_queue.put((1, [JobState(uuid='second', started_at=2, stage='encoding').model_dump()]))
+        supervisor.collect_status()
+
+        self.assertEqual([job.uuid for job in supervisor.jobs.list()], ['second', 'first'])
+        self.assertEqual(supervisor.jobs.get('second').stage, 'encoding')
+
+        supervisor._slots[1].process.exitcode = -9
+        supervisor.check_workers()
+        self.assertEqual([job.uuid for job in supervisor.jobs.list()], ['first'])
+        self.assertIsNone(supervisor.jobs.get('second'))
+
+
+def mp4_box(box_type: bytes, payload_size: int = 8) -> bytes:
+    """Верхнеуровневый атом MP4 с пустым содержимым"""
+    return (8 + payload_size).to_bytes(4, 'big') + box_type + bytes(payload_size)
+
+
+class TestMetrics(unittest.TestCase):
+    """Тесты метрик Prometheus"""
+
+    def test_failed_job_counted_with_stage(self):
+        """Тест: упавшая задача учитывается с этапом падения, ожидание в очереди - по published_at"""
+        processor = make_processor()
+        processor.s3_service = FakeS3Service()
+        processor.retry.channel = FakeChannel()
+
+        async def process_video(data: dict, checkpoint: JobCheckpoint) -> bool:
+            current_job.get().set_stage('probing')
+            return False
+
+        message = make_message(
+            json.dumps({'video_path': 'raw/source.mp4', 'uuid': 'test', 'published_at': time.time() - 30}).encode()
+        )
+        failures = JOBS.labels('failure', 'probing')
+        failures_before = failures._value.get()
+        waits_before = QUEUE_WAIT_SECONDS._sum.get()
+
+        with patch.object(processor, 'process_video', process_video), patch.object(JobLease, 'SETTLE_DELAY', 0):
+            asyncio.run(processor.process_message(message))
+
+        message.ack.assert_awaited_once()
+        self.assertEqual(processor.retry.channel.published[0][0], 'convert_video_to_hls.retry.30s')
+        self.assertEqual(failures._value.get(), failures_before + 1)
+        self.assertGreaterEqual(QUEUE_WAIT_SECONDS._sum.get() - waits_before, 30)
+
+    def test_metrics_endpoint(self):
+        """Тест: /metrics отдает метрики в текстовом формате Prometheus"""
+        response = TestClient(app).get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('text/plain'))
+        self.assertIn('video_postprocess_jobs_total', response.text)
+        self.assertIn('video_postprocess_encode_seconds', response.text)
+
+
+class FakeRangeS3Service:
+    """Заглушка S3Service, отдающая диапазоны байт из памяти"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def get_file_size(self, s3_path: str) -> int:
+        return len(self.data)
+
+    async def read_range(self, s3_path: str, offset: int, length: int) -> bytes:
+        return self.data[offset:offset + length]
+
+
+class TestSourceStreaming(unittest.TestCase):
+    """Тесты определения потоковости исходника"""
+
+    def setUp(self):
+        """Настройка перед каждым тестом"""
+        self.processor = make_processor()
+
+    def check(self, data: bytes) -> bool:
+        self.processor.s3_service = FakeRangeS3Service(data)
+        return asyncio.run(self.processor.source_is_streamable('video.mp4'))
+
+    def test_faststart_mp4_is_streamable(self):
+        """Тест: moov перед mdat — исходник можно читать по ссылке"""
+        self.assertTrue(self.check(mp4_box(b'ftyp') + mp4_box(b'moov', 100) + mp4_box(b'mdat', 1000)))
+
+    def test_moov_at_end_is_not_streamable(self):
+        """Тест: moov после mdat — исходник нужно скачать"""
+        self.assertFalse(self.check(mp4_box(b'ftyp') + mp4_box(b'free') + mp4_box(b'mdat', 1000) + mp4_box(b'moov')))
+
+    def test_non_mp4_is_streamable(self):
+        """Тест: не-MP4 контейнер (например, Matroska) считается потоковым"""
+        self.assertTrue(self.check(b'\x1a\x45\xdf\xa3' + bytes(100)))
+
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+    # Интеграционные тесты S3 (скачивание, дедупликация, отложенные ступени) не должны пропадать незаметно
+    warnings.warn('moto[server] is not installed: TestS3Service is skipped, install requirements-test.txt',
+                  stacklevel=1)
+
+
+@unittest.skipUnless(ThreadedMotoServer, 'moto[server] is not installed (pip install -r requirements-test.txt)')
+class TestS3Service(unittest.TestCase):
+    """Тесты асинхронного S3Service на локальном moto-сервере"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadedMotoServer(port=5123, verbose=False)
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def make_config(self):
+        return MINIO_SETTINGS.model_copy(update={
+            'endpoint': 'http://127.0.0.1:5123',
+            'multipart_threshold': 5 * 1024 * 1024,
+            'multipart_chunksize': 5 * 1024 * 1024,
+        })
+
+    def test_multipart_upload_download_and_delete(self):
+        """Тест: большой файл загружается частями, скачивается обратно и удаляется пакетом"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, 'source.bin')
+            payload = os.urandom(12 * 1024 * 1024)
+            with open(source, 'wb') as source_file:
+                source_file.write(payload)
+            small = os.path.join(temp_dir, 'small.ts')
+            with open(small, 'wb') as small_file:
+                small_file.write(b'segment')
+
+            async def run():
+                s3_service = S3Service(self.make_config())
+                await s3_service.connect()
+                try:
+                    await s3_service.upload_files([(source, 'test/source.bin'), (small, 'test/small.ts')])
+                    self.assertEqual(await s3_service.get_file_size('test/source.bin'), len(payload))
+                    downloaded = os.path.join(temp_dir, 'downloaded.bin')
+                    await s3_service.download_file('test/source.bin', downloaded)
+                    with open(downloaded, 'rb') as downloaded_file:
+                        self.assertEqual(downloaded_file.read(), payload)
+                    await s3_service.delete_files(['test/source.bin', 'test/small.ts'])
+                    return s3_service.metrics.snapshot()
+                finally:
+                    await s3_service.close()
+
+            metrics = asyncio.run(run())
+            self.assertEqual(metrics['upload']['count'], 2)
+            self.assertEqual(metrics['upload']['bytes'], len(payload) + len(b'segment'))
+            self.assertEqual(metrics['download']['bytes'], len(payload))
+
+    def test_small_file_download_streams_and_hashes(self):
+        """Тест: файл меньше порога multipart скачивается одним потоком, хеш считается по ходу"""
+        payload = os.urandom(64 * 1024)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            downloaded = os.path.join(temp_dir, 'downloaded.bin')
+
+            async def run():
+                s3_service = S3Service(self.make_config())
+                await s3_service.connect()
+                try:
+                    await s3_service.upload_bytes(payload, 'test/small.bin')
+                    digest = hashlib.sha256()
+                    await s3_service.download_file('test/small.bin', downloaded, digest)
+                    return digest.hexdigest(), s3_service.metrics.snapshot()
+                finally:
+                    await s3_service.close()
+
+            source_hash, metrics = asyncio.run(run())
+            with open(downloaded, 'rb') as downloaded_file:
+                self.assertEqual(downloaded_file.read(), payload)
+        self.assertEqual(source_hash, hashlib.sha256(payload).hexdigest())
+        self.assertNotIn('read_range', metrics)
+
+    def test_cache_control_by_object_type(self):
+        """Тест: сегменты (в т.ч. multipart) неизменяемы, плейлисты с коротким TTL, служебные файлы без кеша"""
+        config = self.make_config()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            large = os.path.join(temp_dir, 'large.mp4')
+            with open(large, 'wb') as large_file:
+                large_file.write(bytes(6 * 1024 * 1024))
+
+            async def run():
+                s3_service = S3Service(config)
+                await s3_service.connect()
+                try:
+                    await s3_service.upload_file(large, 'video_files/test/720p-test.mp4')
+                    for key in ('video_files/test/720p-test0.ts', 'video_files/test/master.m3u8',
+                                'jobs/test/manifest.json'):
+                        await s3_service.upload_bytes(b'data', key)
+                    return {
+                        key: (await s3_service.client.head_object(Bucket=config.bucket, Key=key)).get('CacheControl')
+                        for key in ('video_files/test/720p-test.mp4', 'video_files/test/720p-test0.ts',
+                                    'video_files/test/master.m3u8', 'jobs/test/manifest.json')
+                    }
+                finally:
+                    await s3_service.close()
+
+            cache_control = asyncio.run(run())
+        self.assertEqual(cache_control, {
+            'video_files/test/720p-test.mp4': config.segment_cache_control,
+            'video_files/test/720p-test0.ts': config.segment_cache_control,
+            'video_files/test/master.m3u8': config.playlist_cache_control,
+            'jobs/test/manifest.json': None,
+        })
+
+    def test_duplicate_source_copies_existing_output(self):
+        """Тест: повторно загруженный исходник не кодируется, HLS копируется с сохранением метаданных"""
+        config = self.make_config()
+        processor = make_processor()
+        processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={'dedup_enabled': True})
+        payload = os.urandom(1024)
+        encoded = []
+        confirmation = AsyncMock()
+
+        async def run():
+            processor.s3_service = S3Service(config)
+            await processor.s3_service.connect()
+            try:
+                for video_uuid in ('dedup-first', 'dedup-second'):
+                    await processor.s3_service.upload_bytes(payload, f'raw/{video_uuid}.mp4')
+                    self.assertTrue(await processor.process_video({
+                        'video_path': f'raw/{video_uuid}.mp4', 'uuid': video_uuid
+                    }))
+                client = processor.s3_service.client
+                copied = {
+                    key: (await client.head_object(Bucket=config.bucket, Key=key))['CacheControl']
+                    for key, _ in await processor.s3_service.list_files('video_files/dedup-second/')
+                }
+                sources = await processor.s3_service.list_files('raw/dedup-')
+                return copied, sources
+            finally:
+                await processor.s3_service.close()
+
+        with patch.object(processor, 'get_media_info', AsyncMock(return_value=MediaInfo(
+                    width=256, height=144, duration=5.0, has_audio=False
+                ))), \
+                patch.object(processor, 'convert_to_hls', make_fake_convert_to_hls(processor, encoded)), \
+                patch.object(processor, 'send_confirmation', confirmation):
+            copied, sources = asyncio.run(run())
+
+        self.assertEqual(encoded, [('dedup-first', '256:144')])
+        self.assertEqual(copied, {
+            'video_files/dedup-second/144p-dedup-first0.ts': config.segment_cache_control,
+            'video_files/dedup-second/144p-dedup-first.m3u8': config.playlist_cache_control,
+            'video_files/dedup-second/master.m3u8': config.playlist_cache_control,
+        })
+        self.assertEqual(confirmation.await_args.args[:2], ('dedup-second', 'complete'))
+        self.assertEqual(confirmation.await_args.args[2].duration, 5.0)
+        self.assertEqual(sources, [])
+
+    def test_duplicate_of_deleted_video_encoded(self):
+        """Тест: запись индекса удаленного видео удаляется, повторный исходник кодируется заново"""
+        config = self.make_config()
+        processor = make_processor()
+        processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={'dedup_enabled': True})
+        payload = os.urandom(1024)
+        source_hash = hashlib.sha256(payload).hexdigest()
+        encoded = []
+
+        async def run():
+            processor.s3_service = S3Service(config)
+            await processor.s3_service.connect()
+            try:
+                await processor.s3_service.upload_bytes(payload, 'raw/stale-first.mp4')
+                self.assertTrue(await processor.process_video({'video_path': 'raw/stale-first.mp4',
+                                                               'uuid': 'stale-first'}))
+                deleted = await processor.s3_service.list_files('video_files/stale-first/')
+                await processor.s3_service.delete_files([key for key, _ in deleted])
+
+                await processor.s3_service.upload_bytes(payload, 'raw/stale-second.mp4')
+                self.assertTrue(await processor.process_video({'video_path': 'raw/stale-second.mp4',
+                                                               'uuid': 'stale-second'}))
+                return await SourceIndex(processor.s3_service).lookup(source_hash)
+            finally:
+                await processor.s3_service.close()
+
+        with patch.object(processor, 'get_media_info', AsyncMock(return_value=MediaInfo(
+                    width=256, height=144, duration=5.0, has_audio=False
+                ))), \
+                patch.object(processor, 'convert_to_hls', make_fake_convert_to_hls(processor, encoded)), \
+                patch.object(processor, 'send_confirmation', AsyncMock()):
+            entry = asyncio.run(run())
+
+        self.assertEqual(encoded, [('stale-first', '256:144'), ('stale-second', '256:144')])
+        self.assertEqual(entry.uuid, 'stale-second')
+
+    def test_deferred_rendition_encoded_on_first_request(self):
+        """Тест: высокая ступень отдается плейлистом меньшей до первого запроса, затем кодируется один раз"""
+        config = self.make_config()
+        processor = make_processor()
+        processor.transcode_config = TRANSCODE_SETTINGS.model_copy(update={
+            'jit_enabled': True, 'jit_min_height': 720, 'dedup_enabled': False, 'progressive_publishing': False
+        })
+        encoded = []
+        channel = SimpleNamespace(default_exchange=SimpleNamespace(publish=AsyncMock()))
+
+        async def read(key):
+            return (await processor.s3_service.get_bytes(key)).decode()
+
+        async def run():
+            processor.s3_service = S3Service(config)
+            await processor.s3_service.connect()
+            try:
+                await processor.s3_service.upload_bytes(b'source', 'raw/jit.mp4')
+                self.assertTrue(await processor.process_video({'video_path': 'raw/jit.mp4', 'uuid': 'jit'}))
+                fallback = await read('video_files/jit/720p-jit.m3u8')
+                master = await read('video_files/jit/master.m3u8')
+
+                demand = RenditionDemand(processor.s3_service, channel, processor.transcode_config, lease_ttl=1.0)
+                statuses = await asyncio.gather(*(
+                    demand.request('jit', name) for name in ('720p-jit.m3u8', '720p-jit.m3u8', '480p-jit.m3u8')
+                ))
+                message = channel.default_exchange.publish.await_args.args[0]
+                self.assertTrue(await processor.process_deferred('jit', json.loads(message.body)['rendition']))
+                return (fallback, master, statuses, await read('video_files/jit/720p-jit.m3u8'),
+                        await processor.s3_service.list_files('raw/jit'),
+                        await processor.s3_service.get_bytes(DeferredRenditions.key('jit')))
+            finally:
+                await processor.s3_service.close()
+
+        with patch.object(processor, 'get_media_info', AsyncMock(return_value=MediaInfo(
+                    width=1280, height=720, duration=5.0, has_audio=False
+                ))), \
+                patch.object(processor, 'convert_to_hls', make_fake_convert_to_hls(processor, encoded)), \
+                patch.object(processor, 'send_confirmation', AsyncMock()):
+            # Одновременные запросы разрешает аренда: без паузы SETTLE_DELAY ее могут получить оба
+            fallback, master, statuses, playlist, sources, deferred = asyncio.run(run())
+
+        self.assertEqual([resolution for _, resolution in encoded],
+                         ['256:144', '854:480', '640:360', '426:240', '1280:720'])
+        self.assertIn('480p-jit0.ts', fallback)
+        self.assertIn('RESOLUTION=1280x720', master)
+        self.assertEqual(sorted(statuses), ['pending', 'queued', 'ready'])
+        self.assertEqual(channel.default_exchange.publish.await_count, 1)
+        self.assertIn('720p-jit0.ts', playlist)
+        self.assertEqual(sources, [])
+        self.assertIsNone(deferred)
+
+    def test_get_bytes_missing_object(self):
+        """Тест: get_bytes возвращает содержимое объекта или None, если объекта нет"""
+        async def run():
+            s3_service = S3Service(self.make_config())
+            await s3_service.connect()
+            try:
+                await s3_service.upload_bytes(b'{}', 'jobs/test/media_info.json')
+                return (await s3_service.get_bytes('jobs/test/media_info.json'),
+                        await s3_service.get_bytes('jobs/missing/media_info.json'))
+            finally:
+                await s3_service.close()
+
+        self.assertEqual(asyncio.run(run()), (b'{}', None))
+
+
+if __name__ == '__main__':
+    unittest.main()